@@ -0,0 +1,51 @@
+"""
+Compare the parsimonious `grammar` with the hand-written parser on long and deeply nested filters.
+
+    python -m OdataTest.bench_filter_parser [--number N]
+"""
+import argparse
+import sys
+import timeit
+from OdataTest.odata_param_parser import grammar
+from OdataTest.odata_filter_parser import parse
+
+
+def or_chain(terms):
+    return " or ".join("Id eq {}".format(i) for i in range(terms))
+
+
+def nested_parens(depth):
+    return "(" * depth + "Name eq 'John'" + " and Age gt 65)" * depth
+
+
+def nested_concat(depth):
+    expr = "City"
+    for i in range(depth):
+        expr = "concat({}, 'part{}')".format(expr, i)
+    return expr + " eq 'Berlin'"
+
+
+CASES = [
+    ("simple", "Name eq 'John' and (Age gt 65 or Age lt 11)"),
+    ("or_chain_50", or_chain(50)),
+    ("or_chain_500", or_chain(500)),
+    ("nested_parens_30", nested_parens(30)),
+    ("nested_concat_20", nested_concat(20)),
+]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--number", type=int, default=20)
+    args = arg_parser.parse_args(argv)
+    # the grammar recurses several frames per nesting level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    print("{:<20}{:>14}{:>14}{:>10}".format("case", "grammar ms", "parser ms", "speedup"))
+    for name, filter_text in CASES:
+        peg = min(timeit.repeat(lambda: grammar.parse(filter_text), number=args.number, repeat=3)) / args.number
+        hand = min(timeit.repeat(lambda: parse(filter_text), number=args.number, repeat=3)) / args.number
+        print("{:<20}{:>14.3f}{:>14.3f}{:>9.1f}x".format(name, peg * 1000, hand * 1000, peg / hand))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Import-time benchmark guarding worker cold start.
+
+Every module is imported in a fresh interpreter under `python -X importtime`; the
+fastest of --repeat runs is kept. Reports the cumulative import time, the time spent
+in this package's own modules and the largest direct imports, plus the time a fresh
+process takes to build the $filter grammar and parse a first filter:
+
+    python -m OdataTest.bench_import --output import.json
+    python -m OdataTest.bench_import --baseline import.json --threshold 0.25
+
+With --baseline the run exits with status 1 when a measure got slower than the
+baseline by more than the threshold (a fraction of the baseline time).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+MODULES = ['OdataTest.odata_param_parser', 'OdataTest.odata_filter_parser', 'OdataTest.odata_count']
+PACKAGE = 'OdataTest'
+FIRST_PARSE = """
+import time
+start = time.perf_counter()
+from OdataTest import odata_grammar
+grammar = odata_grammar.get_grammar()
+grammar.parse("Name eq 'x' and Price lt 10")
+print(time.perf_counter() - start, odata_grammar.load_prebuilt() is not None)
+"""
+
+
+def root():
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root(), os.environ.get('PYTHONPATH')])))
+    # bytecode is written by a first run, so every sample compares warm caches
+    return subprocess.run([sys.executable] + args, capture_output=True, text=True, check=True, cwd=root(), env=env)
+
+
+def parse_importtime(stderr):
+    """Returns [(name, depth, self_us, cumulative_us)] from `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_module(module, repeat):
+    best = None
+    for _ in range(repeat + 1):
+        rows = parse_importtime(run_python(['-X', 'importtime', '-c', 'import ' + module]).stderr)
+        total = next(r[3] for r in rows if r[0] == module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    own = sum(r[2] for r in rows if r[0] == PACKAGE or r[0].startswith(PACKAGE + '.'))
+    module_depth = next(r[1] for r in rows if r[0] == module)
+    children = sorted((r for r in rows if r[1] == module_depth + 1), key=lambda r: -r[3])
+    return {
+        "cumulative": total / 1e6,
+        "own": own / 1e6,
+        "largest": [{"module": r[0], "cumulative": r[3] / 1e6} for r in children[:5]],
+    }
+
+
+def measure_first_parse(repeat):
+    samples = []
+    prebuilt = False
+    for _ in range(repeat + 1):
+        seconds, prebuilt = run_python(['-c', FIRST_PARSE]).stdout.split()
+        samples.append(float(seconds))
+    return {"seconds": min(samples), "prebuilt": prebuilt == 'True'}
+
+
+def run(repeat):
+    results = {module: measure_module(module, repeat) for module in MODULES}
+    results["first_parse"] = measure_first_parse(repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for case, measures in results.items():
+        for measure in ("cumulative", "own", "seconds"):
+            before = baseline.get(case, {}).get(measure)
+            current = measures.get(measure)
+            if not before or current is None:
+                continue
+            change = (current - before) / before
+            if change > threshold:
+                regressions.append({"case": case, "measure": measure, "baseline": before, "current": current,
+                                    "change": change})
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measure, the fastest is kept")
+    arg_parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    arg_parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    arg_parser.add_argument("--threshold", type=float, default=0.25)
+    args = arg_parser.parse_args(argv)
+    report = {
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": run(args.repeat),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report["results"], baseline["results"], args.threshold)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    for regression in report.get("regressions", []):
+        sys.stderr.write("regression: {case} [{measure}] {baseline:.6f}s -> {current:.6f}s (+{change:.0%})\n".format(
+            **regression))
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
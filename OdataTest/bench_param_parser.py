@@ -0,0 +1,263 @@
+"""
+Benchmark suite timing the parse, translate and SQL compile phases separately.
+
+Reuses the FILTER_TESTS, ORDER_TESTS, SELECT_TEST and TOP_SKIP_TESTS corpora plus
+synthetic stress inputs and writes machine-readable JSON results:
+
+    python -m OdataTest.bench_param_parser --output bench.json
+    python -m OdataTest.bench_param_parser --baseline bench.json --threshold 0.25
+
+With --baseline the run exits with status 1 when any phase got slower than the
+baseline by more than the threshold (a fraction of the baseline time). The cases
+without a compile timing, like bare expressions that aren't conditions, are listed
+under "skipped" with the reason.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        INSTALLED_APPS=[],
+        USE_TZ=True,
+    )
+    django.setup()
+
+from django.apps import AppConfig
+from django.apps.registry import Apps
+from django.db import connection, models
+from django.db.models import functions
+from django.core.exceptions import FieldError
+from OdataTest.odata_param_parser import FilterProcessor, ODataException, apply_params, grammar
+from OdataTest.odata_filter_parser import parse
+from OdataTest.bench_filter_parser import or_chain, nested_parens, nested_concat
+from OdataTest.tests_param_parser import FILTER_TESTS, ORDER_TESTS, SELECT_TEST, TOP_SKIP_TESTS
+
+
+class BenchConfig(AppConfig):
+    name = "OdataTest"
+    label = "odata_bench"
+    path = os.path.dirname(__file__)
+
+
+# an own registry gives the bench models their reverse relations, see tests_support
+bench_apps = Apps([BenchConfig("OdataTest", sys.modules[__name__])])
+
+
+class Location(models.Model):
+    postal_code = models.CharField(max_length=10)
+    company = models.CharField(max_length=100)
+    City = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+class Customer(models.Model):
+    Name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+class Tag(models.Model):
+    Name = models.CharField(max_length=100)
+    Active = models.BooleanField()
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+class Person(models.Model):
+    foo = models.CharField(max_length=100)
+    Name = models.CharField(max_length=100)
+    LastName = models.CharField(max_length=100)
+    name = models.CharField(max_length=100)
+    Description = models.TextField()
+    CompanyName = models.CharField(max_length=100)
+    City = models.CharField(max_length=100)
+    Country = models.CharField(max_length=100)
+    Price = models.FloatField()
+    Freight = models.FloatField()
+    Rating = models.IntegerField()
+    Age = models.IntegerField()
+    Id = models.IntegerField()
+    start_date = models.DateField()
+    DateOfBirth = models.DateTimeField()
+    # the properties of the function corpus
+    field = models.CharField(max_length=100)
+    filed_A = models.CharField(max_length=100)
+    filed_B = models.CharField(max_length=100)
+    field_C = models.CharField(max_length=100)
+    value_B = models.CharField(max_length=100)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    Address = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    Customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="+")
+    Tags = models.ManyToManyField(Tag, related_name="people")
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+class Order(models.Model):
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="Orders")
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="Orders")
+    Amount = models.IntegerField()
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+class Line(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="Lines")
+    Price = models.FloatField()
+
+    class Meta:
+        app_label = "odata_bench"
+        apps = bench_apps
+
+
+# the transforms the lookup functions of the corpus (length, tolower, ceiling...) turn into,
+# registered on the bench fields only
+TRANSFORMS = {
+    models.CharField: [functions.Length, functions.Lower, functions.Upper, functions.Trim],
+    models.TextField: [functions.Length, functions.Lower, functions.Upper, functions.Trim],
+    models.FloatField: [functions.Ceil, functions.Floor, functions.Round, functions.Abs],
+}
+for bench_model in (Location, Customer, Tag, Person, Order, Line):
+    for bench_field in bench_model._meta.concrete_fields:
+        for transform in TRANSFORMS.get(type(bench_field), []):
+            bench_field.register_lookup(transform)
+
+
+STRESS_TESTS = [
+    ("or_chain_500", {"$filter": or_chain(500)}),
+    ("nested_parens_30", {"$filter": nested_parens(30)}),
+    ("nested_concat_20", {"$filter": nested_concat(20)}),
+    ("and_chain_100", {"$filter": " and ".join("Age ne {}".format(i) for i in range(100))}),
+    ("orderby_20", {"$orderby": ",".join("location/postal_code desc" for _ in range(20))}),
+]
+
+
+def cases():
+    for name, corpus in (("filter", FILTER_TESTS), ("order", ORDER_TESTS),
+                         ("select", SELECT_TEST), ("top_skip", TOP_SKIP_TESTS)):
+        for param_dict, _ in corpus:
+            yield "{}: {}".format(name, " ".join(param_dict.values())), param_dict
+    for name, param_dict in STRESS_TESTS:
+        yield "stress: {}".format(name), param_dict
+
+
+def translate(param_dict, tree=None):
+    processor = FilterProcessor()
+    rv = {}
+    if tree is not None:
+        rv.update(processor.bool_common_expr(tree))
+    if '$orderby' in param_dict:
+        rv.update(processor.order_by(param_dict['$orderby']))
+    if '$select' in param_dict:
+        rv.update(processor.select(param_dict['$select']))
+    if '$top' in param_dict or "$skip" in param_dict:
+        rv.update(processor.get_slice(param_dict))
+    return rv
+
+
+def compile_sql(params):
+    return apply_params(Person.objects.all(), params).query.get_compiler(connection=connection).as_sql()
+
+
+def measure(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def run(number, repeat):
+    """Returns the timings of every case, and why the SQL compile of the cases without one was skipped."""
+    results = {}
+    skipped = {}
+    for case, param_dict in cases():
+        timings = {}
+        tree = None
+        if '$filter' in param_dict:
+            filter_text = param_dict['$filter']
+            timings["parse"] = measure(lambda: grammar.parse(filter_text), number, repeat)
+            timings["parse_handwritten"] = measure(lambda: parse(filter_text), number, repeat)
+            tree = grammar.parse(filter_text)
+        timings["translate"] = measure(lambda: translate(param_dict, tree), number, repeat)
+        params = translate(param_dict, tree)
+        timings["compile"] = None
+        if not isinstance(params.get("filter", models.Q()), models.Q):
+            skipped[case] = "the filter is an expression, not a condition"
+        else:
+            try:
+                compile_sql(params)
+            except (FieldError, ODataException, ValueError) as e:
+                skipped[case] = str(e)
+            else:
+                timings["compile"] = measure(lambda: compile_sql(params), number, repeat)
+        results[case] = timings
+    return results, skipped
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for case, timings in results.items():
+        for phase, seconds in timings.items():
+            before = baseline.get(case, {}).get(phase)
+            if seconds is None or not before:
+                continue
+            change = (seconds - before) / before
+            if change > threshold:
+                regressions.append({"case": case, "phase": phase, "baseline": before, "current": seconds,
+                                    "change": change})
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--number", type=int, default=20, help="calls per timing sample")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="timing samples, the fastest is kept")
+    arg_parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    arg_parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    arg_parser.add_argument("--threshold", type=float, default=0.25)
+    args = arg_parser.parse_args(argv)
+    # both the grammar and the translation recurse once per nesting level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    results, skipped = run(args.number, args.repeat)
+    report = {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "number": args.number,
+        "repeat": args.repeat,
+        "results": results,
+        # the cases without a compile timing, with the reason
+        "skipped": skipped,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report["results"], baseline["results"], args.threshold)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    for regression in report.get("regressions", []):
+        sys.stderr.write("regression: {case} [{phase}] {baseline:.6f}s -> {current:.6f}s (+{change:.0%})\n".format(
+            **regression))
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Peak memory of serializing a result page materialized as a list versus streamed with stream_json.
+
+    python -m OdataTest.bench_streaming [--rows 10000 50000] [--chunk-size 2000]
+
+Prints JSON with the tracemalloc peak in bytes for every result size; the streamed
+peak should stay flat as the result grows while the materialized one grows with it.
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        INSTALLED_APPS=[],
+        USE_TZ=True,
+    )
+    django.setup()
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models
+from OdataTest.odata_param_parser import apply_params, django_params
+from OdataTest.odata_streaming import stream_json
+
+
+class Entry(models.Model):
+    name = models.CharField(max_length=100)
+    city = models.CharField(max_length=100)
+    amount = models.FloatField()
+    created = models.DateTimeField()
+
+    class Meta:
+        app_label = "odata_bench"
+
+
+def fill(rows):
+    Entry.objects.all().delete()
+    created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    Entry.objects.bulk_create(
+        (Entry(name="entry {}".format(i), city="city {}".format(i % 50), amount=i / 3, created=created)
+         for i in range(rows)),
+        batch_size=5000,
+    )
+
+
+def peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def materialized(params):
+    json.dumps({"value": list(apply_params(Entry.objects.all(), params))}, cls=DjangoJSONEncoder).encode()
+
+
+def streamed(params, chunk_size):
+    for _ in stream_json(Entry.objects.all(), params, chunk_size=chunk_size):
+        pass
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000])
+    arg_parser.add_argument("--chunk-size", type=int, default=2000)
+    args = arg_parser.parse_args(argv)
+    with connection.schema_editor() as editor:
+        editor.create_model(Entry)
+    params = django_params({"$select": "name,city,amount,created", "$filter": "amount ge 0"})
+    results = []
+    for rows in args.rows:
+        fill(rows)
+        results.append({
+            "rows": rows,
+            "materialized_peak": peak(lambda: materialized(params)),
+            "streamed_peak": peak(lambda: streamed(params, args.chunk_size)),
+        })
+    json.dump({"chunk_size": args.chunk_size, "results": results}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
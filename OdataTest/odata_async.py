@@ -0,0 +1,110 @@
+import asyncio
+import functools
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, models
+from OdataTest.odata_count import CountedPage, ExactCount, WindowCount, count_requested, filtered
+from OdataTest.odata_param_parser import apply_params, django_params
+from OdataTest.odata_streaming import json_head, json_tail, rows_queryset
+
+
+# QuerySet.acount and `async for` came with Django 4.1
+ASYNC_ORM = hasattr(models.QuerySet, 'acount')
+
+
+def run_sync(func, executor=None):
+    """
+    Wraps blocking ORM code into a coroutine function. Without `executor` it runs in
+    Django's thread sensitive executor, on the same connection as the async ORM. In a
+    thread pool `executor` every call gets the connection of its worker thread, so
+    calls really run in parallel.
+    """
+    if executor is None:
+        return sync_to_async(func)
+
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def run(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(call, *args, **kwargs))
+    return run
+
+
+async def afetch(queryset, params, executor=None) -> list:
+    """Applies the django_params result `params` to `queryset` and fetches the rows."""
+    queryset = apply_params(queryset, params)
+    if executor is None and ASYNC_ORM:
+        return [row async for row in queryset]
+    return await run_sync(list, executor)(queryset)
+
+
+async def acount(queryset, params, strategy=None, executor=None) -> int:
+    strategy = strategy or ExactCount()
+    if type(strategy) is ExactCount and executor is None and ASYNC_ORM:
+        return await filtered(queryset, params).acount()
+    return await run_sync(strategy.count, executor)(queryset, params)
+
+
+async def apaginate(queryset, param_dict, strategy=None, executor=None, **kwargs) -> CountedPage:
+    """
+    Async `paginate`: applies the OData params to `queryset` and, when $count or
+    $inlinecount asks for it, counts the matching rows. The default strategy is
+    ExactCount; WindowCount already gets both from one query and is run as it is.
+    Other kwargs go to django_params.
+
+    Without `executor`, the page and count queries both go through Django's single
+    thread sensitive executor and run one after the other, on one connection. With a
+    thread pool `executor` they run concurrently, each on its worker's connection,
+    which therefore doesn't see the uncommitted writes of the calling thread.
+    """
+    params = django_params(param_dict, **kwargs)
+    if not count_requested(param_dict):
+        return CountedPage(await afetch(queryset, params, executor), None)
+    strategy = strategy or ExactCount()
+    if isinstance(strategy, WindowCount):
+        return await run_sync(strategy.paginate, executor)(queryset, params)
+    if executor is None:
+        rows = await afetch(queryset, params)
+        return CountedPage(rows, await acount(queryset, params, strategy))
+    rows, count = await asyncio.gather(
+        afetch(queryset, params, executor),
+        acount(queryset, params, strategy, executor),
+    )
+    return CountedPage(rows, count)
+
+
+async def aiter_rows(queryset, params, chunk_size=2000):
+    """Async `iter_rows`: yields the selected rows as dicts, reading `chunk_size` rows per round trip."""
+    fields, queryset = rows_queryset(queryset, params)
+    # values_list querysets start executing when iterated, which aiterator() does in the
+    # event loop thread, so the chunks are pulled in the ORM thread explicitly instead
+    rows = iter(queryset.iterator(chunk_size=chunk_size))
+    fetch = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while True:
+        chunk = await fetch()
+        if not chunk:
+            break
+        for row in chunk:
+            yield dict(zip(fields, row))
+
+
+async def astream_json(queryset, params, chunk_size=2000, count=None, context=None, next_link=None):
+    """Async `stream_json`, for StreamingHttpResponse under ASGI."""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield json_head(encoder, count, context)
+    chunk = []
+    separator = ''
+    async for row in aiter_rows(queryset, params, chunk_size):
+        chunk.append(encoder.encode(row))
+        if len(chunk) >= chunk_size:
+            yield (separator + ','.join(chunk)).encode()
+            chunk = []
+            separator = ','
+    if chunk:
+        yield (separator + ','.join(chunk)).encode()
+    yield json_tail(encoder, next_link)
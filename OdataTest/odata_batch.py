@@ -0,0 +1,380 @@
+import json
+import re
+import uuid
+from collections import namedtuple
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, unquote, urlsplit
+from django.core.exceptions import FieldDoesNotExist, FieldError, ObjectDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections, transaction
+from parsimonious.exceptions import ParseError
+from OdataTest.odata_count import ExactCount, count_requested
+from OdataTest.odata_filter_cache import filter_cache
+from OdataTest.odata_param_parser import ODataException, FilterProcessor, django_params
+from OdataTest.odata_streaming import iter_rows
+
+
+BatchRequest = namedtuple('BatchRequest', ['id', 'method', 'url', 'headers', 'body', 'atomicity_group', 'depends_on'])
+BatchResponse = namedtuple('BatchResponse', ['id', 'status', 'body', 'atomicity_group'])
+
+RESOURCE_RE = re.compile(r"^(?P<name>\w+)(?:\((?P<key>[^)]*)\))?$")
+BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.I)
+ENCODER = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def parse_json_batch(data) -> list:
+    """Parses an OData JSON batch document, `{"requests": [...]}`, into BatchRequests."""
+    if isinstance(data, (bytes, str)):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise ODataException("invalid JSON batch document")
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        raise ODataException("a JSON batch needs a 'requests' list")
+    requests = []
+    for i, item in enumerate(data['requests']):
+        if not isinstance(item, dict) or 'method' not in item or 'url' not in item:
+            raise ODataException("batch request {} needs a method and a url".format(i))
+        requests.append(BatchRequest(
+            str(item.get('id', i)), item['method'].upper(), item['url'], item.get('headers', {}), item.get('body'),
+            item.get('atomicityGroup'), item.get('dependsOn', []),
+        ))
+    return requests
+
+
+def split_head(text):
+    """Splits headers from content at the first blank line."""
+    match = re.search(r'\r?\n\r?\n', text)
+    if match is None:
+        return text, ''
+    return text[:match.start()], text[match.end():]
+
+
+def split_multipart(body: str, boundary: str) -> list:
+    """Returns the (headers, content) of every part of a multipart body."""
+    parts = []
+    for chunk in re.split(r'--{}(?:--)?[ \t]*\r?\n?'.format(re.escape(boundary)), body)[1:]:
+        if not chunk.strip():
+            continue
+        head, content = split_head(chunk)
+        headers = {}
+        for line in head.splitlines():
+            name, _, value = line.partition(':')
+            if value:
+                headers[name.strip().lower()] = value.strip()
+        parts.append((headers, content.rstrip('\r\n')))
+    return parts
+
+
+def parse_http_request(text, request_id, atomicity_group=None) -> BatchRequest:
+    head, body = split_head(text.lstrip())
+    request_line, *header_lines = head.splitlines()
+    match = re.match(r'(\w+)\s+(\S+)', request_line)
+    if match is None:
+        raise ODataException("invalid batch request line '{}'".format(request_line))
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = body.strip()
+    if body:
+        try:
+            body = json.loads(body)
+        except ValueError:
+            raise ODataException("batch request {} has an invalid JSON body".format(request_id))
+    return BatchRequest(request_id, match.group(1).upper(), match.group(2), headers, body or None, atomicity_group, [])
+
+
+def parse_multipart_batch(body, content_type) -> list:
+    """Parses a multipart/mixed OData batch; every change set becomes one atomicity group."""
+    if isinstance(body, bytes):
+        body = body.decode()
+    match = BOUNDARY_RE.search(content_type)
+    if match is None:
+        raise ODataException("multipart batch without boundary")
+    requests = []
+    for headers, content in split_multipart(body, match.group(1)):
+        changeset = BOUNDARY_RE.search(headers.get('content-type', ''))
+        if changeset is not None:
+            for change_headers, change in split_multipart(content, changeset.group(1)):
+                request_id = change_headers.get('content-id', str(len(requests)))
+                requests.append(parse_http_request(change, request_id, changeset.group(1)))
+        else:
+            requests.append(parse_http_request(content, headers.get('content-id', str(len(requests)))))
+    return requests
+
+
+class BatchProcessor:
+    """
+    Runs OData $batch requests against `entity_sets`, a dict of entity set names to
+    models or querysets. The params of every GET are compiled through `django_params`,
+    all sharing `cache`. Consecutive independent GETs (no atomicity group, no dependsOn)
+    run in parallel on a pool of `max_workers` threads, each with its own database
+    connection, unless the batch runs inside a transaction (ATOMIC_REQUESTS or an
+    `atomic` block), which only the calling thread's connection sees. Everything else
+    runs in request order in the calling thread, every atomicity group (change set) in
+    one transaction. Responses are yielded as they complete, so they can be streamed.
+
+    Writes are POST to an entity set, and PATCH/PUT/DELETE to `Set(key)`, setting the
+    editable fields other than the primary key; override `write` for anything else.
+    """
+
+    def __init__(self, entity_sets, max_workers=4, processor=None, cache=filter_cache, base_path=''):
+        self.entity_sets = entity_sets
+        self.max_workers = max_workers
+        self.processor = processor or FilterProcessor()
+        self.cache = cache
+        self.base_path = base_path.strip('/')
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='odata-batch')
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def parse(self, body, content_type) -> list:
+        if content_type.split(';')[0].strip().lower() == 'application/json':
+            return parse_json_batch(body)
+        return parse_multipart_batch(body, content_type)
+
+    def resolve(self, url):
+        """Returns (model, queryset, key, param_dict) of a sub-request url."""
+        parts = urlsplit(url)
+        path = unquote(parts.path).strip('/')
+        if self.base_path and path.startswith(self.base_path):
+            path = path[len(self.base_path):].strip('/')
+        match = RESOURCE_RE.match(path)
+        if match is None or match.group('name') not in self.entity_sets:
+            raise ObjectDoesNotExist("unknown resource '{}'".format(path))
+        source = self.entity_sets[match.group('name')]
+        queryset = source._default_manager.all() if isinstance(source, type) else source.all()
+        key = match.group('key')
+        if key is not None:
+            key = key.strip("'") if key.startswith("'") else int(key)
+        return queryset.model, queryset, key, dict(parse_qsl(parts.query, keep_blank_values=True))
+
+    def compile(self, request):
+        """Resolves a GET and translates its OData params; returns (queryset, key, param_dict, params)."""
+        model, queryset, key, param_dict = self.resolve(request.url)
+        return queryset, key, param_dict, django_params(param_dict, cache=self.cache, processor=self.processor,
+                                                        model=model)
+
+    def read(self, request, compiled):
+        queryset, key, param_dict, params = compiled
+        if key is not None:
+            queryset = queryset.filter(pk=key)
+        rows = list(iter_rows(queryset, params))
+        if key is not None:
+            if not rows:
+                raise ObjectDoesNotExist("no entity with key {}".format(key))
+            return BatchResponse(request.id, 200, rows[0], request.atomicity_group)
+        body = {"value": rows}
+        if count_requested(param_dict):
+            body = {"@odata.count": ExactCount().count(queryset, params), "value": rows}
+        return BatchResponse(request.id, 200, body, request.atomicity_group)
+
+    @staticmethod
+    def writable_values(model, body):
+        """Returns (field, value) pairs of a write body; only editable fields other than the key can be set."""
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            raise ODataException("the body of a write must be a JSON object")
+        fields = {}
+        for field in model._meta.concrete_fields:
+            if field.editable and not field.primary_key:
+                fields[field.name] = fields[field.attname] = field
+        unknown = [name for name in body if name not in fields]
+        if unknown:
+            raise ODataException("'{}' can't set {}".format(model.__name__, ', '.join(map(repr, unknown))))
+        return [(fields[name], value) for name, value in body.items()]
+
+    def write(self, request):
+        model, queryset, key, _ = self.resolve(request.url)
+        if request.method == 'POST' and key is None:
+            instance = model()
+            for field, value in self.writable_values(model, request.body):
+                setattr(instance, field.attname, value)
+            instance.full_clean()
+            instance.save()
+            return BatchResponse(request.id, 201, {f.attname: getattr(instance, f.attname)
+                                                   for f in model._meta.concrete_fields}, request.atomicity_group)
+        if request.method in ('PATCH', 'PUT', 'DELETE') and key is not None:
+            instance = queryset.get(pk=key)
+            if request.method == 'DELETE':
+                instance.delete()
+            else:
+                values = self.writable_values(model, request.body)
+                for field, value in values:
+                    setattr(instance, field.attname, value)
+                exclude = None
+                if request.method == 'PATCH':
+                    # a partial update only validates the fields it sets
+                    fields = [field for field, _ in values]
+                    exclude = [f.name for f in model._meta.concrete_fields if f not in fields]
+                instance.full_clean(exclude=exclude)
+                instance.save()
+            return BatchResponse(request.id, 204, None, request.atomicity_group)
+        return BatchResponse(request.id, 405, self.error("method {} not allowed on '{}'".format(
+            request.method, request.url)), request.atomicity_group)
+
+    @staticmethod
+    def error(message):
+        return {"error": {"message": str(message)}}
+
+    def failure(self, request, exc):
+        if isinstance(exc, ObjectDoesNotExist):
+            status = 404
+        elif isinstance(exc, (ODataException, ParseError, FieldError, FieldDoesNotExist, ValidationError, ValueError,
+                              TypeError, LookupError)):
+            status = 400
+        else:
+            status = 500
+        return BatchResponse(request.id, status, self.error(exc), request.atomicity_group)
+
+    def run(self, request, compiled=None):
+        try:
+            if request.method == 'GET':
+                return self.read(request, compiled or self.compile(request))
+            return self.write(request)
+        except Exception as exc:
+            return self.failure(request, exc)
+
+    def run_parallel(self, request, compiled):
+        try:
+            return self.run(request, compiled)
+        finally:
+            close_old_connections()
+
+    def dependency_failure(self, request, failed):
+        """The 424 response of a request depending on a failed request or change set, None when it can run."""
+        for dependency in request.depends_on:
+            if dependency in failed:
+                return BatchResponse(request.id, 424, self.error("request {} failed".format(dependency)),
+                                     request.atomicity_group)
+        return None
+
+    def run_group(self, group, failed=()):
+        responses = []
+        try:
+            with transaction.atomic():
+                for request in group:
+                    response = self.dependency_failure(request, failed) or self.run(request)
+                    if response.status >= 400:
+                        raise ODataException(response)
+                    responses.append(response)
+        except ODataException as exc:
+            # the whole change set is rolled back: only the failing request reports its
+            # error, every other request of the group fails with it
+            failed = exc.args[0]
+            return [failed if r.id == failed.id else
+                    BatchResponse(r.id, 424, self.error("change set failed"), r.atomicity_group) for r in group]
+        return responses
+
+    def execute(self, requests):
+        """
+        Yields the BatchResponses in completion order. A run of independent GETs runs in
+        parallel; any other request waits for the requests before it and the requests
+        after it wait for it, so every request sees the changes made before it. A request
+        depending on a failed request or change set fails with 424 without running.
+        """
+        failed = set()
+        pending = set()
+
+        def done(response):
+            if response.status >= 400:
+                failed.add(response.id)
+                if response.atomicity_group:
+                    failed.add(response.atomicity_group)
+            return response
+
+        i = 0
+        while i < len(requests):
+            request = requests[i]
+            if request.method == 'GET' and not request.atomicity_group and not request.depends_on:
+                i += 1
+                try:
+                    compiled = self.compile(request)
+                except Exception as exc:
+                    yield done(self.failure(request, exc))
+                    continue
+                if connections[compiled[0].db].in_atomic_block:
+                    # the pool's connections can't see the writes of the caller's open transaction
+                    yield done(self.run(request, compiled))
+                    continue
+                pending.add(self.executor.submit(self.run_parallel, request, compiled))
+                for future in [f for f in pending if f.done()]:
+                    pending.discard(future)
+                    yield done(future.result())
+                continue
+            for future in as_completed(pending):
+                yield done(future.result())
+            pending = set()
+            if request.atomicity_group:
+                group = []
+                while i < len(requests) and requests[i].atomicity_group == request.atomicity_group:
+                    group.append(requests[i])
+                    i += 1
+                for response in self.run_group(group, failed):
+                    yield done(response)
+            else:
+                i += 1
+                yield done(self.dependency_failure(request, failed) or self.run(request))
+        for future in as_completed(pending):
+            yield done(future.result())
+
+    def stream_json(self, requests):
+        """Yields the JSON batch response document in chunks, one per completed response."""
+        yield b'{"responses":['
+        separator = ''
+        for response in self.execute(requests):
+            item = {"id": response.id, "status": response.status}
+            if response.atomicity_group:
+                item["atomicityGroup"] = response.atomicity_group
+            if response.body is not None:
+                item["body"] = response.body
+            yield (separator + ENCODER.encode(item)).encode()
+            separator = ','
+        yield b']}'
+
+    @staticmethod
+    def http_part(response):
+        lines = ['Content-Type: application/http', 'Content-Transfer-Encoding: binary',
+                 'Content-ID: {}'.format(response.id), '',
+                 'HTTP/1.1 {} {}'.format(response.status, HTTPStatus(response.status).phrase)]
+        if response.body is not None:
+            lines += ['Content-Type: application/json', '', ENCODER.encode(response.body)]
+        else:
+            lines += ['', '']
+        return '\r\n'.join(lines)
+
+    def stream_multipart(self, requests, boundary):
+        """Yields the multipart/mixed batch response in chunks; change set responses are nested parts."""
+        group = changeset = None
+        for response in self.execute(requests):
+            if changeset is not None and response.atomicity_group != group:
+                yield '--{}--\r\n'.format(changeset).encode()
+                group = changeset = None
+            if response.atomicity_group and changeset is None:
+                group = response.atomicity_group
+                changeset = 'changesetresponse_{}'.format(uuid.uuid4())
+                yield '--{}\r\nContent-Type: multipart/mixed; boundary={}\r\n\r\n'.format(boundary, changeset).encode()
+            yield '--{}\r\n{}\r\n'.format(changeset or boundary, self.http_part(response)).encode()
+        if changeset is not None:
+            yield '--{}--\r\n'.format(changeset).encode()
+        yield '--{}--\r\n'.format(boundary).encode()
+
+    def handle(self, body, content_type):
+        """Returns the response content type and a byte iterator, for StreamingHttpResponse."""
+        requests = self.parse(body, content_type)
+        if content_type.split(';')[0].strip().lower() == 'application/json':
+            return 'application/json', self.stream_json(requests)
+        boundary = 'batchresponse_{}'.format(uuid.uuid4())
+        return 'multipart/mixed; boundary={}'.format(boundary), self.stream_multipart(requests, boundary)
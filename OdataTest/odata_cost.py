@@ -0,0 +1,88 @@
+from collections import namedtuple
+from OdataTest.odata_param_parser import ODataException
+
+
+QueryCost = namedtuple('QueryCost', ['nodes', 'depth', 'disjuncts', 'like_functions', 'arithmetic', 'navigation', 'cost'])
+
+EXPRESSION_NODES = {
+    'rel_expr', 'function_expr', 'function_marker_expr', 'math_expr', 'lambda_expr', 'not_expr', 'and_expr', 'or_expr',
+}
+NESTING_NODES = {'paren_expr', 'not_expr', 'function_expr', 'lambda_expr'}
+LIKE_FUNCTIONS = {'contains', 'endswith', 'substringof', 'indexof'}
+
+
+class CostModel:
+    """
+    Estimates the cost of a parsed $filter before it is translated, so pathological
+    filters are rejected with an ODataException instead of reaching the database.
+
+    The cost weighs the expression node count, the nesting depth of parentheses,
+    `not`, function calls and any/all lambdas, the number of `or` disjuncts, the
+    leading-wildcard LIKE functions (contains, endswith, substringof, indexof), the
+    arithmetic/function comparisons that need an annotation, and the deepest
+    navigation path. Every measure can also be capped on its own; limits left to
+    None are not enforced.
+    """
+
+    def __init__(self, max_cost=None, max_length=None, max_nodes=None, max_depth=None, max_disjuncts=None,
+                 max_like_functions=None, max_arithmetic=None, max_navigation=None,
+                 node_weight=1, depth_weight=2, disjunct_weight=2, like_weight=20, arithmetic_weight=10,
+                 navigation_weight=5):
+        self.max_cost = max_cost
+        self.max_length = max_length
+        self.limits = {
+            'nodes': max_nodes,
+            'depth': max_depth,
+            'disjuncts': max_disjuncts,
+            'like_functions': max_like_functions,
+            'arithmetic': max_arithmetic,
+            'navigation': max_navigation,
+        }
+        self.weights = {
+            'nodes': node_weight,
+            'depth': depth_weight,
+            'disjuncts': disjunct_weight,
+            'like_functions': like_weight,
+            'arithmetic': arithmetic_weight,
+            'navigation': navigation_weight,
+        }
+
+    def measure(self, tree) -> QueryCost:
+        counts = dict.fromkeys(self.weights, 0)
+        stack = [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            name = node.expr_name
+            if name in NESTING_NODES:
+                depth += 1
+                counts['depth'] = max(counts['depth'], depth)
+            if name in EXPRESSION_NODES:
+                counts['nodes'] += 1
+            if name == 'or_expr':
+                counts['disjuncts'] += 1
+            elif name == 'function_expr' and node.children[0].text in LIKE_FUNCTIONS:
+                counts['like_functions'] += 1
+            elif name == 'function_marker_expr':
+                counts['arithmetic'] += 1
+            elif name in ('select_path', 'lambda_path'):
+                counts['navigation'] = max(counts['navigation'], node.text.count('/'))
+            stack.extend((child, depth) for child in node.children)
+        cost = sum(counts[k] * self.weights[k] for k in counts)
+        return QueryCost(cost=cost, **counts)
+
+    def check_text(self, filter_text):
+        if self.max_length is not None and len(filter_text) > self.max_length:
+            raise ODataException("$filter is too long: {} characters exceed the limit of {}".format(
+                len(filter_text), self.max_length))
+
+    def check(self, tree) -> QueryCost:
+        cost = self.measure(tree)
+        for name, limit in self.limits.items():
+            if limit is not None and getattr(cost, name) > limit:
+                raise ODataException("$filter is too expensive: {} {} exceeds the limit of {}".format(
+                    name.replace('_', ' '), getattr(cost, name), limit))
+        if self.max_cost is not None and cost.cost > self.max_cost:
+            raise ODataException("$filter is too expensive: estimated cost {} exceeds the limit of {} ({})".format(
+                cost.cost, self.max_cost, ', '.join('{} {}'.format(k.replace('_', ' '), v)
+                                                    for k, v in cost._asdict().items() if k != 'cost')))
+        return cost
@@ -0,0 +1,136 @@
+import hashlib
+import json
+from collections import namedtuple
+from django.core.cache import caches
+from django.db import connections, models
+from OdataTest.odata_param_parser import apply_params, django_params
+
+
+COUNT_ALIAS = 'odata_count'
+
+CountedPage = namedtuple('CountedPage', ['rows', 'count'])
+
+
+def count_requested(param_dict) -> bool:
+    return str(param_dict.get('$count', '')).lower() == 'true' or param_dict.get('$inlinecount') == 'allpages'
+
+
+def filtered(queryset, params):
+    return apply_params(queryset, {k: v for k, v in params.items() if k in ('apply', 'annotate', 'filter')})
+
+
+class ExactCount:
+    """Counts with a separate COUNT(*) query on the filtered queryset."""
+
+    def count(self, queryset, params):
+        return filtered(queryset, params).count()
+
+    def paginate(self, queryset, params) -> CountedPage:
+        return CountedPage(list(apply_params(queryset, params)), self.count(queryset, params))
+
+
+class WindowCount(ExactCount):
+    """
+    Exact count in a single round trip: the page query gets a `COUNT(*) OVER ()`
+    column, which the database computes over the filtered rows before LIMIT/OFFSET.
+    Only a page past the end, which has no row to carry the column, costs a second query.
+    """
+
+    def paginate(self, queryset, params) -> CountedPage:
+        for step in params.get('apply', ()):
+            # the window would share the SELECT of the topcount rank and count the rows it
+            # drops, or count the input rows of a groupby without aggregates before DISTINCT
+            if step[0] == 'topcount' or step[0] == 'aggregate' and not step[2]:
+                return super().paginate(queryset, params)
+        page_params = dict(params)
+        page_params['annotate'] = dict(params.get('annotate', {}), **{COUNT_ALIAS: models.Window(models.Count('*'))})
+        if 'values' in params:
+            page_params['values'] = params['values'] + [COUNT_ALIAS]
+        rows = list(apply_params(queryset, page_params))
+        if not rows:
+            return CountedPage(rows, super().count(queryset, params))
+        for row in rows:
+            if isinstance(row, dict):
+                count = row.pop(COUNT_ALIAS)
+            else:
+                count = getattr(row, COUNT_ALIAS)
+                delattr(row, COUNT_ALIAS)
+        return CountedPage(rows, count)
+
+
+class CachedCount(ExactCount):
+    """
+    Exact count cached in Django's cache framework for `ttl` seconds. The key is
+    built from the compiled SQL of the filtered queryset, so requests only share a
+    count when they really filter the same rows.
+    """
+
+    def __init__(self, ttl=60, inner=None, cache_alias='default', key_prefix='odata-count'):
+        self.ttl = ttl
+        self.inner = inner or ExactCount()
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    def cache_key(self, queryset):
+        sql, sql_params = queryset.query.sql_with_params()
+        digest = hashlib.sha1(json.dumps([queryset.db, sql, [str(p) for p in sql_params]]).encode()).hexdigest()
+        return '{}:{}:{}'.format(self.key_prefix, queryset.model._meta.label_lower, digest)
+
+    def count(self, queryset, params):
+        cache = caches[self.cache_alias]
+        key = self.cache_key(filtered(queryset, params))
+        count = cache.get(key)
+        if count is None:
+            count = self.inner.count(queryset, params)
+            cache.set(key, count, self.ttl)
+        return count
+
+
+class EstimatedCount(ExactCount):
+    """
+    Count taken from the planner statistics when they say the set is large.
+    Unfiltered PostgreSQL tables use pg_class.reltuples, filtered ones the row
+    estimate of the query plan (also used on MySQL). Backends without statistics
+    and sets estimated below `threshold` rows fall back to `exact`.
+    """
+
+    def __init__(self, threshold=100000, exact=None):
+        self.threshold = threshold
+        self.exact = exact or ExactCount()
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                if not queryset.query.where:
+                    cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                                   [queryset.model._meta.db_table])
+                    row = cursor.fetchone()
+                    return int(row[0]) if row and row[0] >= 0 else None
+                sql, sql_params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, sql_params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return int(plan[0]['Plan']['Plan Rows'])
+            if connection.vendor == 'mysql':
+                sql, sql_params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN ' + sql, sql_params)
+                columns = [c[0] for c in cursor.description]
+                return int(dict(zip(columns, cursor.fetchone()))['rows'])
+        return None
+
+    def count(self, queryset, params):
+        estimate = self.estimate(filtered(queryset, params).order_by())
+        if estimate is not None and estimate >= self.threshold:
+            return estimate
+        return self.exact.count(queryset, params)
+
+
+def paginate(queryset, param_dict, strategy=None, **kwargs) -> CountedPage:
+    """Applies the OData params to `queryset`, counting the matching rows when $count/$inlinecount asks for it."""
+    params = django_params(param_dict, **kwargs)
+    if not count_requested(param_dict):
+        return CountedPage(list(apply_params(queryset, params)), None)
+    return (strategy or WindowCount()).paginate(queryset, params)
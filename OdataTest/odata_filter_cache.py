@@ -0,0 +1,173 @@
+import copy
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from django.db import models
+
+
+LITERAL_RE = re.compile(r"(?P<datetime>datetime'[^']*')|(?P<string>'[^']*')|(?<![\w./])(?P<number>-?[\d.]+)(?![\w.])")
+PLACEHOLDERS = {
+    'datetime': "datetime'?'",
+    'string': "'?'",
+    'int': "0",
+    'float': "0.0",
+}
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class Slot:
+    """Placeholder for a literal lifted out of a $filter, filled in by `bind`."""
+    __slots__ = ('index', 'converters')
+
+    def __init__(self, index, converters=()):
+        self.index = index
+        self.converters = converters
+
+    def __repr__(self):
+        return 'Slot({})'.format(self.index)
+
+    def map(self, converter):
+        """A slot resolving to `converter(value)`, for conversions that depend on the literal."""
+        return Slot(self.index, self.converters + (converter,))
+
+    def resolve(self, values):
+        value = values[self.index]
+        for converter in self.converters:
+            value = converter(value)
+        return value
+
+
+class RecordedUsage(list):
+    """Recorder collecting the usage events of a template compilation, replayed on every hit."""
+
+    def record(self, *event):
+        self.append(event)
+
+    def replay(self, recorder):
+        for event in self:
+            recorder.record(*event)
+
+
+def lift_literals(filter_text):
+    """
+    Split a $filter into its shape and its literals.
+    Returns (shape, literals, offsets): literals is a list of (kind, text) pairs and
+    offsets maps the start of every placeholder inside the shape to its literal index.
+    """
+    shape = []
+    literals = []
+    offsets = {}
+    pos = 0
+    length = 0
+    for match in LITERAL_RE.finditer(filter_text):
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string' and text == "''":
+            continue
+        if kind == 'number':
+            placeholder = PLACEHOLDERS['float' if '.' in text else 'int']
+        else:
+            placeholder = PLACEHOLDERS[kind]
+        chunk = filter_text[pos:match.start()]
+        shape.append(chunk)
+        length += len(chunk)
+        offsets[length] = len(literals)
+        literals.append((kind, text))
+        shape.append(placeholder)
+        length += len(placeholder)
+        pos = match.end()
+    shape.append(filter_text[pos:])
+    return ''.join(shape), literals, offsets
+
+
+def bind(template, values):
+    """Rebuild a translated template with every `Slot` replaced by its value."""
+    if isinstance(template, Slot):
+        return template.resolve(values)
+    if isinstance(template, models.Q):
+        children = [bind(c, values) for c in template.children]
+        return models.Q(*children, _connector=template.connector, _negated=template.negated)
+    if isinstance(template, dict):
+        return {k: bind(v, values) for k, v in template.items()}
+    if isinstance(template, (list, tuple)):
+        return type(template)(bind(i, values) for i in template)
+    constructor_args = getattr(template, '_constructor_args', None)
+    if constructor_args is not None:
+        args, kwargs = constructor_args
+        return type(template)(*bind(args, values), **bind(kwargs, values))
+    return template
+
+
+class FilterCache:
+    """
+    Bounded LRU cache of translated $filter templates keyed on the filter shape,
+    i.e. the filter text with every string, number and datetime literal lifted out.
+    A hit skips parsing and translation and only rebinds the literal values.
+    """
+
+    def __init__(self, maxsize=512):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        with self._lock:
+            self._maxsize = value
+            self._evict()
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self._maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def process(self, processor, filter_text: str, info=None):
+        """Translates `filter_text` with `processor`; the filter shape is added to the phase `info` dict."""
+        if processor.cost_model is not None:
+            processor.cost_model.check_text(filter_text)
+        shape, literals, offsets = lift_literals(filter_text)
+        if info is not None:
+            info["shape"] = shape
+        values = [processor.literal_value(kind, text) for kind, text in literals]
+        key = (processor.cache_key(), shape)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self.compile(processor, shape, offsets)
+            with self._lock:
+                self.misses += 1
+                if self._maxsize > 0:
+                    self._entries[key] = entry
+                    self._evict()
+        template, usage = entry
+        if processor.recorder is not None:
+            usage.replay(processor.recorder)
+        return processor.finalize(bind(template, values))
+
+    @staticmethod
+    def compile(processor, shape, offsets):
+        template_processor = copy.copy(processor)
+        template_processor.slots = {offset: Slot(index) for offset, index in offsets.items()}
+        template_processor.recorder = usage = RecordedUsage()
+        return template_processor.translate(shape), usage
+
+
+filter_cache = FilterCache()
@@ -0,0 +1,209 @@
+import re
+from OdataTest.odata_param_parser import ODataException
+
+
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+    |(?P<datetime>datetime'[^']+')
+    |(?P<string>'[^']+')
+    |(?P<number>-?[\d.]+)
+    |(?P<word>[a-zA-Z][\w/]*)
+    |(?P<lparen>\()
+    |(?P<rparen>\))
+    |(?P<comma>,)
+    |(?P<colon>:)
+""", re.VERBOSE)
+REL_MARKERS = {'eq', 'ne', 'lt', 'le', 'gt', 'ge'}
+MATH_MARKERS = {'mod', 'div', 'mul', 'sub', 'add', 'sqrt'}
+JSON_PRIMITIVES = {'true', 'false', 'null'}
+LAMBDA_PATH_RE = re.compile(r'[a-zA-Z][\w/]*/(any|all)$')
+LAMBDA_VARIABLE_RE = re.compile(r'[a-zA-Z]\w*$')
+OPERAND_KINDS = {'datetime', 'string', 'number', 'word', 'lparen'}
+
+
+class Node:
+    """
+    Parse tree node exposing the part of parsimonious' Node interface used by
+    FilterProcessor (`expr_name`, `children`, `text`, `start`), so the hand-written
+    parser feeds the existing translation unchanged. Only the nodes the translation
+    looks at are created, so `FilterProcessor.walk` never has to descend through
+    anonymous sequence nodes.
+    """
+    __slots__ = ('expr_name', 'full_text', 'start', 'end', 'children')
+
+    def __init__(self, expr_name, full_text, start, end, children=()):
+        self.expr_name = expr_name
+        self.full_text = full_text
+        self.start = start
+        self.end = end
+        self.children = children
+
+    @property
+    def text(self):
+        return self.full_text[self.start:self.end]
+
+    def __repr__(self):
+        return '<Node {} {!r}>'.format(self.expr_name, self.text)
+
+
+class Token:
+    __slots__ = ('kind', 'text', 'start', 'end')
+
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+def tokenize(filter_text):
+    tokens = []
+    pos = 0
+    while pos < len(filter_text):
+        match = TOKEN_RE.match(filter_text, pos)
+        if match is None:
+            raise ODataException("unexpected character {!r} at position {}".format(filter_text[pos], pos))
+        kind = match.lastgroup
+        if kind != 'ws':
+            tokens.append(Token(kind, match.group(kind), match.start(), match.end()))
+        pos = match.end()
+    tokens.append(Token('end', '', pos, pos))
+    return tokens
+
+
+class Parser:
+    """Single pass recursive-descent parser for the $filter language accepted by `grammar`."""
+
+    def __init__(self, filter_text):
+        self.text = filter_text
+        self.tokens = tokenize(filter_text)
+        self.pos = 0
+
+    def parse(self):
+        tree = self.bool_common_expr()
+        if self.peek().kind != 'end':
+            self.error()
+        return tree
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, *kinds):
+        token = self.peek()
+        if token.kind not in kinds:
+            self.error()
+        return self.advance()
+
+    def error(self):
+        token = self.peek()
+        if token.kind == 'end':
+            raise ODataException("unexpected end of filter '{}'".format(self.text))
+        raise ODataException("unexpected '{}' at position {} in filter '{}'".format(token.text, token.start, self.text))
+
+    def node(self, expr_name, start, end, children=()):
+        return Node(expr_name, self.text, start, end, children)
+
+    def leaf(self, expr_name, token):
+        return Node(expr_name, self.text, token.start, token.end)
+
+    def is_word(self, words, offset=0):
+        token = self.peek(offset)
+        return token.kind == 'word' and token.text in words
+
+    def bool_common_expr(self):
+        # and/or chains are read iteratively and folded from the right, which keeps
+        # the right-nested shape produced by the grammar without deep recursion
+        fronts = []
+        while True:
+            if self.is_word({'not'}) and self.peek(1).kind in OPERAND_KINDS | {'end'}:
+                token = self.advance()
+                children = (self.bool_common_expr(),) if self.peek().kind in OPERAND_KINDS else ()
+                end = children[0].end if children else token.end
+                front = self.node('not_expr', token.start, end, children)
+            else:
+                common = self.common_expr()
+                front = self.node('common_expr', common.start, common.end, (common,))
+            if self.is_word({'and', 'or'}):
+                fronts.append((front, self.advance()))
+            else:
+                break
+        tree = self.node('bool_common_expr', front.start, front.end, (front,))
+        for front, op in reversed(fronts):
+            tail = self.node(op.text + '_expr', op.start, tree.end, (tree,))
+            tree = self.node('bool_common_expr', front.start, tree.end, (front, tail))
+        return tree
+
+    def common_expr(self):
+        if self.peek().kind == 'lparen':
+            start = self.advance().start
+            inner = self.bool_common_expr()
+            end = self.expect('rparen').end
+            return self.node('paren_expr', start, end, (inner,))
+        token = self.peek()
+        if token.kind == 'word' and LAMBDA_PATH_RE.match(token.text) and self.peek(1).kind == 'lparen' \
+                and self.peek(1).start == token.end:
+            return self.lambda_expr()
+        operand = self.function_param()
+        if self.is_word(MATH_MARKERS):
+            marker = self.leaf('math_marker', self.advance())
+            number = self.leaf('number', self.expect('number'))
+            math = self.node('math_expr', operand.start, number.end, (operand, marker, number))
+            if not self.is_word(REL_MARKERS):
+                self.error()
+            rel = self.leaf('rel_marker', self.advance())
+            value = self.function_param()
+            if value.expr_name not in ('string', 'number'):
+                raise ODataException("expected a string or number at position {} in filter '{}'".format(
+                    value.start, self.text))
+            return self.node('function_marker_expr', operand.start, value.end, (math, rel, value))
+        if self.is_word(REL_MARKERS):
+            rel = self.leaf('rel_marker', self.advance())
+            value = self.function_param()
+            if operand.expr_name == 'function_expr' and value.expr_name in ('string', 'number'):
+                return self.node('function_marker_expr', operand.start, value.end, (operand, rel, value))
+            return self.node('rel_expr', operand.start, value.end, (operand, rel, value))
+        if operand.expr_name != 'function_expr':
+            self.error()
+        return operand
+
+    def lambda_expr(self):
+        path = self.leaf('lambda_path', self.advance())
+        self.advance()
+        children = (path,)
+        if self.peek().kind != 'rparen':
+            if self.peek().kind != 'word' or not LAMBDA_VARIABLE_RE.match(self.peek().text):
+                self.error()
+            variable = self.leaf('lambda_variable', self.advance())
+            self.expect('colon')
+            children += (variable, self.bool_common_expr())
+        end = self.expect('rparen').end
+        return self.node('lambda_expr', path.start, end, children)
+
+    def function_param(self):
+        token = self.peek()
+        if token.kind == 'word' and self.peek(1).kind == 'lparen' and self.peek(1).start == token.end:
+            return self.function_expr()
+        if token.kind in ('number', 'string', 'datetime'):
+            return self.leaf(token.kind, self.advance())
+        if token.kind == 'word':
+            return self.leaf('json_primitive' if token.text in JSON_PRIMITIVES else 'select_path', self.advance())
+        self.error()
+
+    def function_expr(self):
+        name = self.leaf('func_name', self.advance())
+        self.advance()
+        params = [self.function_param()]
+        while self.peek().kind == 'comma':
+            self.advance()
+            params.append(self.function_param())
+        end = self.expect('rparen').end
+        return self.node('function_expr', name.start, end, (name, *params))
+
+
+def parse(filter_text):
+    return Parser(filter_text).parse()
@@ -0,0 +1,97 @@
+"""
+The parsimonious grammar of $filter, built on first use instead of at import.
+
+Importing parsimonious and compiling the rules costs tens of milliseconds that every
+worker and management command importing the API would pay at startup. `get_grammar`
+builds the grammar once, or loads the prebuilt form written next to this module by
+
+    python -m OdataTest.odata_grammar
+
+which is ignored when it was built from other rules or another parsimonious install.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+
+
+GRAMMAR_RULES = """
+    bool_common_expr     = (not_expr / common_expr ) ( and_expr / or_expr )?
+    rel_expr             = (function_param / function_expr) RWS rel_marker RWS function_param 
+    math_expr            = function_param RWS math_marker RWS number
+    rel_marker           = 'eq' / 'ne' / 'lt' / 'le' / 'gt' / 'ge'
+    common_expr          = paren_expr / lambda_expr / function_marker_expr / function_expr / rel_expr
+    function_marker_expr = (function_expr / math_expr) RWS rel_marker RWS (string / number)
+    function_expr        = func_name "(" ~"\s*" function_param  (~"\s*,\s*" function_param)* ~"\s*" ")"
+    func_name            = ~"\w+"
+    select_path          = ~"[a-zA-Z][\w/]*"
+    number               = "-"? ~"[\d\.]+"
+    string               = "'" ~"[^']+" "'"
+    json_primitive       = "true" / "false" / "null"
+    function_param       = function_expr / number / string / datetime / json_primitive / select_path
+    datetime             = 'datetime'string
+    paren_expr           = "(" ~"\s*" bool_common_expr ~"\s*" ")"
+    lambda_expr          = lambda_path "(" ~"\s*" (lambda_variable ~"\s*:\s*" bool_common_expr ~"\s*")? ")"
+    lambda_path          = ~"[a-zA-Z][\w/]*/(any|all)(?=\()"
+    lambda_variable      = ~"[a-zA-Z]\w*"
+    not_expr             = 'not' RWS? bool_common_expr?
+    math_marker          = 'mod' / 'div' / 'mul' / 'sub' / 'add' / 'sqrt'
+    and_expr             = RWS 'and' RWS bool_common_expr
+    or_expr              = RWS 'or' RWS bool_common_expr
+    RWS                  = ~"\s+"
+"""
+
+PREBUILT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'odata_grammar.pickle')
+
+_grammar = None
+_lock = threading.Lock()
+
+
+def fingerprint() -> str:
+    """Identifies the rules and the parsimonious install a prebuilt grammar must match."""
+    import parsimonious.expressions
+    stat = os.stat(parsimonious.expressions.__file__)
+    source = '{}|{}|{}|{}'.format(
+        GRAMMAR_RULES, sys.version_info[:2], parsimonious.expressions.__file__, stat.st_mtime_ns)
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def build():
+    from parsimonious.grammar import Grammar
+    return Grammar(GRAMMAR_RULES)
+
+
+def load_prebuilt(path=PREBUILT_PATH):
+    try:
+        with open(path, 'rb') as f:
+            saved_fingerprint, grammar = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+        return None
+    return grammar if saved_fingerprint == fingerprint() else None
+
+
+def write_prebuilt(path=PREBUILT_PATH):
+    data = pickle.dumps((fingerprint(), build()), protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_grammar():
+    global _grammar
+    if _grammar is None:
+        with _lock:
+            if _grammar is None:
+                _grammar = load_prebuilt() or build()
+    return _grammar
+
+
+def parse(filter_text):
+    return get_grammar().parse(filter_text)
+
+
+if __name__ == '__main__':
+    write_prebuilt()
+    print(PREBUILT_PATH)
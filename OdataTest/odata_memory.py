@@ -0,0 +1,373 @@
+import math
+import operator
+import string
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import functions, lookups
+from django.db.models.functions.text import ConcatPair
+from django.utils import timezone
+from OdataTest.odata_filter_cache import filter_cache
+from OdataTest.odata_param_parser import FilterProcessor, ODataException, RelatedExists, django_params
+
+
+def local(value):
+    # the ORM extracts date parts of aware datetimes in the current time zone
+    if isinstance(value, datetime) and settings.USE_TZ and timezone.is_aware(value):
+        return timezone.localtime(value)
+    return value
+
+
+def round_half_away(value, precision=0):
+    # SQL ROUND, unlike round(), rounds halves away from zero
+    scale = 10 ** precision
+    rounded = math.floor(abs(value) * scale + (Decimal('0.5') if isinstance(value, Decimal) else 0.5))
+    if precision:
+        rounded = rounded / scale
+    return rounded if value >= 0 else -rounded
+
+
+TRANSFORMS = {
+    'lower': lambda v: v.lower(),
+    'upper': lambda v: v.upper(),
+    'trim': lambda v: v.strip(' '),
+    'length': len,
+    'year': lambda v: local(v).year,
+    'month': lambda v: local(v).month,
+    'day': lambda v: local(v).day,
+    'hour': lambda v: local(v).hour,
+    'minute': lambda v: local(v).minute,
+    'second': lambda v: local(v).second,
+    'ceil': math.ceil,
+    'floor': math.floor,
+    'round': round_half_away,
+    'abs': abs,
+}
+LOOKUPS = {
+    'exact': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'contains': lambda a, b: b in a,
+    'startswith': lambda a, b: a.startswith(b),
+    'endswith': lambda a, b: a.endswith(b),
+    'icontains': lambda a, b: b.lower() in a.lower(),
+    'in': lambda a, b: a in b,
+    'range': lambda a, b: b[0] <= a <= b[1],
+}
+LIKE_LOOKUPS = {'contains', 'startswith', 'endswith'}
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+# the field classes whose registered transforms the ORM can filter on
+TRANSFORM_FIELDS = (models.Field, models.CharField, models.TextField, models.IntegerField, models.FloatField,
+                    models.DecimalField, models.DateField, models.DateTimeField, models.TimeField)
+
+
+def ascii_folded(compare):
+    # SQLite's LIKE ignores the case of ASCII letters only
+    return lambda a, b: compare(a.translate(ASCII_LOWER), b.translate(ASCII_LOWER))
+
+
+def registered(transform):
+    return any(transform in field.get_lookups() for field in TRANSFORM_FIELDS)
+
+
+def backend_options(connection) -> dict:
+    """The MemoryQuery options giving the results of the database behind `connection`."""
+    return {"nulls_largest": connection.vendor in ('postgresql', 'oracle'),
+            "ascii_case_like": connection.vendor == 'sqlite'}
+
+
+def sql_div(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        # integer division truncates toward zero in SQL
+        return abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+    return a / b
+
+
+def sql_mod(a, b):
+    # the sign of SQL MOD follows the dividend
+    return type(a)(math.fmod(a, b)) if isinstance(a, int) and isinstance(b, int) else math.fmod(a, b)
+
+
+CONNECTORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': sql_div,
+    '%%': sql_mod,
+    '^': operator.pow,
+}
+
+
+def str_index(string, substring):
+    return string.find(substring) + 1
+
+
+def substr(string, pos, length=None):
+    # SUBSTR counts from 1, and Substr rejects the positions before the first character
+    if pos < 1:
+        raise ODataException("substring position must not be negative")
+    return string[pos - 1:] if length is None else string[pos - 1:pos - 1 + length]
+
+
+FUNCTIONS = {
+    functions.Lower: TRANSFORMS['lower'],
+    functions.Upper: TRANSFORMS['upper'],
+    functions.Trim: TRANSFORMS['trim'],
+    functions.Length: TRANSFORMS['length'],
+    functions.Ceil: TRANSFORMS['ceil'],
+    functions.Floor: TRANSFORMS['floor'],
+    functions.Round: TRANSFORMS['round'],
+    functions.Abs: TRANSFORMS['abs'],
+    functions.ExtractYear: TRANSFORMS['year'],
+    functions.ExtractMonth: TRANSFORMS['month'],
+    functions.ExtractDay: TRANSFORMS['day'],
+    functions.ExtractHour: TRANSFORMS['hour'],
+    functions.ExtractMinute: TRANSFORMS['minute'],
+    functions.ExtractSecond: TRANSFORMS['second'],
+    functions.StrIndex: str_index,
+    functions.Substr: substr,
+    functions.Replace: lambda string, old, new: string.replace(old, new),
+    functions.Sqrt: math.sqrt,
+    functions.Power: operator.pow,
+    functions.Mod: sql_mod,
+}
+
+
+def getter(path):
+    """Reads `path` (`country__name` style) from a dict or an object row; None past a null relation."""
+    names = path.split('__')
+
+    def get(row):
+        if isinstance(row, dict) and path in row:
+            return row[path]
+        value = row
+        for name in names:
+            if value is None:
+                return None
+            try:
+                value = value.get(name) if isinstance(value, dict) else getattr(value, name)
+            except (AttributeError, TypeError):
+                raise ODataException("can't read '{}' of {!r}".format(path.replace('__', '/'), row))
+        return value
+    return get
+
+
+def split_key(key):
+    """
+    Splits a lookup key like 'created__year__gte' into ('created', ['year'], 'gte').
+    Like the ORM, it rejects transforms no field class registers (Lower, Length... are
+    not registered by default).
+    """
+    names = key.split('__')
+    lookup = names.pop() if len(names) > 1 and (names[-1] in LOOKUPS or names[-1] == 'isnull') else 'exact'
+    transforms = []
+    while len(names) > 1 and names[-1] in TRANSFORMS:
+        if not registered(names[-1]):
+            raise ODataException("unsupported lookup '{}'".format(names[-1]))
+        transforms.insert(0, TRANSFORMS[names.pop()])
+    return '__'.join(names), transforms, lookup
+
+
+def null_safe(function):
+    def call(*values):
+        if any(v is None for v in values):
+            return None
+        try:
+            return function(*values)
+        except (TypeError, AttributeError):
+            raise ODataException("can't evaluate {} on {!r}".format(getattr(function, '__name__', function), values))
+        except (ZeroDivisionError, ValueError, ArithmeticError):
+            return None
+    return call
+
+
+class MemoryQuery:
+    """
+    The params of a request (see `django_params`) compiled into plain Python over rows
+    that are dicts or objects: a predicate for the filter, a sort key for $orderby, the
+    $select projection and the $top/$skip slice. It follows the ORM's SQL semantics:
+    comparisons with null are unknown and drop the row, except inside a negation,
+    where the ORM guards nullable columns so `rating ne 2.5` keeps null ratings;
+    integer division truncates; ROUND rounds halves away from zero; date parts are taken
+    in the current time zone and nulls sort first, or last with `nulls_largest`.
+
+    String matching is case-sensitive, as on PostgreSQL; with `ascii_case_like`
+    contains/startswith/endswith ignore the case of ASCII letters, as SQLite's LIKE
+    does. `backend_options(connection)` gives the options matching a database.
+    """
+
+    def __init__(self, params, nulls_largest=False, ascii_case_like=False):
+        if set(params) & {'prefetch_related', 'select_related'}:
+            raise ODataException("$expand is not supported in memory")
+        if 'apply' in params:
+            raise ODataException("$apply is not supported in memory")
+        self.ascii_case_like = ascii_case_like
+        self.annotations = {}
+        for name, expression in params.get('annotate', {}).items():
+            self.annotations[name] = self.expression(expression)
+        self.predicate = self.condition(params['filter']) if 'filter' in params else None
+        self.order_by = [(getter(o.lstrip('-')), o.startswith('-')) for o in params.get('order_by', ())]
+        self.values = params.get('values')
+        self.nulls_largest = nulls_largest
+        self.page = params.get('__getitem__')
+
+    def __call__(self, rows) -> list:
+        if self.predicate is not None:
+            rows = [row for row in rows if self.predicate(row) is True]
+        else:
+            rows = list(rows)
+        for get, descending in reversed(self.order_by):
+            rows.sort(key=lambda row: self.sort_key(get(row)), reverse=descending)
+        if self.page is not None:
+            rows = rows[self.page]
+        if self.values is not None:
+            getters = [(path, getter(path)) for path in self.values]
+            rows = [{path: get(row) for path, get in getters} for row in rows]
+        return rows
+
+    def sort_key(self, value):
+        if value is None:
+            return (1,) if self.nulls_largest else (0,)
+        return (0 if self.nulls_largest else 1, value)
+
+    def value(self, path):
+        return self.annotations.get(path) or getter(path)
+
+    def expression(self, expression):
+        """Compiles an ORM expression into a function of the row."""
+        if isinstance(expression, models.F):
+            return self.value(expression.name)
+        if isinstance(expression, models.Value):
+            value = expression.value
+            return lambda row: value
+        if isinstance(expression, models.expressions.CombinedExpression):
+            if expression.connector not in CONNECTORS:
+                raise ODataException("unsupported operator '{}'".format(expression.connector))
+            combine = null_safe(CONNECTORS[expression.connector])
+            lhs, rhs = self.expression(expression.lhs), self.expression(expression.rhs)
+            return lambda row: combine(lhs(row), rhs(row))
+        if isinstance(expression, (functions.Concat, ConcatPair)):
+            parts = []
+            for source in expression.get_source_expressions():
+                if isinstance(source, ConcatPair):
+                    parts.append(self.expression(source))
+                else:
+                    part = self.expression(source)
+                    # Concat treats null as the empty string
+                    parts.append(lambda row, part=part: '' if part(row) is None else str(part(row)))
+            return lambda row: ''.join(part(row) for part in parts)
+        if type(expression) in FUNCTIONS:
+            function = null_safe(FUNCTIONS[type(expression)])
+            sources = [self.expression(source) for source in expression.get_source_expressions()]
+            return lambda row: function(*(source(row) for source in sources))
+        if not hasattr(expression, 'resolve_expression'):
+            return lambda row: expression
+        raise ODataException("unsupported expression {!r}".format(expression))
+
+    def condition(self, q, negated=False):
+        """
+        Compiles a Q into a function of the row returning True, False or None (unknown).
+        `negated` tells whether the Q sits inside a negation, as the ORM tracks it.
+        """
+        negated = negated != q.negated
+        children = [self.child(c, negated) for c in q.children]
+        if q.connector == models.Q.OR:
+            def evaluate(row):
+                result = False
+                for child in children:
+                    value = child(row)
+                    if value is True:
+                        return True
+                    if value is None:
+                        result = None
+                return result
+        else:
+            def evaluate(row):
+                result = True
+                for child in children:
+                    value = child(row)
+                    if value is False:
+                        return False
+                    if value is None:
+                        result = None
+                return result
+        if q.negated:
+            return lambda row: None if (value := evaluate(row)) is None else not value
+        return evaluate
+
+    def child(self, child, negated):
+        if isinstance(child, models.Q):
+            return self.condition(child, negated)
+        if isinstance(child, RelatedExists):
+            return self.related_exists(child)
+        if isinstance(child, lookups.Lookup):
+            compare = null_safe(self.lookup(child.lookup_name))
+            lhs, rhs = self.expression(child.lhs), self.expression(child.rhs)
+            return lambda row: compare(lhs(row), rhs(row))
+        if not isinstance(child, tuple):
+            raise ODataException("unsupported condition {!r}".format(child))
+        key, rhs = child
+        path, transforms, lookup = split_key(key)
+        get = self.value(path)
+        if transforms:
+            steps = [null_safe(t) for t in transforms]
+            source = get
+
+            def get(row):
+                value = source(row)
+                for step in steps:
+                    value = step(value)
+                return value
+        if lookup == 'isnull' or lookup == 'exact' and rhs is None:
+            expected = rhs if lookup == 'isnull' else True
+            return lambda row: (get(row) is None) == expected
+        compare = null_safe(self.lookup(lookup))
+        # the ORM adds `IS NOT NULL` to a negated lookup on a column, but not on an annotation
+        unknown = None if path in self.annotations or not negated else False
+        return lambda row: unknown if (value := compare(get(row), rhs)) is None else value
+
+    def lookup(self, name):
+        if name not in LOOKUPS:
+            raise ODataException("unsupported lookup '{}'".format(name))
+        if self.ascii_case_like and name in LIKE_LOOKUPS:
+            return ascii_folded(LOOKUPS[name])
+        return LOOKUPS[name]
+
+    def related_exists(self, exists):
+        """
+        Compiles an any/all lambda over the related rows of `exists.path`, a list in a dict
+        row or a related manager of an object row (prefetch it to avoid a query per row).
+        """
+        related = getter(exists.path)
+        match = None
+        if exists.condition is not None:
+            condition = ~exists.condition if exists.all else exists.condition
+            match = MemoryQuery({"filter": condition}, ascii_case_like=self.ascii_case_like).predicate
+
+        def evaluate(row):
+            rows = related(row)
+            if rows is None:
+                rows = ()
+            elif hasattr(rows, 'all'):
+                rows = rows.all()
+            elif not isinstance(rows, (list, tuple)):
+                raise ODataException("'{}' is not a collection".format(exists.path.replace('__', '/')))
+            found = any(match is None or match(r) is True for r in rows)
+            return not found if exists.all else found
+        return evaluate
+
+
+def evaluate(rows, param_dict, processor=None, cache=filter_cache, nulls_largest=False, ascii_case_like=False,
+             using=None) -> list:
+    """
+    Answers an OData request from in-memory rows, with the results the ORM would give
+    on the database `using` or, without it, on a database with the given options.
+    """
+    params = django_params(param_dict, cache=cache, processor=processor or FilterProcessor())
+    options = {"nulls_largest": nulls_largest, "ascii_case_like": ascii_case_like}
+    if using is not None:
+        options = backend_options(connections[using])
+    return MemoryQuery(params, **options)(rows)
@@ -0,0 +1,342 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+LOOKUPS = {
+    'exact', 'iexact', 'gt', 'gte', 'lt', 'lte', 'in', 'range', 'isnull', 'contains', 'icontains',
+    'startswith', 'istartswith', 'endswith', 'iendswith', 'regex', 'iregex',
+}
+LOWER_BOUNDS = {'gt', 'gte'}
+UPPER_BOUNDS = {'lt', 'lte'}
+DATE_PARTS = ['year', 'month', 'day', 'hour']
+
+
+class DatePartKey(str):
+    """
+    A lookup key translated from a year/month/day/hour function, like 'created__year',
+    as opposed to a path whose last property happens to be called `year`. `expression`
+    is the database function computing it, if known.
+    """
+
+    def __new__(cls, text, expression=None):
+        key = super().__new__(cls, text)
+        key.expression = expression
+        return key
+
+
+# the always-false predicate, Django answers it without querying the database
+FALSE = models.Q(pk__in=[])
+
+
+def split_lookup(key):
+    """Splits a lookup like 'Price__length__gte' into ('Price__length', 'gte'); a bare path means exact."""
+    path, _, lookup = key.rpartition('__')
+    if path and lookup in LOOKUPS:
+        return path, lookup
+    return key, 'exact'
+
+
+def is_literal(value):
+    return value is not None and not hasattr(value, 'resolve_expression') and not isinstance(value, (list, tuple, set, dict))
+
+
+def is_ordered(value):
+    # strings compare by the database collation, which Python ordering doesn't follow
+    return isinstance(value, (int, float, Decimal, date, time)) and not isinstance(value, bool)
+
+
+def typed(value):
+    """A comparison key telling 1, 1.0 and True apart, which == doesn't."""
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(typed(v) for v in value)
+    return type(value), value
+
+
+def term_key(child):
+    if isinstance(child, models.Q):
+        return models.Q, child.connector, child.negated, tuple(term_key(c) for c in child.children)
+    if isinstance(child, tuple) and len(child) == 2:
+        return child[0], typed(child[1])
+    return child
+
+
+def constant(value, negated=False):
+    return models.Q() if value != negated else FALSE
+
+
+def is_true(child):
+    return isinstance(child, models.Q) and not child.children
+
+
+def dedupe(children):
+    unique = []
+    keys = []
+    for child in children:
+        key = term_key(child)
+        if key not in keys:
+            keys.append(key)
+            unique.append(child)
+    return unique
+
+
+def merge_disjuncts(children):
+    """Rewrites equality disjunctions on one path into a single __in lookup."""
+    groups = {}
+    for child in children:
+        if isinstance(child, tuple):
+            path, lookup = split_lookup(child[0])
+            if lookup == 'exact' and is_literal(child[1]) or lookup == 'in' and isinstance(child[1], (list, tuple)):
+                groups.setdefault(path, []).append((lookup, child[1]))
+    merged = []
+    done = set()
+    for child in children:
+        if isinstance(child, tuple):
+            path, lookup = split_lookup(child[0])
+            if lookup in ('exact', 'in') and len(groups.get(path, ())) > 1:
+                if path not in done:
+                    values = []
+                    keys = []
+                    for group_lookup, value in groups[path]:
+                        for v in (value if group_lookup == 'in' else [value]):
+                            if typed(v) not in keys:
+                                keys.append(typed(v))
+                                values.append(v)
+                    merged.append(('{}__in'.format(path), values))
+                    done.add(path)
+                continue
+        merged.append(child)
+    return merged
+
+
+def merge_bounds(path, terms):
+    """
+    Folds the equality and range terms of one path in a conjunction. Returns the
+    replacement terms, FALSE for a contradiction, or None when the values can't be compared.
+    """
+    equal = [v for lookup, v in terms if lookup == 'exact']
+    lower = upper = None
+    try:
+        for lookup, value in terms:
+            if lookup in LOWER_BOUNDS:
+                if lower is None or value > lower[0] or value == lower[0] and lookup == 'gt':
+                    lower = (value, lookup)
+            elif lookup in UPPER_BOUNDS:
+                if upper is None or value < upper[0] or value == upper[0] and lookup == 'lt':
+                    upper = (value, lookup)
+        if equal:
+            value = equal[0]
+            if any(v != value for v in equal[1:]):
+                return FALSE
+            if lower is not None and (value < lower[0] or value == lower[0] and lower[1] == 'gt'):
+                return FALSE
+            if upper is not None and (value > upper[0] or value == upper[0] and upper[1] == 'lt'):
+                return FALSE
+            return [(path, value)]
+        if lower is not None and upper is not None:
+            if lower[0] > upper[0]:
+                return FALSE
+            if lower[0] == upper[0]:
+                if lower[1] == 'gt' or upper[1] == 'lt':
+                    return FALSE
+                return [(path, lower[0])]
+            if lower[1] == 'gte' and upper[1] == 'lte':
+                return [('{}__range'.format(path), (lower[0], upper[0]))]
+    except TypeError:
+        return None
+    return [('{}__{}'.format(path, bound[1]), bound[0]) for bound in (lower, upper) if bound is not None]
+
+
+def merge_conjuncts(children):
+    """
+    Merges the numeric and temporal ranges of every path in a conjunction into __range
+    or a tighter bound.
+    """
+    groups = {}
+    for child in children:
+        if isinstance(child, tuple) and is_ordered(child[1]):
+            path, lookup = split_lookup(child[0])
+            if lookup == 'exact' or lookup in LOWER_BOUNDS or lookup in UPPER_BOUNDS:
+                groups.setdefault(path, []).append((lookup, child[1]))
+    replacements = {}
+    for path, terms in groups.items():
+        if len(terms) < 2:
+            continue
+        merged = merge_bounds(path, terms)
+        if merged is FALSE:
+            return FALSE
+        if merged is not None:
+            replacements[path] = merged
+    result = []
+    done = set()
+    for child in children:
+        if isinstance(child, tuple) and is_ordered(child[1]):
+            path, lookup = split_lookup(child[0])
+            if path in replacements and (lookup == 'exact' or lookup in LOWER_BOUNDS or lookup in UPPER_BOUNDS):
+                if path not in done:
+                    result.extend(replacements[path])
+                    done.add(path)
+                continue
+        result.append(child)
+    return result
+
+
+def optimize_q(q_expr):
+    """
+    Rewrites a Q tree into an equivalent, index friendlier one: nested same-connector
+    nodes are flattened into one n-ary node, duplicates are dropped, equality
+    disjunctions on one path become `__in`, numeric and temporal bounds on one path in
+    a conjunction are merged into `__range` (or the tightest bound), and contradictory
+    conjunctions become an always-false predicate. String bounds are left alone, the
+    database collation decides how they compare.
+    """
+    children = []
+    for child in q_expr.children:
+        if isinstance(child, models.Q):
+            child = optimize_q(child)
+            if is_true(child):
+                if q_expr.connector == models.Q.OR:
+                    return constant(True, q_expr.negated)
+                continue
+            if child == FALSE:
+                if q_expr.connector == models.Q.AND:
+                    return constant(False, q_expr.negated)
+                continue
+            if not child.negated and (child.connector == q_expr.connector or len(child.children) == 1):
+                children.extend(child.children)
+                continue
+        children.append(child)
+    if not children:
+        # every child was dropped: all disjuncts false, or all conjuncts true
+        return constant(q_expr.connector == models.Q.AND, q_expr.negated)
+    children = dedupe(children)
+    if q_expr.connector == models.Q.AND:
+        children = merge_conjuncts(children)
+        if children is FALSE:
+            return constant(False, q_expr.negated)
+    else:
+        children = merge_disjuncts(children)
+    if len(children) == 1:
+        if isinstance(children[0], models.Q):
+            return ~children[0] if q_expr.negated else children[0]
+        return models.Q(children[0], _negated=q_expr.negated)
+    return models.Q(*children, _connector=q_expr.connector, _negated=q_expr.negated)
+
+
+def date_part_term(child):
+    """Returns (path, part, lookup, int value) for a date part comparison like ('created__year__gt', 1990)."""
+    if not isinstance(child, tuple) or not isinstance(child[0], DatePartKey) or not is_literal(child[1]):
+        return None
+    path, lookup = split_lookup(child[0])
+    if lookup not in ('exact', 'gt', 'gte', 'lt', 'lte'):
+        return None
+    path, _, part = path.rpartition('__')
+    if not path or part not in DATE_PARTS:
+        return None
+    try:
+        return path, part, lookup, int(child[1])
+    except (TypeError, ValueError):
+        return None
+
+
+def period(parts):
+    """Returns the [start, end) datetimes of a year/month/day/hour prefix, in the current time zone."""
+    start = datetime(parts[0], *(parts[1:3] + [1] * (3 - len(parts[:3]))), *parts[3:])
+    if len(parts) == 1:
+        end = start.replace(year=start.year + 1)
+    elif len(parts) == 2:
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    else:
+        end = start + (timedelta(days=1) if len(parts) == 3 else timedelta(hours=1))
+    if settings.USE_TZ:
+        current = timezone.get_current_timezone()
+        return timezone.make_aware(start, current), timezone.make_aware(end, current)
+    return start, end
+
+
+def sargable_terms(path, terms):
+    """
+    Rewrites the date part terms of one path in a conjunction into range terms on the raw
+    column. Returns the range terms and the (part, lookup) of the terms they replace; the
+    other terms on the path stay as they are, or FALSE when the terms can't all hold.
+    """
+    exact = {}
+    for part, lookup, value in terms:
+        if lookup == 'exact':
+            if exact.get(part, value) != value:
+                return FALSE, set()
+            exact[part] = value
+    parts = []
+    for part in DATE_PARTS:
+        if part not in exact:
+            break
+        parts.append(exact[part])
+    used = {(part, 'exact') for part in DATE_PARTS[:len(parts)]}
+    rewritten = []
+    try:
+        if parts:
+            start, end = period(parts)
+            rewritten += [('{}__gte'.format(path), start), ('{}__lt'.format(path), end)]
+        elif len(terms) == 1 and terms[0][0] == 'year':
+            _, lookup, year = terms[0]
+            start, end = period([year])
+            bound = {'gt': ('gte', end), 'gte': ('gte', start), 'lt': ('lt', start), 'lte': ('lt', end)}[lookup]
+            rewritten.append(('{}__{}'.format(path, bound[0]), bound[1]))
+            used.add(('year', lookup))
+    except (ValueError, OverflowError):
+        # an impossible date, e.g. month 13, matches no row
+        return FALSE, used
+    return rewritten, used
+
+
+def sargable_conjunction(children):
+    """Rewrites the date part terms of a conjunction; returns the new children or FALSE."""
+    groups = {}
+    for child in children:
+        term = date_part_term(child)
+        if term is not None:
+            groups.setdefault(term[0], []).append(term[1:])
+    replacements = {}
+    for path, terms in groups.items():
+        rewritten, used = sargable_terms(path, terms)
+        if rewritten is FALSE:
+            return FALSE
+        if used:
+            replacements[path] = (rewritten, used)
+    result = []
+    for child in children:
+        term = date_part_term(child)
+        if term is not None and term[0] in replacements and term[1:3] in replacements[term[0]][1]:
+            result.extend(replacements[term[0]][0])
+            replacements[term[0]] = ([], replacements[term[0]][1])
+            continue
+        result.append(child)
+    return result
+
+
+def sargable_q(q_expr):
+    """
+    Rewrites date part comparisons into half-open ranges on the raw column, so they can
+    use an index: `year(d) eq 1990 and month(d) eq 5` becomes `d >= 1990-05-01 and
+    d < 1990-06-01`, and `year(d) gt 1990` becomes `d >= 1991-01-01`. Year, month, day
+    and hour equalities are combined as long as they form a prefix of that list; other
+    date part terms, ranges on the combined parts included, are left as they are.
+    Conflicting equalities on one part match no row.
+    """
+    children = [sargable_q(c) if isinstance(c, models.Q) else c for c in q_expr.children]
+    connector = models.Q.AND if len(children) == 1 else q_expr.connector
+    if connector == models.Q.AND:
+        children = sargable_conjunction(children)
+        if children is FALSE:
+            return constant(False, q_expr.negated)
+    else:
+        rewritten = []
+        for child in children:
+            if date_part_term(child) is not None:
+                terms = sargable_conjunction([child])
+                child = terms if terms is FALSE else models.Q(*terms) if len(terms) > 1 else terms[0]
+            rewritten.append(child)
+        children = rewritten
+    return models.Q(*children, _connector=connector, _negated=q_expr.negated)
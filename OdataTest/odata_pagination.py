@@ -0,0 +1,129 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from OdataTest.odata_param_parser import ODataException, apply_params, django_params
+
+
+Page = namedtuple('Page', ['rows', 'skiptoken'])
+# the JSON scalars a $skiptoken may carry as sort key values; sort keys aren't nullable
+SEEK_VALUE_TYPES = (str, int, float, bool)
+
+
+def encode_skiptoken(data) -> str:
+    raw = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_skiptoken(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise ODataException("invalid $skiptoken '{}'".format(token))
+    if not isinstance(data, dict):
+        raise ODataException("invalid $skiptoken '{}'".format(token))
+    return data
+
+
+class KeysetPagination:
+    """
+    Seek pagination driven by an opaque $skiptoken instead of $skip.
+
+    The $orderby ordering gets a primary key tie-breaker so it is total, each page
+    is fetched with one extra row to know whether another page exists, and the
+    $skiptoken handed out with a page carries the sort key values of its last row.
+    The next page turns them into a `(k1, k2) > (v1, v2)` predicate, expanded into
+    `k1 > v1 or (k1 = v1 and k2 > v2)` so mixed asc/desc orderings work on every
+    backend. Sort keys are expected to be non-nullable.
+
+    `max_page_size` is the server-enforced odata.maxpagesize: no page is ever larger,
+    whatever $top asks for.
+    """
+
+    def __init__(self, max_page_size=None, tie_breaker='pk'):
+        self.max_page_size = max_page_size
+        self.tie_breaker = tie_breaker
+
+    def ordering(self, order_by):
+        ordering = [(o.lstrip('-'), o.startswith('-')) for o in order_by]
+        if self.tie_breaker not in [field for field, _ in ordering]:
+            ordering.append((self.tie_breaker, False))
+        return ordering
+
+    def plan(self, param_dict, order_by):
+        """Returns (ordering, seek values, page size, $top left after this page)."""
+        if '$skip' in param_dict:
+            raise ODataException("$skip is not supported with keyset pagination, use $skiptoken")
+        ordering = self.ordering(order_by)
+        top = param_dict.get('$top') and int(param_dict['$top'])
+        values = None
+        if param_dict.get('$skiptoken'):
+            token = decode_skiptoken(param_dict['$skiptoken'])
+            values = token.get('v')
+            if token.get('o') != [field for field, _ in ordering] or not isinstance(values, list) \
+                    or len(values) != len(ordering):
+                raise ODataException("$skiptoken does not match $orderby")
+            top = token.get('t')
+            # the token comes from the client: its values end up in the seek predicate and the slice
+            if any(not isinstance(v, SEEK_VALUE_TYPES) for v in values) \
+                    or top is not None and (isinstance(top, bool) or not isinstance(top, int) or top < 0):
+                raise ODataException("invalid $skiptoken '{}'".format(param_dict['$skiptoken']))
+        page_size = min([size for size in (top, self.max_page_size) if size is not None], default=None)
+        remaining = top - page_size if top is not None else None
+        return ordering, values, page_size, remaining
+
+    @staticmethod
+    def seek_predicate(ordering, values):
+        q_expr = None
+        for i, (field, desc) in enumerate(ordering):
+            term = models.Q(**{'{}__{}'.format(field, 'lt' if desc else 'gt'): values[i]})
+            for j in range(i):
+                term &= models.Q(**{ordering[j][0]: values[j]})
+            q_expr = term if q_expr is None else q_expr | term
+        return q_expr
+
+    def seek(self, param_dict, params) -> dict:
+        rv = dict(params)
+        ordering, values, page_size, _ = self.plan(param_dict, params.get('order_by', []))
+        rv['order_by'] = ['-' + field if desc else field for field, desc in ordering]
+        if values is not None:
+            predicate = self.seek_predicate(ordering, values)
+            rv['filter'] = rv['filter'] & predicate if 'filter' in rv else predicate
+        for key in ('values', 'only'):
+            if key in rv:
+                # the sort keys of the last row must be readable to build the next $skiptoken
+                rv[key] = rv[key] + [field for field, _ in ordering if field not in rv[key]]
+        if page_size is not None:
+            rv['__getitem__'] = slice(None, page_size + 1)
+        return rv
+
+    @staticmethod
+    def row_value(row, field):
+        if isinstance(row, dict):
+            return row[field]
+        for attr in field.split('__'):
+            row = getattr(row, attr)
+        return row
+
+    def paginate(self, queryset, param_dict, **kwargs) -> Page:
+        selected = django_params(param_dict, **kwargs)
+        params = self.seek(param_dict, selected)
+        ordering, _, page_size, remaining = self.plan(param_dict, params['order_by'])
+        rows = list(apply_params(queryset, params))
+        token = None
+        if page_size is not None and len(rows) > page_size and (remaining is None or remaining > 0):
+            rows = rows[:page_size]
+            token = encode_skiptoken({
+                'o': [field for field, _ in ordering],
+                'v': [self.row_value(rows[-1], field) for field, _ in ordering],
+                't': remaining,
+            })
+        if 'values' in selected:
+            # drop the sort keys `seek` read for the $skiptoken but $select left out
+            added = set(params['values']) - set(selected['values'])
+            if added:
+                rows = [{k: v for k, v in row.items() if k not in added} for row in rows]
+        return Page(rows[:page_size], token)
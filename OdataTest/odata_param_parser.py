@@ -1,62 +1,172 @@
+import copy
 import re
-from parsimonious.grammar import Grammar
+from django.core.exceptions import FieldDoesNotExist, FieldError
 from django.db import models
-from django.db.models import functions
+from django.db.models import functions, lookups
 import operator
-from datetime import datetime
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from OdataTest.odata_filter_cache import Slot, filter_cache
+from OdataTest.odata_grammar import get_grammar, parse as grammar_parse
+from OdataTest.odata_optimizer import DATE_PARTS, DatePartKey, optimize_q, sargable_q
 
 
 class ODataException(Exception):
     pass
 
 
-def django_params(param_dict):
+def __getattr__(name):
+    # `grammar` is built on first use, see odata_grammar
+    if name == 'grammar':
+        return get_grammar()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def django_params(param_dict, cache=filter_cache, processor=None, pagination=None, model=None, search=None):
     rv = {}
-    processor = FilterProcessor()
+    processor = processor or FilterProcessor()
+    if '$apply' in param_dict:
+        if '$expand' in param_dict:
+            raise ODataException("$expand doesn't apply to the rows of $apply")
+        rv.update(processor.apply(param_dict['$apply'], cache=cache))
+        if '$filter' in param_dict and rv["apply"] and rv["apply"][-1][0] == 'topcount':
+            raise ODataException("$filter can't follow a topcount transformation")
+        aggregated = [step for step in rv["apply"] if step[0] == 'aggregate']
+        if aggregated:
+            # $filter, $orderby and $select address the aggregated rows, not the model
+            processor = processor.for_model(None, aggregated_columns(aggregated[0])).inlined()
     if '$filter' in param_dict:
-        rv.update(processor.process(param_dict['$filter']))
+        filter_text = param_dict['$filter']
+        info = {}
+        if processor.instrumentation is not None:
+            info = {"filter": filter_text, "cached": cache is not None}
+        with processor.phase('filter', **info) as info:
+            if cache is None:
+                rv.update(processor.process(filter_text))
+            else:
+                rv.update(cache.process(processor, filter_text, info=info))
+    if '$search' in param_dict:
+        if search is None:
+            raise ODataException("$search is not supported here")
+        searched = search.params(param_dict['$search'])
+        if "filter" in rv:
+            searched["filter"] = rv["filter"] & searched["filter"]
+        if "annotate" in rv and "annotate" in searched:
+            searched["annotate"] = dict(rv["annotate"], **searched["annotate"])
+        if "defer" in rv and "defer" in searched:
+            searched["defer"] = deferred_names(rv) + deferred_names(searched)
+        rv.update(searched)
     if '$orderby' in param_dict:
         rv.update(processor.order_by(param_dict['$orderby']))
     if '$select' in param_dict:
         rv.update(processor.select(param_dict['$select']))
-    if '$top' in param_dict or "$skip" in param_dict:
+    if '$expand' in param_dict:
+        if model is None:
+            raise ODataException("$expand needs the model of the queried entity set")
+        expanded = processor.expand(param_dict['$expand'], model, cache=cache)
+        only = expanded.pop("only")
+        rv.update(expanded)
+        if "values" in rv:
+            # expanded rows are attached to model instances, so $select narrows the columns instead
+            rv["only"] = rv.pop("values") + only
+    if pagination is not None:
+        rv = pagination.seek(param_dict, rv)
+    elif '$top' in param_dict or "$skip" in param_dict:
         rv.update(processor.get_slice(param_dict))
     return rv
 
 
-grammar = Grammar(
-    """
-    bool_common_expr     = (not_expr / common_expr ) ( and_expr / or_expr )?
-    rel_expr             = (function_param / function_expr) RWS rel_marker RWS function_param 
-    math_expr            = function_param RWS math_marker RWS number
-    rel_marker           = 'eq' / 'ne' / 'lt' / 'le' / 'gt' / 'ge'
-    common_expr          = paren_expr / function_marker_expr / function_expr / rel_expr
-    function_marker_expr = (function_expr / math_expr) RWS rel_marker RWS (string / number)
-    function_expr        = func_name "(" ~"\s*" function_param  (~"\s*,\s*" function_param)* ~"\s*" ")"
-    func_name            = ~"\w+"
-    select_path          = ~"[a-zA-Z][\w/]*"
-    number               = "-"? ~"[\d\.]+"
-    string               = "'" ~"[^']+" "'"
-    json_primitive       = "true" / "false" / "null"
-    function_param       = function_expr / number / string / datetime / json_primitive / select_path
-    datetime             = 'datetime'string
-    paren_expr           = "(" ~"\s*" bool_common_expr ~"\s*" ")"
-    not_expr             = 'not' RWS? bool_common_expr?
-    math_marker          = 'mod' / 'div' / 'mul' / 'sub' / 'add' / 'sqrt'
-    and_expr             = RWS 'and' RWS bool_common_expr
-    or_expr              = RWS 'or' RWS bool_common_expr
-    RWS                  = ~"\s+"
-    """
-)
+def deferred_names(params) -> tuple:
+    """The names `params["defer"]` leaves out of the SELECT, one name or a tuple of them."""
+    deferred = params.get("defer")
+    if deferred is None:
+        return ()
+    return (deferred,) if isinstance(deferred, str) else tuple(deferred)
+
+
+def apply_params(queryset, params):
+    if "apply" in params:
+        queryset = apply_transformations(queryset, params["apply"])
+    deferred = deferred_names(params)
+    annotations = params.get("annotate", {})
+    if annotations:
+        # a deferred annotation only serves the filter: alias() leaves it out of the SELECT
+        queryset = queryset.annotate(**{k: v for k, v in annotations.items() if k not in deferred})
+        aliases = {k: v for k, v in annotations.items() if k in deferred}
+        if aliases:
+            queryset = queryset.alias(**aliases)
+    if "filter" in params:
+        queryset = queryset.filter(params["filter"])
+    fields = [name for name in deferred if name not in annotations]
+    if fields and "values" not in params:
+        queryset = queryset.defer(*fields)
+    if "select_related" in params:
+        queryset = queryset.select_related(*params["select_related"])
+    if "prefetch_related" in params:
+        queryset = queryset.prefetch_related(*params["prefetch_related"])
+    if "only" in params:
+        queryset = queryset.only(*params["only"])
+    if "order_by" in params:
+        queryset = queryset.order_by(*params["order_by"])
+    if "values" in params:
+        queryset = queryset.values(*params["values"])
+    if "__getitem__" in params:
+        queryset = queryset[params["__getitem__"]]
+    return queryset
+
+
+def aggregated_columns(step) -> list:
+    """The properties of the rows of an aggregate step: its grouping paths and its aliases."""
+    _, paths, aggregates = step
+    return [*(paths or ()), *aggregates]
+
+
+def apply_transformations(queryset, steps):
+    try:
+        return transform(queryset, steps)
+    except (FieldError, ValueError) as exc:
+        raise ODataException(str(exc))
+
+
+def transform(queryset, steps):
+    for step in steps:
+        if step[0] == 'filter':
+            queryset = apply_params(queryset, step[1])
+        elif step[0] == 'aggregate':
+            _, paths, aggregates = step
+            if paths is None:
+                # a constant grouping key leaves GROUP BY out: one row over all the input rows
+                queryset = queryset.annotate(**{APPLY_ALL_ALIAS: models.Value(1)}).values(APPLY_ALL_ALIAS)
+                paths = []
+            else:
+                queryset = queryset.values(*paths)
+            if aggregates:
+                queryset = queryset.annotate(**aggregates).values(*paths, *aggregates)
+            else:
+                queryset = queryset.distinct()
+            queryset = queryset.order_by()
+        elif step[0] == 'topcount':
+            _, count, expression = step
+            query = queryset.query
+            columns = [*query.values_select, *query.annotation_select]
+            # a window rank instead of a slice keeps $orderby, $top and $skip applicable
+            queryset = queryset.annotate(**{
+                APPLY_RANK_ALIAS: models.Window(functions.RowNumber(), order_by=expression.desc())
+            }).filter(**{APPLY_RANK_ALIAS + '__lte': count})
+            if queryset._fields is not None:
+                queryset = queryset.values(*columns)
+    return queryset
+
 
 function_param = ['select_path', 'number', 'string', 'datetime', 'json_primitive']
 good_children = {
     'bool_common_expr': ['not_expr', 'common_expr', 'and_expr', 'or_expr'],
-    'common_expr': ['paren_expr', 'function_marker_expr', 'function_expr', 'rel_expr'],
+    'common_expr': ['paren_expr', 'lambda_expr', 'function_marker_expr', 'function_expr', 'rel_expr'],
     'function_expr': ['func_name', 'function_expr'] + function_param,
     'function_marker_expr': ['func_name', 'rel_marker', 'function_expr', 'math_expr'] + function_param,
     'rel_expr': ['rel_marker', 'function_expr'] + function_param,
     'paren_expr': ['bool_common_expr'],
+    'lambda_expr': ['lambda_path', 'lambda_variable', 'bool_common_expr'],
     'or_expr': ['bool_common_expr'],
     'and_expr': ['bool_common_expr'],
     'not_expr': ['bool_common_expr'],
@@ -64,42 +174,488 @@ good_children = {
 }
 
 
+AGGREGATE_METHODS = {
+    'sum': models.Sum,
+    'min': models.Min,
+    'max': models.Max,
+    'average': models.Avg,
+    'countdistinct': lambda expression: models.Count(expression, distinct=True),
+}
+APPLY_ALL_ALIAS = 'odata_all'
+APPLY_RANK_ALIAS = 'odata_rank'
+EXPRESSION_LOOKUPS = {
+    'eq': lookups.Exact,
+    'ne': lookups.Exact,
+    'gt': lookups.GreaterThan,
+    'ge': lookups.GreaterThanOrEqual,
+    'lt': lookups.LessThan,
+    'le': lookups.LessThanOrEqual,
+}
+BOOL_OPERATORS = {
+    'not': lambda a, b: {"filter": ~a['filter']},
+    'and': lambda a, b: FilterProcessor.merge_dicts(a, b, operator.and_),
+    'or': lambda a, b: FilterProcessor.merge_dicts(a, b, operator.or_),
+}
+ARGUMENT_TYPES = ('string', 'number', 'date', 'time', 'any')
+
+
+class ODataFunction:
+    """
+    A $filter function. `arg_types` are the types of its arguments, out of ARGUMENT_TYPES;
+    the last `optional` ones may be left out and with `variadic` the last one repeats.
+    `expression` builds the database function from the argument expressions. A function
+    with a `lookup` becomes that transform or lookup on its property argument at
+    `path_index` instead, so `length(Name) eq 5` stays the plain `Name__length` filter
+    the optimizer and indexes see. The model-bound processor checks property arguments
+    against the types and converts literal ones.
+    """
+
+    def __init__(self, name, arg_types, expression, lookup=None, path_index=0, optional=0, variadic=False):
+        unknown = set(arg_types) - set(ARGUMENT_TYPES)
+        if unknown:
+            raise ValueError("unknown argument types {} for function {}".format(sorted(unknown), name))
+        self.name = name
+        self.arg_types = tuple(arg_types)
+        self.expression = expression
+        self.lookup = lookup
+        self.path_index = path_index
+        self.optional = optional
+        self.variadic = variadic
+
+    def arg_type(self, index):
+        return self.arg_types[min(index, len(self.arg_types) - 1)]
+
+    def check(self, params):
+        required = len(self.arg_types) - self.optional
+        if len(params) < required or not self.variadic and len(params) > len(self.arg_types):
+            if self.variadic:
+                expected = 'at least {}'.format(required)
+            elif self.optional:
+                expected = '{} to {}'.format(required, len(self.arg_types))
+            else:
+                expected = str(required)
+            raise ODataException("function {} takes {} arguments, got {}".format(self.name, expected, len(params)))
+
+
+class TransformPath(str):
+    """
+    A property under the transforms of functions, like 'Name__trim__lower', with the
+    `expression` computing it, which stands for it as the argument of another function.
+    """
+
+    def __new__(cls, text, expression=None):
+        path = super().__new__(cls, text)
+        path.expression = expression
+        return path
+
+
+def indexof(string, substring):
+    # StrIndex counts from 1 and gives 0 for a miss, OData counts from 0 and gives -1
+    return functions.StrIndex(string, substring) - 1
+
+
+def substring_start(start):
+    if isinstance(start, (int, float)) and start < 0:
+        raise ODataException("substring position must not be negative")
+    return start
+
+
+def substring(string, start, length=None):
+    # Substr only checks plain positions, and the start arrives as a Value, of a slot in a cached template
+    if isinstance(start, models.Value):
+        value = start.value
+        start = models.Value(value.map(substring_start) if isinstance(value, Slot) else substring_start(value))
+    return functions.Substr(string, start + 1, length)
+
+
+FUNCTIONS = {}
+
+
+def register_function(name, arg_types, expression, **kwargs) -> ODataFunction:
+    """
+    Makes `name` available in $filter, see ODataFunction for the arguments:
+
+        register_function('log', ('number',), functions.Ln)
+
+    Registering an existing name replaces it, which empties the default filter cache.
+    """
+    if name in FUNCTIONS:
+        filter_cache.clear()
+    function = FUNCTIONS[name] = ODataFunction(name, arg_types, expression, **kwargs)
+    return function
+
+
+register_function('contains', ('string', 'string'), lookups.Contains, lookup='contains')
+register_function('endswith', ('string', 'string'), lookups.EndsWith, lookup='endswith')
+register_function('startswith', ('string', 'string'), lookups.StartsWith, lookup='startswith')
+register_function('substringof', ('string', 'string'), lambda sub, string: lookups.Contains(string, sub),
+                  lookup='contains', path_index=1)
+register_function('length', ('string',), functions.Length, lookup='length')
+register_function('tolower', ('string',), functions.Lower, lookup='lower')
+register_function('toupper', ('string',), functions.Upper, lookup='upper')
+register_function('trim', ('string',), functions.Trim, lookup='trim')
+register_function('year', ('date',), functions.ExtractYear, lookup='year')
+register_function('month', ('date',), functions.ExtractMonth, lookup='month')
+register_function('day', ('date',), functions.ExtractDay, lookup='day')
+register_function('hour', ('time',), functions.ExtractHour, lookup='hour')
+register_function('minute', ('time',), functions.ExtractMinute, lookup='minute')
+register_function('second', ('time',), functions.ExtractSecond, lookup='second')
+register_function('ceiling', ('number',), functions.Ceil, lookup='ceil')
+register_function('floor', ('number',), functions.Floor, lookup='floor')
+register_function('round', ('number',), functions.Round, lookup='round')
+register_function('abs', ('number',), functions.Abs, lookup='abs')
+register_function('concat', ('any', 'any'), functions.Concat, variadic=True)
+register_function('indexof', ('string', 'string'), indexof)
+register_function('replace', ('string', 'string', 'string'), functions.Replace)
+register_function('substring', ('string', 'number', 'number'), substring, optional=1)
+register_function('sqrt', ('number',), functions.Sqrt)
+register_function('power', ('number', 'number'), functions.Power)
+register_function('mod', ('number', 'number'), functions.Mod)
+
+
+class RelatedExists(models.Expression):
+    """
+    True when the to-many navigation `path` (`orders` style) has a row matching
+    `condition`, or with `all`, when none of its rows fails it: the any/all lambda
+    operators. Resolved against the model of the query into a correlated EXISTS
+    subquery, so parents are neither multiplied by their children nor need DISTINCT.
+    """
+    output_field = models.BooleanField()
+
+    def __init__(self, path, condition=None, all=False):
+        super().__init__()
+        self.path = path
+        self.condition = condition
+        self.all = all
+
+    def __repr__(self):
+        return '{}({!r}, {!r}, all={})'.format(type(self).__name__, self.path, self.condition, self.all)
+
+    @staticmethod
+    def reverse_path(model, path):
+        """Returns the model at the end of `path` and the lookup leading from it back to `model`."""
+        names = []
+        many = False
+        for name in path.split('__'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ODataException("'{}' has no navigation property '{}'".format(model.__name__, name))
+            if not field.is_relation:
+                raise ODataException("'{}' is not a navigation property of '{}'".format(name, model.__name__))
+            reverse = field.field.name if isinstance(field, models.ForeignObjectRel) else field.related_query_name()
+            names.insert(0, reverse)
+            many = many or field.one_to_many or field.many_to_many
+            model = field.related_model
+        if not many:
+            raise ODataException("any and all apply to collections, '{}' is not one".format(path.replace('__', '/')))
+        return model, '__'.join(names)
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        related_model, link = self.reverse_path(query.model, self.path)
+        queryset = related_model._default_manager.filter(**{link: models.OuterRef('pk')})
+        if self.condition is not None:
+            queryset = queryset.filter(~self.condition if self.all else self.condition)
+        exists = models.Exists(queryset)
+        return (~exists if self.all else exists).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+
+
+class SlicedPrefetch(models.Prefetch):
+    """
+    Prefetch of `queryset[page]`, which Django slices per parent with a window function.
+    The related managers filter the unsliced `queryset` to hold the prefetched rows,
+    as filtering a sliced queryset isn't allowed.
+    """
+
+    def __init__(self, lookup, queryset, page):
+        super().__init__(lookup, queryset=queryset)
+        self.page = page
+
+    def get_current_querysets(self, level):
+        querysets = super().get_current_querysets(level)
+        return querysets and [queryset[self.page] for queryset in querysets]
+
+
 class FilterProcessor:
+    slots = None
+    # whether literals are checked and converted against the properties they're compared with
+    coerces_literals = False
+    # the variable and navigation path of the lambda expression being translated
+    lambda_variable = None
+    path_prefix = ''
+    # the properties of the aggregated $apply rows, the only paths a processor for them accepts
+    columns = None
+
+    def __init__(self, parser=None, cost_model=None, optimize=False, sargable=False, recorder=None,
+                 instrumentation=None, inline_expressions=False):
+        self.parser = parser or grammar_parse
+        self.cost_model = cost_model
+        self.optimize = optimize
+        self.sargable = sargable
+        self.recorder = recorder
+        self.instrumentation = instrumentation
+        self.inline_expressions = inline_expressions
+
+    def for_model(self, model, columns=()):
+        """
+        The processor for the options of an expanded navigation property, or for the
+        aggregated rows of $apply, with the properties `columns`, when `model` is None.
+        """
+        if model is None:
+            processor = copy.copy(self)
+            processor.columns = frozenset(columns)
+            return processor
+        return self
+
+    def cache_key(self):
+        return type(self), self.cost_model, self.inline_expressions, self.columns
+
+    def check_column(self, path):
+        if self.columns is not None and path not in self.columns:
+            raise ODataException("'{}' is not a property of the aggregated rows".format(path.replace('__', '/')))
+        return path
+
+    def phase(self, name, **info):
+        if self.instrumentation is None:
+            return nullcontext(info)
+        return self.instrumentation.phase(name, **info)
+
+    @staticmethod
+    def count_nodes(tree):
+        count = 0
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    def record(self, kind, fields, op, function=None):
+        if self.recorder is not None:
+            self.recorder.record(kind, self.path_prefix + self.field_mapper(fields), op, function)
+
     def order_by(self, order_param) -> dict:
         terms = order_param.split(',')
         final = []
         for t in terms:
             term, *direction = re.split(r'\s+', t)
-            ordering = self.field_mapper(term)
+            ordering = self.check_column(self.field_mapper(term))
+            self.record('order', ordering, direction[0] if direction else 'asc')
             if direction and direction[0] == 'desc':
                 ordering = '-%s' % ordering
             final.append(ordering)
         return {"order_by": final}
 
-    @staticmethod
-    def select(select_param) -> dict:
+    def select(self, select_param) -> dict:
         terms = select_param.split(',')
         final = []
         for t in terms:
             term = t.strip().replace("/", "__")
-            final.append(term)
+            final.append(self.check_column(term))
         return {"values": final}
 
+    @staticmethod
+    def split_options(text, separator):
+        parts = []
+        current = []
+        depth = 0
+        quoted = False
+        for char in text:
+            if char == "'":
+                quoted = not quoted
+            elif not quoted and char == '(':
+                depth += 1
+            elif not quoted and char == ')':
+                depth -= 1
+            if char == separator and not depth and not quoted:
+                parts.append(''.join(current))
+                current = []
+            else:
+                current.append(char)
+        parts.append(''.join(current))
+        return [p.strip() for p in parts if p.strip()]
+
+    @staticmethod
+    def resolve_path(model, path):
+        many = False
+        for name in path.split('/'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ODataException("'{}' has no navigation property '{}'".format(model.__name__, name))
+            if not field.is_relation:
+                raise ODataException("'{}' is not a navigation property of '{}'".format(name, model.__name__))
+            many = many or field.one_to_many or field.many_to_many
+            model = field.related_model
+            last = field
+        return last, model, many
+
+    def expand(self, expand_param, model, prefix='', cache=None) -> dict:
+        rv = {"select_related": [], "prefetch_related": [], "only": []}
+        for item in self.split_options(expand_param, ','):
+            match = re.match(r'([\w/]+)\s*(?:\((.*)\))?$', item, re.S)
+            if match is None:
+                raise ODataException("invalid $expand item '{}'".format(item))
+            path, options_text = match.groups()
+            options = {}
+            for option in self.split_options(options_text or '', ';'):
+                name, _, value = option.partition('=')
+                options[name.strip()] = value.strip()
+            field, related_model, many = self.resolve_path(model, path)
+            lookup = prefix + self.field_mapper(path)
+            if not many:
+                if set(options) - {'$select', '$expand'}:
+                    raise ODataException("only $select and $expand apply to the to-one path '{}'".format(path))
+                rv["select_related"].append(lookup)
+                if '$select' in options:
+                    rv["only"].extend('{}__{}'.format(lookup, f) for f in self.select(options['$select'])['values'])
+                else:
+                    rv["only"].append(lookup)
+                if '$expand' in options:
+                    nested = self.expand(options['$expand'], related_model, lookup + '__', cache)
+                    for key in rv:
+                        rv[key].extend(nested[key])
+                continue
+            params = django_params(options, cache=cache, processor=self.for_model(related_model), model=related_model)
+            if "values" in params:
+                params["only"] = params.pop("values")
+            if "only" in params and field.one_to_many:
+                # the reverse foreign key is needed to attach the rows to their parents
+                params["only"].append(field.field.name)
+            page = params.pop("__getitem__", None)
+            if page is not None and "order_by" not in params:
+                # $top/$skip apply to the related rows of every parent, in a stable order
+                params["order_by"] = ["pk"]
+            queryset = apply_params(related_model._default_manager.all(), params)
+            if page is None:
+                rv["prefetch_related"].append(models.Prefetch(lookup, queryset=queryset))
+            else:
+                rv["prefetch_related"].append(SlicedPrefetch(lookup, queryset, page))
+        return rv
+
+    def apply(self, apply_param, cache=None) -> dict:
+        steps = []
+        aggregated = None
+        for transformation in self.split_options(apply_param, '/'):
+            match = re.match(r'(\w+)\s*\((.*)\)$', transformation, re.S)
+            if match is None:
+                raise ODataException("invalid $apply transformation '{}'".format(transformation))
+            name, args_text = match.groups()
+            args = self.split_options(args_text, ',')
+            if steps and steps[-1][0] == 'topcount':
+                raise ODataException("topcount must be the last $apply transformation")
+            if name == 'filter':
+                processor = (self if aggregated is None else aggregated).inlined()
+                result = processor.process(args_text) if cache is None else cache.process(processor, args_text)
+                steps.append(('filter', {k: v for k, v in result.items() if k in ('annotate', 'filter')}))
+            elif name in ('aggregate', 'groupby'):
+                if aggregated is not None:
+                    raise ODataException("aggregating aggregated rows is not supported")
+                if name == 'aggregate':
+                    steps.append(('aggregate', None, self.aggregates(args)))
+                else:
+                    if not args or not args[0].startswith('(') or not args[0].endswith(')'):
+                        raise ODataException("groupby needs a list of properties, like groupby((Name))")
+                    paths = self.select(args[0][1:-1])["values"]
+                    aggregates = {}
+                    for arg in args[1:]:
+                        inner = re.match(r'aggregate\s*\((.*)\)$', arg, re.S)
+                        if inner is None:
+                            raise ODataException("unsupported groupby transformation '{}'".format(arg))
+                        aggregates.update(self.aggregates(self.split_options(inner.group(1), ','), paths))
+                    steps.append(('aggregate', paths, aggregates))
+                aggregated = self.for_model(None, aggregated_columns(steps[-1]))
+            elif name == 'topcount':
+                if len(args) != 2 or not args[0].isdigit() or not re.fullmatch(r'[a-zA-Z][\w/]*', args[1]):
+                    raise ODataException("topcount needs a count and a property, like topcount(5, Total)")
+                processor = self if aggregated is None else aggregated
+                steps.append(('topcount', int(args[0]), models.F(processor.check_column(processor.field_mapper(args[1])))))
+            else:
+                raise ODataException("unsupported $apply transformation '{}'".format(name))
+        return {"apply": steps}
+
+    def check_alias(self, alias, paths):
+        if alias in paths:
+            raise ODataException("the aggregate alias '{}' is also a grouping property".format(alias))
+
+    def aggregates(self, items, paths=()) -> dict:
+        rv = {}
+        for item in items:
+            match = re.match(r'(.+?)\s+with\s+(\w+)\s+as\s+(\w+)$', item, re.S)
+            if match is None:
+                count = re.match(r'\$count\s+as\s+(\w+)$', item)
+                if count is None:
+                    raise ODataException("invalid aggregate expression '{}'".format(item))
+                self.check_alias(count.group(1), paths)
+                rv[count.group(1)] = models.Count('*')
+                continue
+            expression, method, alias = match.groups()
+            self.check_alias(alias, paths)
+            if method not in AGGREGATE_METHODS:
+                raise ODataException("unsupported aggregation method '{}'".format(method))
+            rv[alias] = AGGREGATE_METHODS[method](self.aggregate_expression(expression))
+        return rv
+
+    def aggregate_expression(self, text):
+        """Translates the aggregated value of an `aggregate`, a property or an expression like `Price mul 2`."""
+        text = text.strip()
+        if re.fullmatch(r'[a-zA-Z][\w/]*', text):
+            return models.F(self.select(text)["values"][0])
+        from parsimonious.exceptions import ParseError
+        for rule in ('math_expr', 'function_expr'):
+            try:
+                node = get_grammar()[rule].parse(text)
+            except ParseError:
+                continue
+            result = getattr(self, rule)(node)["filter"]
+            if isinstance(result, str):
+                # a transform lookup like `Name__length` isn't a column to aggregate
+                expression = getattr(result, 'expression', None)
+                return models.F(result) if expression is None else expression
+            return result
+        raise ODataException("invalid aggregated expression '{}'".format(text))
+
     def process(self, filter_text: str):
-        parsed = grammar.parse(filter_text)
-        return self.bool_common_expr(parsed)
+        return self.finalize(self.translate(filter_text))
+
+    def finalize(self, result: dict) -> dict:
+        if self.sargable and isinstance(result.get("filter"), models.Q):
+            result["filter"] = sargable_q(result["filter"])
+        if self.optimize and isinstance(result.get("filter"), models.Q):
+            result["filter"] = optimize_q(result["filter"])
+        return result
+
+    def translate(self, filter_text: str):
+        if self.cost_model is not None:
+            self.cost_model.check_text(filter_text)
+        try:
+            with self.phase('parse', text=filter_text) as info:
+                parsed = self.parser(filter_text)
+                if self.instrumentation is not None:
+                    info["nodes"] = self.count_nodes(parsed)
+            if self.cost_model is not None:
+                self.cost_model.check(parsed)
+            with self.phase('translate', text=filter_text):
+                return self.bool_common_expr(parsed)
+        except RecursionError:
+            raise ODataException("$filter is nested too deeply")
 
     @staticmethod
     def get_slice(param_dict) -> dict:
         skip = param_dict.get("$skip") and int(param_dict.get("$skip"))
         top = param_dict.get("$top") and int(param_dict.get("$top"))
-        top = top + skip if skip else top
+        top = top + skip if skip and top is not None else top
         return {"__getitem__": slice(skip, top)}
 
-    @staticmethod
-    def field_mapper(field):
+    def field_mapper(self, field):
         if isinstance(field, list):
-            return "__".join(field)
+            if self.lambda_variable is not None:
+                # paths inside a lambda expression start with its variable
+                if field[0] != self.lambda_variable or len(field) == 1:
+                    raise ODataException("'{}' must be a property of the lambda variable '{}'".format(
+                        '/'.join(field), self.lambda_variable))
+                field = field[1:]
+            return self.check_column("__".join(field))
         if isinstance(field, str):
             return field.replace("/", "__")
 
@@ -118,15 +674,24 @@ class FilterProcessor:
         return self.bool_common_expr(FilterProcessor.walk(node, node.expr_name)[0])
 
     def bool_common_expr(self, node):
-        front, *pieces = FilterProcessor.walk(node, 'bool_common_expr')
-        if front.expr_name == 'not_expr':
-            q_expr = self.bool_combine(self.unpack(front), 'not')
-        else:
-            q_expr = self.common_expr(front)
-        if pieces:
-            bin_expr = pieces[0]
-            addition = self.unpack(bin_expr)
-            q_expr = self.bool_combine(q_expr, 'and' if bin_expr.expr_name == 'and_expr' else 'or', addition)
+        # and/or chains are right-nested in the parse tree: follow them iteratively and
+        # combine from the right, which gives the same result without deep recursion
+        chain = []
+        while node is not None:
+            front, *pieces = FilterProcessor.walk(node, 'bool_common_expr')
+            if front.expr_name == 'not_expr':
+                q_expr = self.bool_combine(self.unpack(front), 'not')
+            else:
+                q_expr = self.common_expr(front)
+            node = op = None
+            if pieces:
+                bin_expr = pieces[0]
+                op = 'and' if bin_expr.expr_name == 'and_expr' else 'or'
+                node = FilterProcessor.walk(bin_expr, bin_expr.expr_name)[0]
+            chain.append((q_expr, op))
+        q_expr, _ = chain.pop()
+        for front_expr, op in reversed(chain):
+            q_expr = self.bool_combine(front_expr, op, q_expr)
         return q_expr
 
     @staticmethod
@@ -145,12 +710,40 @@ class FilterProcessor:
 
     @staticmethod
     def bool_combine(left_expr, op, right_expr=None):
-        ops = {
-            'not': lambda a, b: {"filter": ~a['filter']},
-            'and': lambda a, b: FilterProcessor.merge_dicts(a, b, operator.and_),
-            'or': lambda a, b: FilterProcessor.merge_dicts(a, b, operator.or_)
-        }
-        return ops[op](left_expr, right_expr)
+        return BOOL_OPERATORS[op](left_expr, right_expr)
+
+    def inlined(self):
+        """
+        The processor comparing computed expressions in place, for filters whose rows are
+        transformed afterwards ($apply), where the annotation alias would be selected,
+        grouped by or defined twice.
+        """
+        if self.inline_expressions:
+            return self
+        processor = copy.copy(self)
+        processor.inline_expressions = True
+        return processor
+
+    def lambda_processor(self, path, variable):
+        """The processor of the expression of a lambda operator over `path`, whose rows are `variable`."""
+        processor = copy.copy(self)
+        processor.lambda_variable = variable
+        processor.path_prefix = self.path_prefix + path + '__'
+        # the expression becomes the WHERE clause of a subquery, which annotations can't reach
+        processor.inline_expressions = True
+        return processor
+
+    def lambda_expr(self, node):
+        path_node, *rest = FilterProcessor.walk(node, 'lambda_expr')
+        collection, _, operator_name = path_node.text.rpartition('/')
+        path = self.field_mapper(collection.split('/'))
+        if not rest:
+            if operator_name == 'all':
+                raise ODataException("all needs a lambda expression")
+            return {"filter": models.Q(RelatedExists(path))}
+        variable, expression = rest
+        condition = self.lambda_processor(path, variable.text).bool_common_expr(expression)["filter"]
+        return {"filter": models.Q(RelatedExists(path, condition, all=operator_name == 'all'))}
 
     def common_expr(self, node):
         inner = FilterProcessor.walk(node, 'common_expr')[0]
@@ -169,19 +762,42 @@ class FilterProcessor:
             op = pieces[1].text
             fields = pieces[0].text.split('/')
             val = self.primitive(pieces[2])
+            self.record('filter', fields, 'null' if val is None else op)
             return self.basic_relation(fields, op, val)
         else:
             raise ODataException("unimplemented relation expression: '{}'".format(node.text))
 
-    def primitive(self, node):
-        if node.expr_name == 'string':
-            return node.children[1].text
-        elif node.expr_name == 'number':
-            dd = node.text
-            if '.' in dd:
-                return float(dd)
+    def literal_value(self, kind, text):
+        if kind == 'string':
+            return text[1:-1]
+        elif kind == 'number':
+            if '.' in text:
+                return float(text)
             else:
-                return int(dd)
+                return int(text)
+        elif kind == 'datetime':
+            if self.sargable:
+                return self.datetime_value(text)
+            return datetime.strptime(text, "datetime'%Y-%m-%dT%H:%M:%S'").timestamp()
+        raise ODataException("unmatched literal type '{}'".format(text))
+
+    @staticmethod
+    def datetime_value(text):
+        # keep an aware datetime the database can compare with the column as is
+        try:
+            value = datetime.fromisoformat(text[len("datetime'"):-1])
+        except ValueError:
+            raise ODataException("invalid datetime literal {}".format(text))
+        return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+    def literal(self, node):
+        if self.slots is not None:
+            return self.slots[node.start]
+        return self.literal_value(node.expr_name, node.text)
+
+    def primitive(self, node):
+        if node.expr_name in ('string', 'number', 'datetime'):
+            return self.literal(node)
         elif node.expr_name == 'json_primitive':
             cases = {
                 'true': True,
@@ -194,8 +810,6 @@ class FilterProcessor:
             return node.text
         elif node.expr_name == "math_marker":
             return node.text
-        elif node.expr_name == "datetime":
-            return datetime.strptime(node.text, "datetime'%Y-%m-%dT%H:%M:%S'").timestamp()
         raise ODataException("unmatched primitive type '{}'".format(node.text))
 
     def basic_relation(self, fields, op, value):
@@ -207,60 +821,85 @@ class FilterProcessor:
             if op in ('le', 'ge'):
                 op = op[0] + 'te'
             token = '{}__{}'.format(token, op)
+        if isinstance(fields, DatePartKey):
+            token = DatePartKey(token)
         q_expr = models.Q(**{token: value})
         if op == 'ne':
             q_expr = ~q_expr
         return {"filter": q_expr}
 
-    def basic_function(self, func_name, fields, *args, params=None):
-        converter_a = {
-            "contains": "contains",
-            "endswith": "endswith",
-            "startswith": "startswith",
-            "length": "length",
-            "year": "year",
-            "month": "month",
-            "day": "day",
-            "hour": "hour",
-            "minute": "minute",
-            "second": "second",
-            "tolower": "lower",
-            "toupper": "upper",
-            "trim": "trim",
-            "ceiling": "ceil",
-            "floor": "floor",
-            "round": "round",
-            "power": "power",        # TODO write the test for this
-            "sqtr": "sqtr",          # TODO write the test for this
-            "abs": "abs",            # TODO write the test for this
-            "mod": "mod"             # TODO write the test for this
-        }
-        converter_b = {
-            "string": lambda n: models.Value(n.text.strip("'")),
-            "select_path": lambda n: models.F(n.text.strip("'")),
-            "function_expr": self.function_expr
-        }
-        converted_value = converter_a.get(func_name)
-        if converted_value is not None:
-            token = self.field_mapper(fields)
-            token = f"{token}__{converted_value}"
-            if not args:
-                return {"filter": token}
-            return {"filter": models.Q(**{token: args[0]})}
-        if func_name == 'concat':
-            try:
-                params = [converter_b[i.expr_name](i) for i in params]
-                params = [i['filter'] if isinstance(i, dict) else i for i in params]
-                return {"filter": functions.Concat(*params)}
-            except KeyError as ke:
-                raise ODataException(f"type {ke} is not support for function concat")
-        elif func_name == "substringof":
-            token = self.field_mapper(args[0])
-            token = f"{token}__contains"
-            return {"filter": models.Q(**{token: fields})}
+    def expression_value(self, expression, value):
+        """The literal `value` compared with the computed `expression`, coerced by model-bound processors."""
+        return value
+
+    @staticmethod
+    def expression_relation(expression, op, value):
+        # a lookup on the expression itself stays in the WHERE clause, so any number of
+        # computed comparisons combine without annotations competing for one alias
+        if op not in EXPRESSION_LOOKUPS:
+            raise ODataException("unsupported comparison '{}'".format(op))
+        q_expr = models.Q(EXPRESSION_LOOKUPS[op](expression, models.Value(value)))
+        return ~q_expr if op == 'ne' else q_expr
+
+    def function(self, func_name):
+        function = FUNCTIONS.get(func_name)
+        if function is None:
+            raise ODataException("unknown function '{}'".format(func_name))
+        return function
+
+    @staticmethod
+    def is_path(value, param):
+        # a property, or a property under the transforms of nested functions like `Name__trim`
+        return param.expr_name == 'select_path' or param.expr_name == 'function_expr' and isinstance(value, str)
+
+    def function_argument(self, value, param):
+        """The database expression of the function argument `value` translated from `param`."""
+        if param.expr_name == 'select_path':
+            return models.F(self.field_mapper(value))
+        if param.expr_name == 'function_expr':
+            if isinstance(value, models.Q):
+                raise ODataException("'{}' can't be a function argument".format(param.text))
+            if isinstance(value, str):
+                # a transform lookup like `Name__lower` isn't a column other functions can take
+                expression = getattr(value, 'expression', None)
+                return models.F(value) if expression is None else expression
+            return value
+        return models.Value(value)
+
+    def basic_function(self, func_name, *args, params=None):
+        function = self.function(func_name)
+        path = args[function.path_index]
+        if function.lookup is not None and self.is_path(path, params[function.path_index]):
+            # a transform or lookup on the property keeps a plain filter the optimizer and indexes see
+            token = f"{self.field_mapper(path)}__{function.lookup}"
+            others = [(a, p) for i, (a, p) in enumerate(zip(args, params)) if i != function.path_index]
+            if not others:
+                expression = function.expression(self.function_argument(path, params[function.path_index]))
+                token_class = DatePartKey if function.lookup in DATE_PARTS else TransformPath
+                return {"filter": token_class(token, expression)}
+            value, param = others[0]
+            if param.expr_name in ('select_path', 'function_expr'):
+                value = self.function_argument(value, param)
+            self.record('filter', path, function.lookup)
+            return {"filter": models.Q(**{token: value})}
+        result = function.expression(*[self.function_argument(a, p) for a, p in zip(args, params)])
+        if isinstance(result, lookups.Lookup):
+            return {"filter": models.Q(result)}
+        return {"filter": result}
+
+    @staticmethod
+    def referenced_fields(expression):
+        if isinstance(expression, models.F):
+            return [expression.name]
+        fields = []
+        for source in expression.get_source_expressions():
+            fields.extend(FilterProcessor.referenced_fields(source))
+        return fields
 
     def function_expr(self, node):
         func_name, *params = FilterProcessor.walk(node, 'function_expr')
+        self.function(func_name.text).check(params)
+        # every argument, nested functions included, is translated once
         param_vals = [(p.text.split('/') if p.expr_name == 'select_path' else self.primitive(p)) for p in params]
         return self.basic_function(func_name.text, *param_vals, params=params)
 
@@ -269,7 +908,8 @@ class FilterProcessor:
         op, val = [(p.text.split('/') if p.expr_name == 'select_path' else self.primitive(p)) for p in params]
         if op == "div":
             op = "truediv"
-        return {"filter": getattr(operator, op)(models.F(func_name.text), val)}
+        field = func_name.text.split('/') if func_name.expr_name == 'select_path' else func_name.text
+        return {"filter": getattr(operator, op)(models.F(self.field_mapper(field)), val)}
 
     def function_marker_expr(self, node):
         func_name, *params = FilterProcessor.walk(node, 'function_marker_expr')
@@ -281,8 +921,18 @@ class FilterProcessor:
             raise ODataException(f"function_marker_expr doesn't support type {func_name.expr_name}")
         op, value = [self.primitive(i) for i in params]
         if isinstance(func_result['filter'], str):
+            path, _, function = func_result['filter'].rpartition('__')
+            self.record('filter', path, op, function)
             return self.basic_relation(func_result['filter'], op, value)
         else:
+            if self.recorder is not None:
+                names = FilterProcessor.walk(func_name, func_name.expr_name)
+                function = names[0].text if func_name.expr_name == 'function_expr' else names[1].text
+                for field in self.referenced_fields(func_result['filter']):
+                    self.record('filter', field, op, function)
+            value = self.expression_value(func_result['filter'], value)
+            if self.inline_expressions:
+                return {"filter": self.expression_relation(func_result['filter'], op, value)}
             result = {"defer": "annotated_value"}
             result.update(self.basic_relation(["annotated_value"], op, value))
             result.update(annotate={"annotated_value": func_result['filter']})
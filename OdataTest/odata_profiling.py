@@ -0,0 +1,186 @@
+import cProfile
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.db import connections
+from OdataTest.odata_filter_cache import lift_literals
+from OdataTest.odata_param_parser import apply_params
+
+
+class Instrumentation:
+    """
+    Timing hooks called around every phase of an OData request:
+
+    * `filter`: the whole $filter handling in django_params, cache lookup included;
+      info has the `filter` text and whether it is `cached`, and with the cache its
+      normalized `shape`, which `filter_shape` computes otherwise,
+    * `parse` and `translate`: the grammar parse and the walk into Q objects, which a
+      filter cache hit skips; `parse` info has the parsed `nodes` count,
+    * `apply`, `execute`, `compile` and `database`: see `evaluate`.
+
+    `start` is called with the phase name and its info dict, `stop` with the same and the
+    elapsed seconds; info collected during the phase is added to the dict before `stop`.
+    Phases nest, e.g. `parse` runs inside `filter`. Subclasses override `start`/`stop`.
+    """
+
+    def start(self, phase, info):
+        pass
+
+    @staticmethod
+    def filter_shape(info) -> str:
+        """The shape of the `filter` phase, lifted here when no filter cache did it."""
+        if "shape" not in info:
+            info["shape"] = lift_literals(info["filter"])[0]
+        return info["shape"]
+
+    def stop(self, phase, info, elapsed):
+        pass
+
+    @contextmanager
+    def phase(self, phase, **info):
+        self.start(phase, info)
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.stop(phase, info, time.perf_counter() - start)
+
+
+class PhaseTimer(Instrumentation):
+    """Aggregates the count, total and maximum time of every phase."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}
+
+    def stop(self, phase, info, elapsed):
+        with self._lock:
+            stat = self.phases.setdefault(phase, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+
+    def timings(self) -> dict:
+        with self._lock:
+            return {phase: {"count": c, "total": t, "max": m} for phase, (c, t, m) in self.phases.items()}
+
+
+class SlowRequestProfiler(Instrumentation):
+    """
+    Runs cProfile on a random `sample_rate` fraction of the requests and keeps the
+    `keep` slowest of them, with the phases they went through, until `dump`. Requests
+    that aren't sampled only pay for a random draw, so the profiler can stay enabled
+    in production.
+
+        profiler = SlowRequestProfiler(keep=10, sample_rate=0.01)
+        processor = FilterProcessor(instrumentation=profiler)
+        with profiler.request(request.get_full_path()):
+            params = django_params(request.GET, processor=processor)
+            rows = evaluate(queryset, params, profiler)
+    """
+
+    def __init__(self, keep=10, sample_rate=0.01, random=random.random):
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self.random = random
+        self._slowest = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def stop(self, phase, info, elapsed):
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            if phase == 'filter':
+                # only the sampled requests pay for the shape
+                self.filter_shape(info)
+            record["phases"].append(dict(info, phase=phase, elapsed=elapsed))
+
+    @contextmanager
+    def request(self, label=None):
+        if self.random() >= self.sample_rate:
+            yield None
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running in this thread
+            yield None
+            return
+        record = {"label": label, "phases": []}
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            profile.disable()
+            self._local.record = None
+            record["elapsed"] = time.perf_counter() - start
+            self._offer(record, profile)
+
+    def _offer(self, record, profile):
+        entry = (record["elapsed"], next(self._counter), record, profile)
+        with self._lock:
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """The kept (record, profile) pairs, the slowest first."""
+        with self._lock:
+            return [(record, profile) for _, _, record, profile in sorted(self._slowest, reverse=True)]
+
+    def dump(self, directory):
+        """Writes a `.prof` cProfile dump and a `.json` record for every kept request; returns the dump paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (record, profile) in enumerate(self.slowest()):
+            path = os.path.join(directory, 'slow-{:03d}.prof'.format(rank))
+            profile.dump_stats(path)
+            with open(path[:-len('.prof')] + '.json', 'w') as f:
+                json.dump(record, f, indent=2, default=str)
+            paths.append(path)
+        return paths
+
+    def clear(self):
+        with self._lock:
+            self._slowest = []
+
+
+def evaluate(queryset, params, instrumentation=None):
+    """
+    Applies django_params to a queryset and fetches the rows, timing the phases:
+    `apply` builds the queryset, `execute` covers the evaluation, within which
+    `compile` runs until the first SQL statement is sent and `database` wraps every
+    statement, with the emitted `sql` in its info.
+    """
+    if instrumentation is None:
+        return list(apply_params(queryset, params))
+    with instrumentation.phase('apply'):
+        queryset = apply_params(queryset, params)
+    compiling = []
+
+    def wrapper(execute, sql, sql_params, many, context):
+        if compiling:
+            compiling.pop().__exit__(None, None, None)
+        with instrumentation.phase('database', sql=sql, params=sql_params):
+            return execute(sql, sql_params, many, context)
+
+    with instrumentation.phase('execute') as info:
+        compiling.append(instrumentation.phase('compile'))
+        compiling[0].__enter__()
+        try:
+            with connections[queryset.db].execute_wrapper(wrapper):
+                rows = list(queryset)
+        finally:
+            if compiling:
+                compiling.pop().__exit__(None, None, None)
+        info["rows"] = len(rows)
+    return rows
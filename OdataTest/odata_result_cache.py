@@ -0,0 +1,243 @@
+import hashlib
+import json
+import re
+import time
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+from django.db.models import signals
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import parse_etags
+from OdataTest.odata_count import paginate
+
+
+QUERY_OPTIONS = (
+    '$apply', '$filter', '$search', '$orderby', '$select', '$expand', '$top', '$skip', '$skiptoken', '$count',
+    '$inlinecount',
+)
+STRING_RE = re.compile(r"('[^']*')")
+PATH_RE = re.compile(r"[A-Za-z_]\w*(?:/[A-Za-z_]\w*)*")
+LAMBDA_RE = re.compile(r"([A-Za-z_][\w/]*)/(?:any|all)\(\s*([A-Za-z_]\w*)\s*:")
+
+
+def collapse(text):
+    """Collapses whitespace outside string literals."""
+    parts = STRING_RE.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip()
+
+
+def canonical_params(param_dict) -> dict:
+    """The query options of a request that select its result, with insignificant differences removed."""
+    canonical = {}
+    for option in QUERY_OPTIONS:
+        value = param_dict.get(option)
+        if value is None:
+            continue
+        value = collapse(str(value))
+        if option in ('$select', '$expand'):
+            value = ','.join(collapse(v) for v in value.split(','))
+        elif option == '$orderby':
+            value = ','.join(re.sub(r'\s+asc$', '', collapse(v)) for v in value.split(','))
+        elif option in ('$count', '$inlinecount'):
+            value = value.lower()
+        canonical[option] = value
+    return canonical
+
+
+def related_models(model, param_dict) -> set:
+    """The models besides `model` whose rows a request can read, through navigation paths in its options."""
+    models = set()
+    for option in ('$apply', '$filter', '$orderby', '$select', '$expand'):
+        text = STRING_RE.sub('', str(param_dict.get(option, '')))
+        # paths in a lambda start with its variable, `o/customer` in `orders/any(o: o/customer/...)`
+        variables = {}
+        for collection, variable in LAMBDA_RE.findall(text):
+            head, _, rest = collection.partition('/')
+            variables[variable] = variables[head] + '/' + rest if head in variables and rest else collection
+        for path in set(PATH_RE.findall(text)):
+            head, _, rest = path.partition('/')
+            if head in variables and rest:
+                path = variables[head] + '/' + rest
+            current = model
+            for name in path.split('/'):
+                field = next((f for f in current._meta.get_fields() if f.name == name), None)
+                if field is None or not field.is_relation or field.related_model is None:
+                    break
+                current = field.related_model
+                models.add(current)
+    models.discard(model)
+    return models
+
+
+def joined_models(queryset) -> set:
+    """The models besides its own that the filters of `queryset` join, whose changes change its rows."""
+    models = set()
+    for join in queryset.query.alias_map.values():
+        model = getattr(getattr(join, 'join_field', None), 'related_model', None)
+        if model is not None:
+            models.add(model)
+    models.discard(queryset.model)
+    return models
+
+
+def describe(value):
+    """A description of a `paginate` option that is the same in every process."""
+    if hasattr(value, 'cache_key'):
+        return describe(value.cache_key())
+    if isinstance(value, (list, tuple)):
+        return '({})'.format(', '.join(describe(v) for v in value))
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        attributes = sorted((k, v) for k, v in vars(value).items() if not k.startswith('_'))
+        arguments = ', '.join('{}={}'.format(k, describe(v)) for k, v in attributes)
+        return '{}({})'.format(type(value).__qualname__, arguments)
+    return repr(value)
+
+
+def queryset_scope(queryset, kwargs) -> list:
+    """What besides the query options selects the rows of `paginate(queryset, ..., **kwargs)`."""
+    try:
+        sql, sql_params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        sql, sql_params = None, ()
+    # the filter cache only saves work, it doesn't change the result
+    options = sorted((k, describe(v)) for k, v in kwargs.items() if k != 'cache')
+    return [queryset.db, sql, [str(p) for p in sql_params], options]
+
+
+class ResultCache:
+    """
+    Caches OData results in Django's cache framework, keyed by the target model, the
+    canonicalized query options and a scope: for `page` and `respond`, the database,
+    the SQL of the base queryset and the `paginate` options, so querysets scoped
+    differently (`Customer.objects.filter(owner=user)`) never share entries. Every model has a version, bumped by
+    post_save, post_delete and m2m_changed once `connect` is called (or by
+    `invalidate`); an entry is keyed by the versions of the model and of the models
+    its navigation paths and the filters of the base queryset read, so a change makes
+    the old entries unreachable.
+
+    The key doubles as the ETag: `respond` answers a matching If-None-Match with 304
+    from the versions alone, without touching the database.
+
+    Writes that send no signals (QuerySet.update, bulk_create, raw SQL) have to call
+    `invalidate` themselves.
+    """
+
+    def __init__(self, ttl=60, cache_alias='default', key_prefix='odata-result'):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def version_key(self, model):
+        return '{}:version:{}'.format(self.key_prefix, model._meta.label_lower)
+
+    def versions(self, models) -> dict:
+        keys = {self.version_key(m): m for m in models}
+        versions = self.cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # a lost version must not bring old entries back, so it restarts from a fresh value
+                self.cache.add(key, time.time_ns(), None)
+                versions[key] = self.cache.get(key)
+        return versions
+
+    def invalidate(self, model):
+        key = self.version_key(model)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, time.time_ns(), None)
+
+    def etag(self, model, param_dict, scope=None, joined=()) -> str:
+        """
+        `scope` is any JSON serializable value telling apart results of the same model and
+        options, `joined` the other models the rows depend on besides the navigation paths.
+        """
+        related = related_models(model, param_dict) | set(joined)
+        related.discard(model)
+        models = [model] + sorted(related, key=lambda m: m._meta.label_lower)
+        versions = self.versions(models)
+        payload = json.dumps([
+            model._meta.label_lower,
+            sorted(canonical_params(param_dict).items()),
+            sorted(versions.items()),
+            scope,
+        ])
+        return '"{}"'.format(hashlib.sha1(payload.encode()).hexdigest())
+
+    def get_or_compute(self, model, param_dict, compute, scope=None, joined=()):
+        """Returns (etag, result), calling `compute()` only when the result isn't cached."""
+        etag = self.etag(model, param_dict, scope, joined)
+        return etag, self.lookup(etag, compute)
+
+    def lookup(self, etag, compute):
+        key = '{}:{}'.format(self.key_prefix, etag.strip('"'))
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.set(key, result, self.ttl)
+        return result
+
+    def page(self, queryset, param_dict, **kwargs):
+        """Cached `paginate`: returns (etag, CountedPage)."""
+        return self.get_or_compute(queryset.model, param_dict, lambda: paginate(queryset, param_dict, **kwargs),
+                                   queryset_scope(queryset, kwargs), joined_models(queryset))
+
+    @staticmethod
+    def row(row):
+        if isinstance(row, dict):
+            return row
+        return {f.attname: getattr(row, f.attname) for f in row._meta.concrete_fields}
+
+    def respond(self, request, queryset, param_dict=None, **kwargs) -> HttpResponse:
+        """
+        OData JSON response for `queryset` filtered by the request's query string, with an
+        ETag; a request whose If-None-Match has the current ETag gets a 304.
+        """
+        param_dict = request.GET.dict() if param_dict is None else param_dict
+        etag = self.etag(queryset.model, param_dict, queryset_scope(queryset, kwargs), joined_models(queryset))
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponseNotModified()
+        else:
+            def body():
+                page = paginate(queryset, param_dict, **kwargs)
+                content = {"value": [self.row(r) for r in page.rows]}
+                if page.count is not None:
+                    content = {"@odata.count": page.count, **content}
+                return json.dumps(content, cls=DjangoJSONEncoder)
+            response = HttpResponse(self.lookup(etag, body), content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def changed(self, model, using):
+        self.invalidate(model)
+        # bumped again on commit: a read running before the commit may have cached
+        # the old rows under the first bump
+        transaction.on_commit(lambda: self.invalidate(model), using=using)
+
+    def _saved_or_deleted(self, sender, using, **kwargs):
+        self.changed(sender, using)
+
+    def _m2m_changed(self, sender, instance, action, model, using, **kwargs):
+        if action.startswith('post_'):
+            for changed in (sender, type(instance), model):
+                self.changed(changed, using)
+
+    def connect(self):
+        uid = 'odata-result-cache-{}'.format(id(self))
+        signals.post_save.connect(self._saved_or_deleted, dispatch_uid=uid, weak=False)
+        signals.post_delete.connect(self._saved_or_deleted, dispatch_uid=uid, weak=False)
+        signals.m2m_changed.connect(self._m2m_changed, dispatch_uid=uid, weak=False)
+
+    def disconnect(self):
+        uid = 'odata-result-cache-{}'.format(id(self))
+        signals.post_save.disconnect(dispatch_uid=uid)
+        signals.post_delete.disconnect(dispatch_uid=uid)
+        signals.m2m_changed.disconnect(dispatch_uid=uid)
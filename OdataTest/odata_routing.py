@@ -0,0 +1,167 @@
+import hashlib
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.cache import caches
+from django.db.models import signals
+from OdataTest.odata_count import paginate
+
+
+STRATEGIES = ('round_robin', 'least_loaded')
+
+# the alias chosen by the innermost `ReplicaRouter.read` block, for `db_for_read`
+_reading = ContextVar('odata_reading', default=None)
+# the client whose writes the signals see, set by `ReplicaRouter.writing`
+_writing = ContextVar('odata_writing', default=None)
+
+
+class ReplicaRouter:
+    """
+    Routes OData reads, page and $count queries alike, to the `replicas` database
+    aliases, round-robin or to the replica with the fewest reads in flight in this
+    process (`least_loaded`). Writes stay on `primary`.
+
+    A replica lags behind the primary. After `wrote(client)`, the reads of `client`
+    stay on the primary for `staleness` seconds. `client` is any key with a stable
+    str(), such as a session key or a user id. A write recorded for client None pins
+    every client. With `connect`, the save, delete and m2m signals of writes to the
+    primary record them: writes inside `writing(client)` pin that client. Other writes,
+    like session saves or `last_login` updates, are ignored unless `pin_unscoped`
+    makes them pin every client.
+
+    Pins are kept in this process, so with several worker processes a write handled
+    by one worker doesn't pin the reads served by another. Pass `cache_alias` to keep
+    them in a Django cache shared by the workers instead; `clock` must then be the
+    same in every process, as the default wall clock is.
+
+        router = ReplicaRouter(['replica1', 'replica2'], staleness=2, cache_alias='default')
+        page = router.paginate(Customer.objects.all(), request.GET.dict(), client=request.session.session_key)
+
+    Listed in DATABASE_ROUTERS, the router also sends the reads of querysets without
+    `.using()` to the alias of the enclosing `read` block, and leaves every other
+    query to the next router.
+    """
+
+    def __init__(self, replicas, primary='default', strategy='round_robin', staleness=1.0, clock=time.time,
+                 cache_alias=None, key_prefix='odata-pin', pin_unscoped=False):
+        if strategy not in STRATEGIES:
+            raise ValueError("unknown strategy '{}', expected one of {}".format(strategy, ', '.join(STRATEGIES)))
+        self.replicas = list(replicas)
+        self.primary = primary
+        self.strategy = strategy
+        self.staleness = staleness
+        self.clock = clock
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+        self.pin_unscoped = pin_unscoped
+        self.load = dict.fromkeys(self.replicas, 0)
+        self.pins = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def pin_key(self, client):
+        if client is None:
+            return '{}:all'.format(self.key_prefix)
+        return '{}:client:{}'.format(self.key_prefix, hashlib.sha1(str(client).encode()).hexdigest())
+
+    def wrote(self, client=None):
+        """Keeps the reads of `client` (of every client for None) on the primary for `staleness` seconds."""
+        now = self.clock()
+        if self.cache_alias is not None:
+            caches[self.cache_alias].set(self.pin_key(client), now + self.staleness, math.ceil(self.staleness))
+            return
+        with self._lock:
+            if len(self.pins) > 1024:
+                self.pins = {c: until for c, until in self.pins.items() if until > now}
+            self.pins[client] = now + self.staleness
+
+    def pinned(self, client=None) -> bool:
+        now = self.clock()
+        clients = [None] if client is None else [None, client]
+        if self.cache_alias is not None:
+            pins = caches[self.cache_alias].get_many([self.pin_key(c) for c in clients])
+            return any(until > now for until in pins.values())
+        with self._lock:
+            return any(self.pins.get(c, 0) > now for c in clients)
+
+    def choose(self, client=None) -> str:
+        """The alias the next read of `client` goes to."""
+        if not self.replicas or self.pinned(client):
+            return self.primary
+        with self._lock:
+            start = next(self._turn) % len(self.replicas)
+            if self.strategy == 'round_robin':
+                return self.replicas[start]
+            # ties go round-robin
+            order = self.replicas[start:] + self.replicas[:start]
+            return min(order, key=self.load.__getitem__)
+
+    @contextmanager
+    def read(self, client=None):
+        """Yields the alias to read from, counted as a read in flight until the block ends."""
+        alias = self.choose(client)
+        counted = alias in self.load
+        if counted:
+            with self._lock:
+                self.load[alias] += 1
+        token = _reading.set(alias)
+        try:
+            yield alias
+        finally:
+            _reading.reset(token)
+            if counted:
+                with self._lock:
+                    self.load[alias] -= 1
+
+    @contextmanager
+    def writing(self, client):
+        """The writes the connected signals see inside the block pin `client`."""
+        token = _writing.set(client)
+        try:
+            yield self.primary
+        finally:
+            _writing.reset(token)
+
+    def paginate(self, queryset, param_dict, client=None, **kwargs):
+        """`paginate` on the alias `read` chooses, rows and count from the same database."""
+        with self.read(client) as alias:
+            return paginate(queryset.using(alias), param_dict, **kwargs)
+
+    # Django database router interface
+
+    def db_for_read(self, model, **hints):
+        return _reading.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the rows of the primary
+        databases = {self.primary, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def _written(self, using, **kwargs):
+        client = _writing.get()
+        if using == self.primary and (client is not None or self.pin_unscoped):
+            self.wrote(client)
+
+    def _m2m_changed(self, action, using, **kwargs):
+        if action.startswith('post_'):
+            self._written(using)
+
+    def connect(self):
+        uid = 'odata-replica-router-{}'.format(id(self))
+        signals.post_save.connect(self._written, dispatch_uid=uid, weak=False)
+        signals.post_delete.connect(self._written, dispatch_uid=uid, weak=False)
+        signals.m2m_changed.connect(self._m2m_changed, dispatch_uid=uid, weak=False)
+
+    def disconnect(self):
+        uid = 'odata-replica-router-{}'.format(id(self))
+        signals.post_save.disconnect(dispatch_uid=uid)
+        signals.post_delete.disconnect(dispatch_uid=uid)
+        signals.m2m_changed.disconnect(dispatch_uid=uid)
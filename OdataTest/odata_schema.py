@@ -0,0 +1,274 @@
+import copy
+import threading
+from datetime import datetime, timezone
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db import models
+from django.db.models.sql import Query
+from OdataTest.odata_filter_cache import Slot
+from OdataTest.odata_param_parser import FilterProcessor, ODataException
+
+
+STRING_FIELDS = (models.CharField, models.TextField)
+NUMBER_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField)
+TIME_FIELDS = (models.DateTimeField, models.TimeField)
+# the field types a property argument of each function argument type can be
+ARGUMENT_FIELDS = {
+    'string': STRING_FIELDS,
+    'number': NUMBER_FIELDS,
+    'date': models.DateField,
+    'time': TIME_FIELDS,
+    'any': models.Field,
+}
+
+
+def number_value(value):
+    if isinstance(value, str):
+        try:
+            return float(value) if '.' in value else int(value)
+        except ValueError:
+            raise ODataException("{!r} is not a number".format(value))
+    return value
+
+
+# the conversion of a literal argument of each type, when the function computes in SQL;
+# only concat takes 'any' arguments, which it joins as text
+ARGUMENT_CONVERTERS = {
+    'string': str,
+    'number': number_value,
+    'any': str,
+}
+# the Python type of a transformed column, keyed by the lookup name of the transform
+TRANSFORM_TYPES = {
+    'year': int, 'month': int, 'day': int, 'hour': int, 'minute': int, 'second': int, 'length': int,
+    'lower': str, 'upper': str, 'trim': str,
+    'ceil': None, 'floor': None, 'round': None, 'abs': None,
+}
+
+
+class ModelSchema:
+    """
+    Index of the filterable paths of a model, `country__name` style, built from `_meta`
+    up to `depth` relations deep when the schema is created; deeper paths are resolved
+    on first use and remembered.
+    """
+
+    def __init__(self, model, depth=2):
+        self.model = model
+        self.paths = {}
+        self._index(model, '', depth)
+
+    def _index(self, model, prefix, depth):
+        opts = model._meta
+        self.paths[prefix + 'pk'] = opts.pk
+        for field in opts.get_fields():
+            path = prefix + field.name
+            self.paths[path] = field
+            if field.concrete and field.attname != field.name:
+                self.paths[prefix + field.attname] = field
+            if field.is_relation and field.related_model is not None and depth > 0:
+                self._index(field.related_model, path + '__', depth - 1)
+
+    def field(self, path):
+        """Returns the field at the end of `path`, raising ODataException for an unknown path."""
+        field = self.paths.get(path)
+        if field is not None:
+            return field
+        model = self.model
+        for name in path.split('__'):
+            if field is not None:
+                if not field.is_relation or field.related_model is None:
+                    raise ODataException("'{}' has no property '{}'".format(field.name, name))
+                model = field.related_model
+            try:
+                field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ODataException("'{}' has no property '{}'".format(model.__name__, name))
+        self.paths[path] = field
+        return field
+
+    def converter(self, path):
+        """Returns the function coercing a literal compared with `path`, which may end in transforms."""
+        field, transform = self.target(path)
+        python_type = TRANSFORM_TYPES.get(transform)
+        if python_type is None and not field.concrete:
+            # a reverse or many-to-many relation compares with the related primary key
+            field = field.related_model._meta.pk
+        return field_converter(field, "'{}'".format(path.replace('__', '/')), python_type)
+
+    def target(self, path):
+        """
+        Returns (field, transform) of a path like `created__year`; transform is None for a
+        bare field, and the outermost one of nested transforms like `name__trim__lower`.
+        """
+        field_path = path
+        transform = None
+        while field_path not in self.paths:
+            prefix, _, last = field_path.rpartition('__')
+            if not prefix or last not in TRANSFORM_TYPES:
+                break
+            field_path = prefix
+            transform = transform or last
+        if field_path == path:
+            return self.field(path), None
+        return self.field(field_path), transform
+
+
+def field_converter(field, label, python_type=None):
+    """
+    Returns the function coercing a literal compared with `field`, or with a transform of
+    it computing `python_type` values; an invalid literal raises an ODataException.
+    """
+    to_python = python_type or field.to_python
+    boolean = python_type is None and isinstance(field, models.BooleanField)
+
+    def convert(value):
+        try:
+            # true/false only compare with booleans, not with the 1/0 numbers to_python makes of them
+            converted = None if isinstance(value, bool) and not boolean else to_python(value)
+        except (ValidationError, ValueError, TypeError):
+            converted = None
+        # int() truncates, `age eq 1.5` must not match age 1
+        if converted is None or isinstance(converted, int) and isinstance(value, float) and converted != value:
+            raise ODataException("{!r} is not a valid value for {}".format(value, label))
+        if isinstance(converted, datetime) and converted.tzinfo is None and python_type is None:
+            # like datetime literals, a naive datetime string is UTC
+            converted = converted.replace(tzinfo=timezone.utc)
+        return converted
+    return convert
+
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def schema_for(model) -> ModelSchema:
+    """The ModelSchema of `model`, built once per model."""
+    schema = _schemas.get(model)
+    if schema is None:
+        with _schemas_lock:
+            schema = _schemas.get(model)
+            if schema is None:
+                schema = _schemas[model] = ModelSchema(model)
+    return schema
+
+
+class ModelFilterProcessor(FilterProcessor):
+    """
+    FilterProcessor bound to a model: every field path, function and navigation in
+    $filter, $orderby and $select is checked against the model's schema while it is
+    translated, and literals are coerced to the Python type of the field they are
+    compared with (`Price lt '20'` compares with Decimal('20')), or to the type a
+    computed expression like `Price add 1` outputs, so an invalid request fails with an
+    ODataException before any SQL is built and the database never casts a column.
+    Datetime literals and datetime strings become aware datetimes. With the filter cache, checks run once per filter shape and the
+    coercion is applied to the literals of every request.
+    """
+
+    coerces_literals = True
+
+    def __init__(self, model, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.schema = schema_for(model)
+
+    def cache_key(self):
+        return super().cache_key() + (self.model,)
+
+    def for_model(self, model, columns=()):
+        if model is None:
+            # aggregated $apply rows have no model to check against, only their columns
+            processor = FilterProcessor.__new__(FilterProcessor)
+            processor.__dict__.update(self.__dict__)
+            return processor.for_model(None, columns)
+        processor = copy.copy(self)
+        processor.model = model
+        processor.schema = schema_for(model)
+        return processor
+
+    def lambda_processor(self, path, variable):
+        field = self.schema.field(path)
+        if not field.is_relation or not (field.one_to_many or field.many_to_many):
+            raise ODataException("any and all apply to collections, '{}' is not one".format(path.replace('__', '/')))
+        return super().lambda_processor(path, variable).for_model(field.related_model)
+
+    def check_alias(self, alias, paths):
+        super().check_alias(alias, paths)
+        if alias in self.schema.paths:
+            raise ODataException("the aggregate alias '{}' is also a property of {}".format(alias, self.model.__name__))
+
+    def coerce(self, path, value):
+        return self.convert_literal(self.schema.converter(path), value)
+
+    @staticmethod
+    def convert_literal(convert, value):
+        if isinstance(value, Slot):
+            return value.map(convert)
+        return convert(value)
+
+    def check_argument(self, function, index, path):
+        field = self.schema.field(path)
+        if not isinstance(field, ARGUMENT_FIELDS[function.arg_type(index)]):
+            raise ODataException("function {} does not apply to '{}'".format(function.name, path.replace('__', '/')))
+        return field
+
+    def literal_value(self, kind, text):
+        if kind == 'datetime':
+            return self.datetime_value(text)
+        return super().literal_value(kind, text)
+
+    def order_by(self, order_param) -> dict:
+        result = super().order_by(order_param)
+        for ordering in result["order_by"]:
+            self.schema.field(ordering.lstrip('-'))
+        return result
+
+    def select(self, select_param) -> dict:
+        result = super().select(select_param)
+        for path in result["values"]:
+            self.schema.field(path)
+        return result
+
+    def basic_relation(self, fields, op, value):
+        token = self.field_mapper(fields)
+        if token != 'annotated_value':
+            if value is None:
+                self.schema.target(token)
+            else:
+                value = self.coerce(token, value)
+        return super().basic_relation(fields, op, value)
+
+    def basic_function(self, func_name, *args, params=None):
+        function = self.function(func_name)
+        args = list(args)
+        for index, param in enumerate(params):
+            if param.expr_name == 'select_path':
+                self.check_argument(function, index, self.field_mapper(args[index]))
+        path = args[function.path_index]
+        lookup = function.lookup is not None and self.is_path(path, params[function.path_index])
+        for index, param in enumerate(params):
+            if param.expr_name not in ('string', 'number'):
+                continue
+            if lookup:
+                # the lookup compares the literal with the property
+                if index != function.path_index:
+                    args[index] = self.coerce(self.field_mapper(path), args[index])
+            elif function.arg_type(index) in ARGUMENT_CONVERTERS:
+                args[index] = self.convert_literal(ARGUMENT_CONVERTERS[function.arg_type(index)], args[index])
+        return super().basic_function(func_name, *args, params=params)
+
+    def expression_value(self, expression, value):
+        if value is None:
+            return value
+        try:
+            output_field = expression.resolve_expression(Query(self.model)).output_field
+        except FieldError as exc:
+            raise ODataException(str(exc))
+        label = 'a computed {}'.format(output_field.get_internal_type())
+        return self.convert_literal(field_converter(output_field, label), value)
+
+    def math_expr(self, node):
+        result = super().math_expr(node)
+        for name in self.referenced_fields(result["filter"]):
+            if not isinstance(self.schema.field(self.field_mapper(name)), NUMBER_FIELDS):
+                raise ODataException("arithmetic does not apply to '{}'".format(name))
+        return result
@@ -0,0 +1,261 @@
+import re
+from functools import reduce
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from OdataTest.odata_param_parser import ODataException
+
+
+SEARCH_TOKEN_RE = re.compile(r'\s*(?:(?P<paren>[()])|"(?P<phrase>(?:[^"\\]|\\.)*)"|(?P<word>[^\s()"]+))')
+SEARCH_ALIAS = 'odata_search'
+RANK_ALIAS = 'odata_search_rank'
+
+
+def tokenize_search(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = SEARCH_TOKEN_RE.match(text, pos)
+        if match is None:
+            raise ODataException("invalid $search near '{}'".format(text[pos:]))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'phrase':
+            value = re.sub(r'\\(.)', r'\1', value)
+            if not value.strip():
+                raise ODataException("empty phrase in $search")
+        elif kind == 'word' and value in ('AND', 'OR', 'NOT'):
+            kind = value
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def parse_search(text):
+    """
+    Parses an OData $search expression into a tree of ('word', text), ('phrase', text),
+    ('not', node), ('and', left, right) and ('or', left, right) nodes. NOT binds tighter
+    than AND, which binds tighter than OR; adjacent terms are ANDed.
+    """
+    tokens = tokenize_search(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def or_expr():
+        nonlocal pos
+        node = and_expr()
+        while peek() == 'OR':
+            pos += 1
+            node = ('or', node, and_expr())
+        return node
+
+    def and_expr():
+        nonlocal pos
+        node = unary()
+        while peek() in ('AND', 'NOT', 'word', 'phrase', 'paren') and tokens[pos][1] != ')':
+            if peek() == 'AND':
+                pos += 1
+            node = ('and', node, unary())
+        return node
+
+    def unary():
+        nonlocal pos
+        kind = peek()
+        if kind == 'NOT':
+            pos += 1
+            return 'not', unary()
+        if kind in ('word', 'phrase'):
+            pos += 1
+            return kind, tokens[pos - 1][1]
+        if kind == 'paren' and tokens[pos][1] == '(':
+            pos += 1
+            node = or_expr()
+            if peek() != 'paren' or tokens[pos][1] != ')':
+                raise ODataException("unbalanced parentheses in $search")
+            pos += 1
+            return node
+        raise ODataException("$search expects a term at '{}'".format(' '.join(t[1] for t in tokens[pos:]) or 'the end'))
+
+    try:
+        tree = or_expr()
+    except RecursionError:
+        raise ODataException("$search is nested too deeply")
+    if pos != len(tokens):
+        raise ODataException("unexpected '{}' in $search".format(tokens[pos][1]))
+    return tree
+
+
+class ContainsSearch:
+    """
+    $search as case-insensitive `icontains` over `fields`: no index needed, every row
+    is scanned. A fallback for backends without a full-text backend here.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def q(self, node):
+        if node[0] in ('word', 'phrase'):
+            return reduce(lambda a, b: a | b, (models.Q(**{field + '__icontains': node[1]}) for field in self.fields))
+        if node[0] == 'not':
+            return ~self.q(node[1])
+        left, right = self.q(node[1]), self.q(node[2])
+        return left & right if node[0] == 'and' else left | right
+
+    def params(self, search_text, rank=False) -> dict:
+        return {"filter": self.q(parse_search(search_text))}
+
+
+class PostgresSearch:
+    """
+    $search as a PostgreSQL full-text match of `SearchVector(*fields, config=config)`
+    with a SearchQuery built from the expression: words are plain queries, phrases
+    phrase queries, and AND/OR/NOT the tsquery operators. The match is an expression
+    lookup, so a GIN index on the same vector serves it:
+
+        GinIndex(SearchVector('name', 'city', config='english'), name='customer_search')
+
+    or pass `vector_field` to match a maintained SearchVectorField column instead.
+    With `rank`, rows are ordered by SearchRank when $orderby doesn't order them.
+    """
+
+    def __init__(self, fields=(), config='english', vector_field=None, rank=False):
+        if not fields and vector_field is None:
+            raise ValueError("PostgresSearch needs fields or a vector_field")
+        self.fields = fields
+        self.config = config
+        self.vector_field = vector_field
+        self.rank = rank
+
+    def vector(self):
+        if self.vector_field is not None:
+            return models.F(self.vector_field)
+        return SearchVector(*self.fields, config=self.config)
+
+    def query(self, node):
+        if node[0] == 'word':
+            return SearchQuery(node[1], config=self.config, search_type='plain')
+        if node[0] == 'phrase':
+            return SearchQuery(node[1], config=self.config, search_type='phrase')
+        if node[0] == 'not':
+            return ~self.query(node[1])
+        left, right = self.query(node[1]), self.query(node[2])
+        return left & right if node[0] == 'and' else left | right
+
+    def params(self, search_text, rank=None) -> dict:
+        query = self.query(parse_search(search_text))
+        vector = self.vector()
+        # the vector only serves the match, so it's deferred out of the SELECT like a computed filter
+        rv = {"annotate": {SEARCH_ALIAS: vector}, "defer": SEARCH_ALIAS, "filter": models.Q(**{SEARCH_ALIAS: query})}
+        if self.rank if rank is None else rank:
+            rv["annotate"][RANK_ALIAS] = SearchRank(vector, query)
+            rv["order_by"] = ['-' + RANK_ALIAS]
+        return rv
+
+
+class SQLiteFTS5Search:
+    """
+    $search through an SQLite FTS5 table indexing `fields` of `model`, an external
+    content table over the model's table kept in sync by triggers (`install` creates
+    them and indexes the existing rows). The expression becomes one FTS5 MATCH query
+    where FTS5 can express it; a NOT that isn't the right side of an AND is combined
+    in SQL from several matches. With `rank`, rows are ordered by bm25 when $orderby
+    doesn't order them.
+    """
+
+    def __init__(self, model, fields, table=None, rank=False, using='default'):
+        self.model = model
+        self.fields = fields
+        self.table = table or '{}_fts'.format(model._meta.db_table)
+        self.rank = rank
+        self.using = using
+
+    def quote(self, name):
+        return connections[self.using].ops.quote_name(name)
+
+    def columns(self):
+        return [self.model._meta.get_field(f).column for f in self.fields]
+
+    def install_sql(self) -> list:
+        quote = self.quote
+        content, table, pk = self.model._meta.db_table, self.table, self.model._meta.pk.column
+        columns = self.columns()
+        names = ', '.join(quote(c) for c in columns)
+        new = ', '.join('new.{}'.format(quote(c)) for c in columns)
+        old = ', '.join('old.{}'.format(quote(c)) for c in columns)
+        delete = "INSERT INTO {t}({t}, rowid, {names}) VALUES ('delete', old.{pk}, {old});".format(
+            t=quote(table), names=names, pk=quote(pk), old=old)
+        insert = "INSERT INTO {t}(rowid, {names}) VALUES (new.{pk}, {new});".format(
+            t=quote(table), names=names, pk=quote(pk), new=new)
+        return [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, content={}, content_rowid={})".format(
+                quote(table), names, quote(content), quote(pk)),
+            "CREATE TRIGGER IF NOT EXISTS {} AFTER INSERT ON {} BEGIN {} END".format(
+                quote(table + '_ai'), quote(content), insert),
+            "CREATE TRIGGER IF NOT EXISTS {} AFTER DELETE ON {} BEGIN {} END".format(
+                quote(table + '_ad'), quote(content), delete),
+            "CREATE TRIGGER IF NOT EXISTS {} AFTER UPDATE ON {} BEGIN {} {} END".format(
+                quote(table + '_au'), quote(content), delete, insert),
+            "INSERT INTO {t}({t}) VALUES ('rebuild')".format(t=quote(table)),
+        ]
+
+    def install(self):
+        with connections[self.using].cursor() as cursor:
+            for sql in self.install_sql():
+                cursor.execute(sql)
+
+    def uninstall(self):
+        quote = self.quote
+        with connections[self.using].cursor() as cursor:
+            for suffix in ('_ai', '_ad', '_au'):
+                cursor.execute("DROP TRIGGER IF EXISTS {}".format(quote(self.table + suffix)))
+            cursor.execute("DROP TABLE IF EXISTS {}".format(quote(self.table)))
+
+    @staticmethod
+    def quote_term(text):
+        return '"{}"'.format(text.replace('"', '""'))
+
+    def match(self, node):
+        """The FTS5 query of `node`, or None when FTS5 can't express it (a NOT on its own)."""
+        if node[0] in ('word', 'phrase'):
+            return self.quote_term(node[1])
+        if node[0] == 'not':
+            return None
+        if node[0] == 'and' and node[2][0] == 'not':
+            left, right = self.match(node[1]), self.match(node[2][1])
+            template = '({}) NOT ({})'
+        else:
+            left, right = self.match(node[1]), self.match(node[2])
+            template = '({}) AND ({})' if node[0] == 'and' else '({}) OR ({})'
+        if left is None or right is None:
+            return None
+        return template.format(left, right)
+
+    def matching(self, query):
+        sql = 'SELECT rowid FROM {t} WHERE {t} MATCH %s'.format(t=self.quote(self.table))
+        return models.Q(pk__in=RawSQL(sql, [query]))
+
+    def q(self, node):
+        query = self.match(node)
+        if query is not None:
+            return self.matching(query)
+        if node[0] == 'not':
+            return ~self.q(node[1])
+        left, right = self.q(node[1]), self.q(node[2])
+        return left & right if node[0] == 'and' else left | right
+
+    def params(self, search_text, rank=None) -> dict:
+        tree = parse_search(search_text)
+        rv = {"filter": self.q(tree)}
+        query = self.match(tree)
+        if (self.rank if rank is None else rank) and query is not None:
+            quote = self.quote
+            # FTS5 ranks better matches lower, the alias orders descending like SearchRank
+            sql = '(SELECT -rank FROM {t} WHERE {t} MATCH %s AND rowid = {table}.{pk})'.format(
+                t=quote(self.table), table=quote(self.model._meta.db_table), pk=quote(self.model._meta.pk.column))
+            rv["annotate"] = {RANK_ALIAS: RawSQL(sql, [query], output_field=models.FloatField())}
+            rv["order_by"] = ['-' + RANK_ALIAS]
+        return rv
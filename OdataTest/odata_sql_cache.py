@@ -0,0 +1,251 @@
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models.query import RawQuerySet
+from OdataTest.odata_filter_cache import CacheInfo, filter_cache, lift_literals
+from OdataTest.odata_param_parser import FilterProcessor, apply_params, django_params
+
+
+# ways the ORM turns a literal into a query parameter, tried in this order
+ADAPTERS = {
+    'value': lambda connection, value: value,
+    'int': lambda connection, value: int(value),
+    'float': lambda connection, value: float(value),
+    'decimal': lambda connection, value: Decimal(str(value)),
+    'str': lambda connection, value: str(value),
+    'contains': lambda connection, value: '%{}%'.format(connection.ops.prep_for_like_query(value)),
+    'startswith': lambda connection, value: '{}%'.format(connection.ops.prep_for_like_query(value)),
+    'endswith': lambda connection, value: '%{}'.format(connection.ops.prep_for_like_query(value)),
+    'datetime': lambda connection, value: connection.ops.adapt_datetimefield_value(value),
+    'date': lambda connection, value: connection.ops.adapt_datefield_value(value),
+}
+# templates that still can't tell where a parameter comes from after this many requests are given up
+MAX_OBSERVATIONS = 8
+
+
+def same(a, b):
+    return type(a) is type(b) and a == b
+
+
+class SQLTemplate:
+    """
+    The SQL text of one request shape and, once learned, where each of its parameters
+    comes from: a literal of the $filter through one of the ADAPTERS, or a constant.
+
+    Every request served by the ORM is an observation: the candidate sources of each
+    parameter are narrowed to those that reproduce the parameters the ORM compiled.
+    The template is only used when every parameter has a single source and the
+    mapping held for at least two requests, so it is checked against the ORM first.
+    """
+
+    def __init__(self, sql, names, converters):
+        self.sql = sql
+        self.names = names
+        self.converters = converters
+        self.candidates = None
+        self.observations = 0
+        self.plan = None
+        self.broken = False
+
+    def sources(self, connection, values, param):
+        found = [('const', param)]
+        for index, value in enumerate(values):
+            for name, adapter in ADAPTERS.items():
+                try:
+                    adapted = adapter(connection, value)
+                except (TypeError, ValueError, ArithmeticError, AttributeError):
+                    continue
+                if same(adapted, param):
+                    found.append(('slot', index, name))
+        return found
+
+    def observe(self, connection, values, sql, params):
+        if sql != self.sql:
+            self.broken = True
+            return
+        if self.candidates is None:
+            self.candidates = [self.sources(connection, values, p) for p in params]
+        else:
+            self.candidates = [
+                [c for c in candidates if self.resolve(connection, c, values, param)]
+                for candidates, param in zip(self.candidates, params)
+            ]
+        self.observations += 1
+        if not all(self.candidates) or self.observations >= MAX_OBSERVATIONS:
+            self.broken = True
+        elif self.observations >= (2 if values else 1):
+            plan = []
+            for candidates in self.candidates:
+                slots = [c for c in candidates if c[0] == 'slot']
+                if not slots:
+                    plan.append(candidates[0])
+                elif len(slots) < len(candidates) or len({c[1] for c in slots}) > 1:
+                    # the literals didn't vary enough yet to tell the sources apart
+                    return
+                else:
+                    # equivalent adapters of the same literal: the first one wins
+                    plan.append(slots[0])
+            if {source[1] for source in plan if source[0] == 'slot'} != set(range(len(values))):
+                # a literal that isn't a parameter went into the SQL text, like the 1 or 0
+                # compared with a boolean column (`WHERE "active"` or `WHERE NOT "active"`)
+                self.broken = True
+                return
+            self.plan = plan
+
+    @staticmethod
+    def resolve(connection, source, values, param):
+        if source[0] == 'const':
+            return same(source[1], param)
+        try:
+            adapted = ADAPTERS[source[2]](connection, values[source[1]])
+        except (TypeError, ValueError, ArithmeticError, AttributeError):
+            return False
+        return same(adapted, param)
+
+    def params(self, connection, values):
+        """The parameters for `values`, or None when a literal doesn't adapt (the ORM reports the error)."""
+        params = []
+        for source in self.plan:
+            if source[0] == 'const':
+                params.append(source[1])
+                continue
+            try:
+                params.append(ADAPTERS[source[2]](connection, values[source[1]]))
+            except (TypeError, ValueError, ArithmeticError, AttributeError):
+                return None
+        return params
+
+
+class SQLTemplateCache:
+    """
+    Cache of the SQL text Django compiles for the requests on one entity set, keyed by
+    the shape of $filter (its literals lifted out) together with $orderby and $select.
+    Once a shape's template is learned (see SQLTemplate), a request only binds its
+    literals into the cached parameter list and runs the SQL directly: no Q tree, no
+    query building and no SQL compiler. $top/$skip are appended as LIMIT/OFFSET.
+    Requests the template can't serve ($expand, $search, shapes whose parameters aren't
+    plain adaptations of the literals) go through the ORM, and so does every request
+    of a processor with `optimize` or `sargable`, whose SQL depends on the literal
+    values and not only on the shape. A shape whose literals don't all become query
+    parameters keeps going through the ORM. With a model-bound processor a request
+    still binds its literals into the $filter template of `cache`, so invalid values
+    are rejected like on the ORM path.
+
+    Repeated shapes produce identical SQL text, which lets the backend reuse prepared
+    statements: sqlite3 keeps a per-connection statement cache keyed by the SQL and
+    psycopg 3 prepares server side after `prepare_threshold` executions.
+    """
+
+    def __init__(self, queryset, processor=None, cache=filter_cache, maxsize=256):
+        self.queryset = queryset
+        self.processor = processor or FilterProcessor()
+        self.cache = cache
+        self._maxsize = maxsize
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self._maxsize, len(self._templates))
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def key(self, param_dict, shape):
+        return (self.processor.cache_key(), shape, param_dict.get('$apply'), param_dict.get('$orderby'),
+                param_dict.get('$select'))
+
+    def rows(self, param_dict) -> list:
+        """The rows of the request: model instances, or dicts with $select."""
+        if '$expand' in param_dict or '$search' in param_dict or self.processor.optimize or self.processor.sargable:
+            # the optimizer and the sargable rewrite change the SQL with the literal values
+            return list(self.orm_queryset(param_dict))
+        values = []
+        shape = None
+        if '$filter' in param_dict:
+            if self.processor.cost_model is not None:
+                self.processor.cost_model.check_text(param_dict['$filter'])
+            shape, literals, _ = lift_literals(param_dict['$filter'])
+            values = [self.processor.literal_value(kind, text) for kind, text in literals]
+        key = self.key(param_dict, shape)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+        connection = connections[self.queryset.db]
+        params = template.params(connection, values) if template is not None and template.plan is not None else None
+        if params is not None and shape is not None and self.processor.coerces_literals:
+            # the coercion of a model-bound processor rejects invalid literals: rebinding the
+            # filter template runs it without building the SQL
+            django_params({'$filter': param_dict['$filter']}, cache=self.cache, processor=self.processor)
+        if params is not None:
+            with self._lock:
+                self.hits += 1
+            sql = template.sql
+            page = self.processor.get_slice(param_dict)["__getitem__"]
+            if page.stop is not None and page.stop <= (page.start or 0):
+                return []
+            if page.start or page.stop is not None:
+                sql = '{} {}'.format(sql, connection.ops.limit_offset_sql(page.start, page.stop))
+            return self.execute(connection, template, sql, params)
+        with self._lock:
+            self.misses += 1
+        queryset = self.orm_queryset(param_dict, sliced=False)
+        if template is None or template.plan is None and not template.broken:
+            compiler = queryset.query.get_compiler(queryset.db)
+            try:
+                sql, params = compiler.as_sql()
+            except EmptyResultSet:
+                return []
+            with self._lock:
+                if template is None:
+                    template = self.template(queryset, compiler, sql)
+                    if self._maxsize > 0:
+                        self._templates[key] = template
+                        self.evict()
+                if not template.broken:
+                    template.observe(connection, values, sql, params)
+        if '$top' in param_dict or '$skip' in param_dict:
+            queryset = queryset[self.processor.get_slice(param_dict)["__getitem__"]]
+        return list(queryset)
+
+    def evict(self):
+        while len(self._templates) > self._maxsize:
+            self._templates.popitem(last=False)
+            self.evictions += 1
+
+    def orm_queryset(self, param_dict, sliced=True):
+        if not sliced:
+            param_dict = {k: v for k, v in param_dict.items() if k not in ('$top', '$skip')}
+        params = django_params(param_dict, cache=self.cache, processor=self.processor, model=self.queryset.model)
+        return apply_params(self.queryset, params)
+
+    @staticmethod
+    def template(queryset, compiler, sql):
+        query = queryset.query
+        if queryset._fields is None:
+            names = converters = None
+        else:
+            names = [*query.extra_select, *query.values_select, *query.annotation_select]
+            converters = compiler.get_converters([column[0] for column in compiler.select])
+        return SQLTemplate(sql, names, converters)
+
+    def execute(self, connection, template, sql, params):
+        if template.names is None:
+            return list(RawQuerySet(sql, model=self.queryset.model, params=params, using=self.queryset.db))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        result = []
+        for row in rows:
+            row = list(row)
+            for position, (converters, expression) in template.converters.items():
+                for converter in converters:
+                    row[position] = converter(row[position], expression, connection)
+            result.append(dict(zip(template.names, row)))
+        return result
@@ -0,0 +1,64 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from OdataTest.odata_param_parser import ODataException, apply_params
+
+
+def rows_queryset(queryset, params):
+    """Returns the selected field names and the values_list queryset reading them."""
+    params = dict(params)
+    if 'prefetch_related' in params or 'select_related' in params:
+        raise ODataException("$expand is not supported when streaming")
+    fields = params.pop('values', None) or params.pop('only', None) \
+        or [f.attname for f in queryset.model._meta.concrete_fields]
+    params.pop('only', None)
+    page = params.pop('__getitem__', None)
+    queryset = apply_params(queryset, params).values_list(*fields)
+    if page is not None:
+        queryset = queryset[page]
+    return fields, queryset
+
+
+def iter_rows(queryset, params, chunk_size=2000):
+    """
+    Yields the rows selected by `params` as dicts without materializing the result:
+    the queryset is read as values_list tuples through `.iterator(chunk_size)`.
+    """
+    fields, queryset = rows_queryset(queryset, params)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield dict(zip(fields, row))
+
+
+def json_head(encoder, count=None, context=None):
+    head = []
+    if context is not None:
+        head.append('"@odata.context":{},'.format(encoder.encode(context)))
+    if count is not None:
+        head.append('"@odata.count":{},'.format(encoder.encode(count)))
+    return '{{{}"value":['.format(''.join(head)).encode()
+
+
+def json_tail(encoder, next_link=None):
+    tail = ']'
+    if next_link is not None:
+        tail += ',"@odata.nextLink":{}'.format(encoder.encode(next_link))
+    return (tail + '}').encode()
+
+
+def stream_json(queryset, params, chunk_size=2000, count=None, context=None, next_link=None):
+    """
+    Generator of OData JSON bytes for `queryset` filtered by the django_params result
+    `params`, suitable for StreamingHttpResponse. Rows are encoded and flushed one
+    chunk at a time, so peak memory depends on `chunk_size` and not on the result size.
+    """
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield json_head(encoder, count, context)
+    chunk = []
+    separator = ''
+    for row in iter_rows(queryset, params, chunk_size):
+        chunk.append(encoder.encode(row))
+        if len(chunk) >= chunk_size:
+            yield (separator + ','.join(chunk)).encode()
+            chunk = []
+            separator = ','
+    if chunk:
+        yield (separator + ','.join(chunk)).encode()
+    yield json_tail(encoder, next_link)
@@ -0,0 +1,263 @@
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import functions
+
+
+FieldUsage = namedtuple('FieldUsage', ['kind', 'path', 'operator', 'function'])
+UsageStat = namedtuple('UsageStat', ['usage', 'count', 'timed', 'total_time', 'max_time'])
+IndexSuggestion = namedtuple('IndexSuggestion', ['model', 'kind', 'fields', 'index', 'count', 'load'])
+
+# operators a B-tree index on the bare column can serve
+INDEXABLE_OPERATORS = {'eq', 'null', 'gt', 'ge', 'lt', 'le', 'startswith', 'asc', 'desc'}
+EQUALITY_OPERATORS = {'eq', 'null'}
+EXPRESSIONS = {
+    'lower': functions.Lower,
+    'upper': functions.Upper,
+    'trim': functions.Trim,
+    'length': functions.Length,
+    'year': functions.ExtractYear,
+    'month': functions.ExtractMonth,
+    'day': functions.ExtractDay,
+    'hour': functions.ExtractHour,
+    'minute': functions.ExtractMinute,
+    'second': functions.ExtractSecond,
+    'ceil': functions.Ceil,
+    'floor': functions.Floor,
+    'round': functions.Round,
+    'abs': functions.Abs,
+}
+
+
+class UsageRecorder:
+    """
+    Collects per-field predicate statistics from the FilterProcessor hooks: which paths
+    are filtered and sorted on, with which operator and function wrapper, how often,
+    and how long the requests using them took. Events recorded inside `request()` are
+    timed together and also counted as a combination, which feeds composite index
+    suggestions; events outside of it are only counted.
+
+        recorder = UsageRecorder(model=Customer)
+        processor = FilterProcessor(recorder=recorder)
+        with recorder.request():
+            rows = list(apply_params(Customer.objects.all(), django_params(query, processor=processor)))
+    """
+
+    def __init__(self, model=None):
+        self.model = model
+        self.fields = {}
+        self.combinations = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, kind, path, operator, function=None):
+        usage = FieldUsage(kind, path, operator, function)
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            if usage not in pending:
+                pending.append(usage)
+        else:
+            self.add([usage])
+
+    @contextmanager
+    def request(self):
+        outer = getattr(self._local, 'pending', None)
+        self._local.pending = pending = []
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._local.pending = outer
+            self.add(pending, time.perf_counter() - start)
+
+    def add(self, usages, elapsed=None, count=1):
+        with self._lock:
+            for usage in usages:
+                self._update(self.fields, usage, elapsed, count)
+            if len(usages) > 1:
+                self._update(self.combinations, tuple(sorted(usages, key=str)), elapsed, count)
+
+    @staticmethod
+    def _update(stats, key, elapsed, count):
+        stat = stats.setdefault(key, [0, 0, 0.0, 0.0])
+        stat[0] += count
+        if elapsed is not None:
+            stat[1] += count
+            stat[2] += elapsed * count
+            stat[3] = max(stat[3], elapsed)
+
+    def stats(self):
+        """Field statistics, the heaviest first."""
+        with self._lock:
+            stats = [UsageStat(usage, *stat) for usage, stat in self.fields.items()]
+        return sorted(stats, key=estimated_load, reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self.fields.clear()
+            self.combinations.clear()
+
+    def dump(self) -> dict:
+        """JSON serializable statistics, for `load` in an offline report."""
+        with self._lock:
+            return {
+                'fields': [list(usage) + stat for usage, stat in self.fields.items()],
+                'combinations': [[list(u) for u in usages] + [stat] for usages, stat in self.combinations.items()],
+            }
+
+    @classmethod
+    def load(cls, data, model=None):
+        recorder = cls(model)
+        for *usage, count, timed, total_time, max_time in data['fields']:
+            recorder.fields[FieldUsage(*usage)] = [count, timed, total_time, max_time]
+        for *usages, stat in data['combinations']:
+            recorder.combinations[tuple(FieldUsage(*u) for u in usages)] = stat
+        return recorder
+
+
+def estimated_load(stat):
+    """Total time of the requests using a field, extrapolated to the untimed ones; the count when none is timed."""
+    if not stat.timed:
+        return stat.count
+    return stat.total_time / stat.timed * stat.count
+
+
+def resolve_column(model, path):
+    """Returns (model, field) holding the column of a filter path, or None when the path isn't a column."""
+    names = path.split('__')
+    field = None
+    for i, name in enumerate(names):
+        if field is not None:
+            if not field.is_relation:
+                return None
+            if field.many_to_one and name in (field.target_field.name, 'pk') and i == len(names) - 1:
+                # the foreign key column already holds the related primary key
+                break
+            model = field.related_model
+        try:
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+    if field is None or field.many_to_many or field.one_to_many or not field.concrete:
+        return None
+    return model, field
+
+
+def existing_indexes(model):
+    """Returns the column lists and the expressions of the indexes a model already has."""
+    opts = model._meta
+    columns = [[opts.pk.name]]
+    columns.extend([f.name] for f in opts.concrete_fields if f.db_index or f.unique)
+    columns.extend(list(fields) for fields in opts.unique_together)
+    expressions = []
+    for index in list(opts.indexes) + [c for c in opts.constraints if isinstance(c, models.UniqueConstraint)]:
+        if index.fields:
+            columns.append([f.lstrip('-') for f in index.fields])
+        expressions.extend(index.expressions)
+    return columns, expressions
+
+
+def covered(columns, indexes):
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def index_name(model, suffix):
+    name = '{}_{}_idx'.format(model._meta.db_table, suffix)
+    return name[:models.Index.max_name_length]
+
+
+def advise(recorder, model=None, min_count=1):
+    """
+    Cross-references the recorded statistics with the indexes in the model `_meta` and
+    suggests the missing ones, ranked by estimated load:
+
+    * single column indexes for fields compared or sorted on directly,
+    * composite indexes for fields used together in a request, with the equality
+      columns first and a range or sort column last,
+    * expression indexes for fields wrapped in a function such as lower() or year().
+
+    Paths through relations are suggested on the related model. Leading-wildcard
+    predicates (contains, endswith) and arithmetic can't use a B-tree index and are skipped.
+    """
+    model = model or recorder.model
+    if model is None:
+        raise ValueError('advise needs a model, either bound to the recorder or given')
+    suggestions = {}
+
+    def suggest(key, make_index, stat):
+        entry = suggestions.get(key)
+        if entry is None:
+            target_model, kind, fields = key
+            entry = suggestions[key] = [target_model, kind, fields, make_index(), 0, 0]
+        entry[4] += stat.count
+        entry[5] += estimated_load(stat)
+
+    for stat in recorder.stats():
+        usage = stat.usage
+        if stat.count < min_count or usage.operator not in INDEXABLE_OPERATORS:
+            continue
+        resolved = resolve_column(model, usage.path)
+        if resolved is None:
+            continue
+        target_model, field = resolved
+        columns, expressions = existing_indexes(target_model)
+        if usage.function is None:
+            if not covered([field.name], columns):
+                suggest((target_model, 'single', (field.name,)),
+                        lambda: models.Index(fields=[field.name], name=index_name(target_model, field.name)), stat)
+        elif usage.function in EXPRESSIONS:
+            expression = EXPRESSIONS[usage.function](field.name)
+            if expression not in expressions:
+                suggest((target_model, 'expression', ('{}({})'.format(usage.function, field.name),)),
+                        lambda: models.Index(expression, name=index_name(target_model, usage.function + '_' + field.name)),
+                        stat)
+
+    with recorder._lock:
+        combinations = [UsageStat(usages, *stat) for usages, stat in recorder.combinations.items()]
+    for stat in combinations:
+        if stat.count < min_count:
+            continue
+        fields = composite_columns(model, stat.usage)
+        if fields is None:
+            continue
+        target_model, fields = fields
+        columns, _ = existing_indexes(target_model)
+        if not covered(fields, columns):
+            suggest((target_model, 'composite', tuple(fields)),
+                    lambda: models.Index(fields=fields, name=index_name(target_model, '_'.join(fields))), stat)
+
+    return sorted((IndexSuggestion(*entry) for entry in suggestions.values()), key=lambda s: s.load, reverse=True)
+
+
+def composite_columns(model, usages):
+    """Orders the columns of a request on one model: equalities, then one range or the sort columns."""
+    equal, ranges, order = [], [], []
+    target = None
+    for usage in usages:
+        if usage.function is not None or usage.operator not in INDEXABLE_OPERATORS:
+            continue
+        resolved = resolve_column(model, usage.path)
+        if resolved is None:
+            continue
+        if target is not None and resolved[0] is not target:
+            return None
+        target, field = resolved
+        group = equal if usage.operator in EQUALITY_OPERATORS else order if usage.kind == 'order' else ranges
+        if field.name not in group:
+            group.append(field.name)
+    tail = order if order else ranges[:1]
+    fields = sorted(equal) + [f for f in tail if f not in equal]
+    if len(fields) < 2:
+        return None
+    return target, fields
+
+
+def report(suggestions) -> str:
+    lines = []
+    for s in suggestions:
+        lines.append('{:>12.3f} {:>8} {}.{} {} index on {}'.format(
+            s.load, s.count, s.model._meta.app_label, s.model.__name__, s.kind, ', '.join(s.fields)))
+    return '\n'.join(lines)
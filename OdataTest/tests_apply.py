@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from OdataTest.odata_count import paginate
+from OdataTest.odata_param_parser import apply_params, django_params, ODataException
+from OdataTest.odata_schema import ModelFilterProcessor
+from OdataTest.tests_support import ModelTestCase, Customer, Country
+
+
+class ApplyTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        narnia = Country.objects.create(name='Narnia')
+        for i in range(8):
+            Customer.objects.create(name='c{}'.format(i), city='city{}'.format(i % 3), age=20 + i,
+                                    rating=None if i % 4 == 0 else i / 2, country=narnia if i % 2 else None,
+                                    created=datetime(2020, 1, 1 + i, 12, tzinfo=timezone.utc))
+
+    def rows(self, param_dict, processor=None):
+        return list(apply_params(Customer.objects.all(), django_params(param_dict, processor=processor)))
+
+    def test_groupby(self):
+        param_dict = {"$apply": "groupby((city), aggregate(age with sum as total, $count as n, rating with max as top))",
+                      "$orderby": "city"}
+        for processor in (None, ModelFilterProcessor(Customer)):
+            with CaptureQueriesContext(connection) as queries:
+                rows = self.rows(param_dict, processor)
+            self.assertEqual(rows, [
+                {"city": "city0", "total": 69, "n": 3, "top": 3.0},
+                {"city": "city1", "total": 72, "n": 3, "top": 3.5},
+                {"city": "city2", "total": 47, "n": 2, "top": 2.5},
+            ])
+            self.assertIn('GROUP BY', queries[0]['sql'])
+        self.assertEqual(self.rows({"$apply": "groupby((country/name, city))", "$orderby": "country/name,city",
+                                    "$filter": "city ne 'city2'"}), [
+            {"country__name": None, "city": "city0"}, {"country__name": None, "city": "city1"},
+            {"country__name": "Narnia", "city": "city0"}, {"country__name": "Narnia", "city": "city1"},
+        ])
+
+    def test_aggregate_and_filters(self):
+        self.assertEqual(self.rows({"$apply": "aggregate(age with average as avg, age mul 2 with sum as doubled, "
+                                              "city with countdistinct as cities)"}),
+                         [{"avg": 23.5, "doubled": 376, "cities": 3}])
+        self.assertEqual(self.rows({"$apply": "filter(age gt 100)/aggregate($count as n, age with min as youngest)"}),
+                         [{"n": 0, "youngest": None}])
+        param_dict = {"$apply": "filter(country/name eq 'Narnia')/groupby((city), aggregate(age with sum as total))"
+                                "/filter(total gt 24)", "$orderby": "total desc", "$select": "city"}
+        for processor in (None, ModelFilterProcessor(Customer)):
+            self.assertEqual(self.rows(param_dict, processor), [{"city": "city1"}, {"city": "city2"}])
+
+    def test_computed_filters(self):
+        param_dict = {"$apply": "groupby((city), aggregate(age with sum as total))", "$filter": "total add 1 gt 60",
+                      "$orderby": "city"}
+        self.assertEqual(self.rows(param_dict), [{"city": "city0", "total": 69}, {"city": "city1", "total": 72}])
+        param_dict = {"$apply": "filter(age add 1 gt 22)/groupby((city), aggregate(age with sum as total))",
+                      "$filter": "total mul 2 gt 95", "$orderby": "city"}
+        self.assertEqual(self.rows(param_dict), [{"city": "city0", "total": 49}, {"city": "city1", "total": 51}])
+        rows = self.rows({"$apply": "filter(age mod 2 eq 0)", "$filter": "age add 1 lt 25", "$orderby": "age"})
+        self.assertEqual([c.age for c in rows], [20, 22])
+        self.assertFalse(hasattr(rows[0], 'annotated_value'))
+        self.assertEqual(self.rows({"$apply": "filter(age add 1 gt 26)", "$select": "name"}),
+                         [{"name": "c6"}, {"name": "c7"}])
+
+    def test_groupby_count(self):
+        for param_dict in ({"$apply": "groupby((city))", "$count": "true"},
+                           {"$apply": "groupby((city), aggregate($count as n))", "$count": "true", "$top": "1"}):
+            self.assertEqual(paginate(Customer.objects.all(), param_dict).count, 3)
+
+    def test_topcount(self):
+        param_dict = {"$apply": "groupby((city), aggregate(age with sum as total))/topcount(2, total)",
+                      "$orderby": "city", "$count": "true"}
+        page = paginate(Customer.objects.all(), param_dict)
+        self.assertEqual(page.rows, [{"city": "city0", "total": 69}, {"city": "city1", "total": 72}])
+        self.assertEqual(page.count, 2)
+        self.assertEqual([c.name for c in self.rows({"$apply": "topcount(2, age)", "$orderby": "name"})], ['c6', 'c7'])
+
+    def test_invalid(self):
+        invalid = [
+            "groupby(city)",
+            "aggregate(age with median as m)",
+            "aggregate(age as a)",
+            "topcount(2, age)/filter(age gt 1)",
+            "aggregate($count as n)/groupby((n))",
+            "compute(age add 1 as next)",
+            "groupby((city), topcount(1, age))",
+        ]
+        for apply_text in invalid:
+            with self.assertRaises(ODataException, msg=apply_text):
+                self.rows({"$apply": apply_text})
+        with self.assertRaises(ODataException):
+            self.rows({"$apply": "topcount(2, age)", "$filter": "age gt 1"})
+        with self.assertRaises(ODataException):
+            self.rows({"$apply": "groupby((unknown))"}, ModelFilterProcessor(Customer))
+
+    def test_aggregated_properties(self):
+        grouped = "groupby((city), aggregate(age with sum as total))"
+        invalid = [
+            {"$apply": grouped, "$orderby": "name"},
+            {"$apply": grouped, "$select": "name"},
+            {"$apply": grouped, "$filter": "name eq 'c0'"},
+            {"$apply": grouped, "$filter": "length(name) gt 1"},
+            {"$apply": grouped + "/filter(age gt 1)"},
+            {"$apply": grouped + "/topcount(1, age)"},
+            {"$apply": "groupby((city), aggregate(age with sum as city))"},
+            {"$apply": "filter(unknown eq 1)/aggregate($count as n)"},
+        ]
+        for param_dict in invalid:
+            for processor in (None, ModelFilterProcessor(Customer)):
+                with self.assertRaises(ODataException, msg=param_dict):
+                    self.rows(param_dict, processor)
+        # a model-bound processor rejects every alias naming a property of the model
+        with self.assertRaises(ODataException):
+            self.rows({"$apply": "aggregate(age with sum as name)"}, ModelFilterProcessor(Customer))
+        param_dict = {"$apply": grouped, "$filter": "total gt 60 and city ne 'x'", "$orderby": "total desc",
+                      "$select": "city,total"}
+        self.assertEqual(self.rows(param_dict), [{"city": "city1", "total": 72}, {"city": "city0", "total": 69}])
+        self.assertEqual(self.rows({"$apply": "aggregate(length(name) with sum as letters)"}), [{"letters": 16}])
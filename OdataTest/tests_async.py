@@ -0,0 +1,46 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from OdataTest.odata_async import apaginate, aiter_rows, astream_json
+from OdataTest.odata_count import ExactCount, WindowCount
+from OdataTest.odata_param_parser import django_params
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class ThreadCount(ExactCount):
+    def count(self, queryset, params):
+        self.thread = threading.current_thread()
+        return 42
+
+
+class AsyncTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(8):
+            Customer.objects.create(name='c{}'.format(i), city='city{}'.format(i % 2), age=20 + i, created=created)
+
+    async def test_apaginate(self):
+        param_dict = {"$filter": "age gt 21", "$orderby": "age", "$top": "3", "$count": "true"}
+        page = await apaginate(Customer.objects.all(), param_dict)
+        self.assertEqual(([c.age for c in page.rows], page.count), ([22, 23, 24], 6))
+        page = await apaginate(Customer.objects.all(), param_dict, strategy=WindowCount())
+        self.assertEqual(([c.age for c in page.rows], page.count), ([22, 23, 24], 6))
+        page = await apaginate(Customer.objects.all(), {"$select": "name", "$filter": "city eq 'city1'"})
+        self.assertEqual((page.rows, page.count), ([{"name": "c{}".format(i)} for i in (1, 3, 5, 7)], None))
+
+    async def test_executor(self):
+        strategy = ThreadCount()
+        with ThreadPoolExecutor(2, thread_name_prefix='odata-test') as executor:
+            page = await apaginate(Customer.objects.none(), {"$count": "true"}, strategy=strategy, executor=executor)
+        self.assertEqual(page, ([], 42))
+        self.assertTrue(strategy.thread.name.startswith('odata-test'))
+
+    async def test_streaming(self):
+        params = django_params({"$filter": "age lt 25", "$select": "name,age", "$orderby": "-age"})
+        rows = [row async for row in aiter_rows(Customer.objects.all(), params, chunk_size=2)]
+        self.assertEqual(rows, [{"name": "c{}".format(i), "age": 20 + i} for i in range(4, -1, -1)])
+        chunks = [chunk async for chunk in astream_json(Customer.objects.all(), params, chunk_size=2, count=5)]
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), {"@odata.count": 5, "value": rows})
@@ -0,0 +1,155 @@
+import json
+from datetime import datetime, timezone
+from django.db import transaction
+from django.test import TransactionTestCase
+from OdataTest.odata_batch import BatchProcessor, parse_multipart_batch
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.tests_support import ModelTestCase, Customer, Country
+
+
+MULTIPART_BATCH = """--batch_1\r
+Content-Type: application/http\r
+Content-ID: r1\r
+\r
+GET Customers?$filter=age%20gt%2022&$select=name HTTP/1.1\r
+\r
+\r
+--batch_1\r
+Content-Type: multipart/mixed; boundary=changeset_1\r
+\r
+--changeset_1\r
+Content-Type: application/http\r
+Content-ID: c1\r
+\r
+POST Countries HTTP/1.1\r
+Content-Type: application/json\r
+\r
+{"name": "Narnia"}\r
+--changeset_1\r
+Content-Type: application/http\r
+Content-ID: c2\r
+\r
+DELETE Customers(1) HTTP/1.1\r
+\r
+\r
+--changeset_1--\r
+--batch_1--\r
+"""
+
+
+class BatchTest(TransactionTestCase):
+    # parallel reads use their own connections, so the rows have to be committed
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        ModelTestCase.create_tables()
+
+    @classmethod
+    def tearDownClass(cls):
+        ModelTestCase.drop_tables()
+        super().tearDownClass()
+
+    def setUp(self):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(5):
+            Customer.objects.create(id=i + 1, name='c{}'.format(i), city='city', age=20 + i, created=created)
+        self.batch = BatchProcessor({'Customers': Customer, 'Countries': Country.objects.all()}, max_workers=3,
+                                    cache=FilterCache(), base_path='/odata/')
+
+    def tearDown(self):
+        self.batch.shutdown()
+        Customer.objects.all().delete()
+        Country.objects.all().delete()
+
+    def run_json(self, requests):
+        content_type, chunks = self.batch.handle(json.dumps({"requests": requests}), 'application/json')
+        self.assertEqual(content_type, 'application/json')
+        return {r["id"]: r for r in json.loads(b''.join(chunks))["responses"]}
+
+    def test_parallel_reads(self):
+        responses = self.run_json([
+            {"id": str(i), "method": "GET", "url": "/odata/Customers?$filter=age ge {}&$select=age&$count=true".format(20 + i)}
+            for i in range(5)
+        ] + [
+            {"id": "key", "method": "get", "url": "Customers(2)?$select=name"},
+            {"id": "bad", "method": "GET", "url": "Customers?$filter=age gt"},
+            {"id": "missing", "method": "GET", "url": "Orders"},
+        ])
+        for i in range(5):
+            self.assertEqual(responses[str(i)]["body"]["@odata.count"], 5 - i)
+            self.assertEqual(responses[str(i)]["body"]["value"], [{"age": a} for a in range(20 + i, 25)])
+        self.assertEqual(responses["key"], {"id": "key", "status": 200, "body": {"name": "c1"}})
+        self.assertEqual((responses["bad"]["status"], responses["missing"]["status"]), (400, 404))
+
+    def test_change_set(self):
+        responses = self.run_json([
+            {"id": "1", "method": "POST", "url": "Countries", "body": {"name": "a"}, "atomicityGroup": "g1"},
+            {"id": "2", "method": "PATCH", "url": "Customers(1)", "body": {"age": "old"}, "atomicityGroup": "g1"},
+            {"id": "3", "method": "POST", "url": "Countries", "body": {"name": "b"}, "atomicityGroup": "g2"},
+            {"id": "4", "method": "DELETE", "url": "Customers(99)", "atomicityGroup": "g2"},
+            {"id": "5", "method": "GET", "url": "Countries?$select=name", "dependsOn": ["1", "3"]},
+        ])
+        self.assertEqual([responses[i]["status"] for i in "12345"], [424, 400, 424, 404, 424])
+        self.assertEqual(responses["5"]["body"], {"error": {"message": "request 1 failed"}})
+        self.assertFalse(Country.objects.exists())
+
+        country = Country.objects.create(name='a')
+        responses = self.run_json([
+            {"id": "1", "method": "PATCH", "url": "Customers(1)", "body": {"country": country.pk}, "atomicityGroup": "g"},
+            {"id": "2", "method": "DELETE", "url": "Customers(2)", "atomicityGroup": "g"},
+        ])
+        self.assertEqual([responses[i]["status"] for i in "12"], [204, 204])
+        self.assertEqual(Customer.objects.get(pk=1).country, country)
+        self.assertFalse(Customer.objects.filter(pk=2).exists())
+
+    def test_request_order(self):
+        responses = self.run_json([
+            {"id": "1", "method": "GET", "url": "Countries?$select=name"},
+            {"id": "2", "method": "POST", "url": "Countries", "body": {"name": "a"}},
+            {"id": "3", "method": "GET", "url": "Countries?$select=name"},
+            {"id": "4", "method": "POST", "url": "Countries", "body": {"name": "b"}, "atomicityGroup": "g"},
+            {"id": "5", "method": "GET", "url": "Countries?$select=name&$orderby=name"},
+            {"id": "6", "method": "GET", "url": "Countries?$select=name", "dependsOn": ["g"]},
+        ])
+        self.assertEqual([responses[i]["status"] for i in "123456"], [200, 201, 200, 201, 200, 200])
+        self.assertEqual(responses["1"]["body"]["value"], [])
+        self.assertEqual(responses["3"]["body"]["value"], [{"name": "a"}])
+        self.assertEqual(responses["5"]["body"]["value"], [{"name": "a"}, {"name": "b"}])
+
+    def test_outer_transaction(self):
+        with transaction.atomic():
+            responses = self.run_json([
+                {"id": "1", "method": "POST", "url": "Countries", "body": {"name": "a"}},
+                {"id": "2", "method": "GET", "url": "Countries?$select=name"},
+                {"id": "3", "method": "GET", "url": "Customers?$filter=age gt 23&$select=name"},
+            ])
+        self.assertEqual(responses["2"]["body"]["value"], [{"name": "a"}])
+        self.assertEqual(responses["3"]["body"]["value"], [{"name": "c4"}])
+
+    def test_writable_fields(self):
+        responses = self.run_json([
+            {"id": "1", "method": "POST", "url": "Countries", "body": {"id": 50, "name": "a"}},
+            {"id": "2", "method": "POST", "url": "Countries", "body": {"title": "a"}},
+            {"id": "3", "method": "PATCH", "url": "Customers(1)", "body": {"pk": 7}},
+            {"id": "4", "method": "PUT", "url": "Customers(1)", "body": ["age", 3]},
+            {"id": "5", "method": "PATCH", "url": "Customers(1)", "body": {"age": 40}},
+        ])
+        self.assertEqual([responses[i]["status"] for i in "12345"], [400, 400, 400, 400, 204])
+        self.assertFalse(Country.objects.exists())
+        self.assertEqual(Customer.objects.get(pk=1).age, 40)
+
+    def test_multipart(self):
+        requests = parse_multipart_batch(MULTIPART_BATCH, 'multipart/mixed; boundary=batch_1')
+        self.assertEqual([(r.id, r.method, r.atomicity_group) for r in requests],
+                         [('r1', 'GET', None), ('c1', 'POST', 'changeset_1'), ('c2', 'DELETE', 'changeset_1')])
+        self.assertEqual(requests[1].body, {"name": "Narnia"})
+        content_type, chunks = self.batch.handle(MULTIPART_BATCH.encode(), 'multipart/mixed; boundary=batch_1')
+        body = b''.join(chunks).decode()
+        boundary = content_type.split('boundary=')[1]
+        self.assertTrue(body.endswith('--{}--\r\n'.format(boundary)))
+        self.assertEqual(body.count('HTTP/1.1 '), 3)
+        self.assertIn('HTTP/1.1 201 Created', body)
+        self.assertIn('{"value":[{"name":"c3"},{"name":"c4"}]}', body)
+        self.assertTrue(Country.objects.filter(name='Narnia').exists())
+        self.assertFalse(Customer.objects.filter(pk=1).exists())
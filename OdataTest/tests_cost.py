@@ -0,0 +1,45 @@
+from django.test import TestCase
+from OdataTest.odata_param_parser import django_params, FilterProcessor, ODataException, grammar
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_filter_parser import parse
+from OdataTest.odata_cost import CostModel
+from OdataTest.tests_param_parser import FILTER_TESTS
+
+
+class CostModelTest(TestCase):
+    def test_measure(self):
+        filter_text = "a/b/c eq 1 or (contains(name, 'x') and not (Price add 2 eq 5 or endswith(name, 'y')))"
+        for tree in (grammar.parse(filter_text), parse(filter_text)):
+            cost = CostModel().measure(tree)
+            self.assertEqual(cost[:6], (9, 4, 2, 2, 1, 2))
+            self.assertEqual(cost.cost, 9 + 8 + 4 + 40 + 10 + 10)
+
+    def test_corpus_within_default_budget(self):
+        processor = FilterProcessor(cost_model=CostModel(max_cost=200, max_depth=10))
+        for t in FILTER_TESTS:
+            self.assertEqual(django_params(t[0], processor=processor), t[1], msg=t[0])
+
+    def test_limits(self):
+        cases = [
+            (CostModel(max_disjuncts=3), " or ".join("Id eq {}".format(i) for i in range(5)), "disjuncts 4"),
+            (CostModel(max_depth=3), "((((Name eq 'John'))))", "depth 4"),
+            (CostModel(max_like_functions=0), "contains(name, 'x')", "like functions 1"),
+            (CostModel(max_navigation=1), "a/b/c eq 1", "navigation 2"),
+            (CostModel(max_cost=10), "Price add 2 eq 5 and Name eq 'x'", "estimated cost 14"),
+            (CostModel(max_length=10), "Name eq 'John'", "14 characters"),
+        ]
+        for cost_model, filter_text, message in cases:
+            for cache in (None, FilterCache()):
+                with self.assertRaisesRegex(ODataException, message):
+                    django_params({"$filter": filter_text}, cache=cache, processor=FilterProcessor(cost_model=cost_model))
+
+    def test_cache_is_per_cost_model(self):
+        cache = FilterCache()
+        django_params({"$filter": "contains(name, 'x')"}, cache=cache)
+        with self.assertRaises(ODataException):
+            django_params({"$filter": "contains(name, 'y')"}, cache=cache,
+                          processor=FilterProcessor(cost_model=CostModel(max_like_functions=0)))
+
+    def test_recursion_is_reported(self):
+        with self.assertRaisesRegex(ODataException, "nested too deeply"):
+            django_params({"$filter": "(" * 2000 + "a eq 1" + ")" * 2000})
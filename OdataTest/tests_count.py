@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from OdataTest.odata_count import paginate, count_requested, WindowCount, CachedCount, EstimatedCount, ExactCount
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class CountTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(12):
+            Customer.objects.create(name='c{:02}'.format(i), city='city{}'.format(i % 3), age=20 + i, created=created)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count_requested(self):
+        self.assertTrue(count_requested({"$count": "true"}))
+        self.assertTrue(count_requested({"$inlinecount": "allpages"}))
+        self.assertFalse(count_requested({"$inlinecount": "none"}))
+        self.assertFalse(count_requested({}))
+
+    def test_no_count(self):
+        page = paginate(Customer.objects.all(), {"$top": "3"})
+        self.assertEqual((len(page.rows), page.count), (3, None))
+
+    def test_window_count_single_query(self):
+        param_dict = {"$filter": "age gt 23", "$orderby": "age", "$top": "3", "$skip": "2", "$count": "true"}
+        with CaptureQueriesContext(connection) as queries:
+            page = paginate(Customer.objects.all(), param_dict, strategy=WindowCount())
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(page.count, 8)
+        self.assertEqual([c.age for c in page.rows], [26, 27, 28])
+        self.assertFalse(hasattr(page.rows[0], 'odata_count'))
+
+    def test_window_count_values(self):
+        param_dict = {"$filter": "city eq 'city1'", "$select": "name", "$inlinecount": "allpages"}
+        page = paginate(Customer.objects.all(), param_dict, strategy=WindowCount())
+        self.assertEqual(page.count, 4)
+        self.assertEqual(page.rows[0], {"name": "c01"})
+
+    def test_window_count_past_end(self):
+        param_dict = {"$filter": "age gt 23", "$skip": "50", "$count": "true"}
+        page = paginate(Customer.objects.all(), param_dict, strategy=WindowCount())
+        self.assertEqual((page.rows, page.count), ([], 8))
+
+    def test_cached_count(self):
+        strategy = CachedCount(ttl=30)
+        param_dict = {"$filter": "age gt 23", "$top": "2", "$count": "true"}
+        self.assertEqual(paginate(Customer.objects.all(), param_dict, strategy=strategy).count, 8)
+        Customer.objects.filter(age=30).delete()
+        with CaptureQueriesContext(connection) as queries:
+            page = paginate(Customer.objects.all(), param_dict, strategy=strategy)
+        self.assertEqual((len(queries), page.count), (1, 8))
+        param_dict["$filter"] = "age gt 24"
+        self.assertEqual(paginate(Customer.objects.all(), param_dict, strategy=strategy).count, 6)
+
+    def test_estimated_count_falls_back(self):
+        strategy = EstimatedCount(threshold=1, exact=ExactCount())
+        page = paginate(Customer.objects.all(), {"$filter": "age lt 22", "$count": "true"}, strategy=strategy)
+        self.assertEqual(page.count, 2)
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from OdataTest.odata_param_parser import django_params, apply_params, ODataException
+from OdataTest.tests_support import ModelTestCase, Country, Customer, Order, Tag
+
+
+class ExpandTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        countries = [Country.objects.create(name='country{}'.format(i)) for i in range(2)]
+        tags = [Tag.objects.create(name='tag{}'.format(i), active=i % 2 == 0) for i in range(3)]
+        for i in range(6):
+            customer = Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created,
+                                               country=countries[i % 2])
+            customer.tags.set(tags[:i % 3 + 1])
+            for j in range(4):
+                Order.objects.create(customer=customer, amount=Decimal(10 * j + i), active=j % 2 == 0)
+
+    def fetch(self, model, param_dict):
+        params = django_params(param_dict, model=model)
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(apply_params(model.objects.all(), params))
+        return rows, len(queries)
+
+    def test_expand_params(self):
+        params = django_params({"$expand": "country,orders($select=amount;$top=2)", "$select": "name"}, model=Customer)
+        self.assertEqual(params["select_related"], ["country"])
+        self.assertEqual(params["only"], ["name", "country"])
+        prefetch = params["prefetch_related"][0]
+        self.assertEqual(prefetch.prefetch_through, "orders")
+        self.assertEqual(prefetch.queryset.query.deferred_loading, ({"amount", "customer"}, False))
+        sliced = prefetch.get_current_querysets(0)[0].query
+        self.assertEqual((sliced.low_mark, sliced.high_mark), (0, 2))
+
+    def test_constant_queries(self):
+        param_dict = {"$expand": "country,tags($filter=active eq true),orders($filter=active eq true;$orderby=amount desc)"}
+        rows, queries = self.fetch(Customer, param_dict)
+        self.assertEqual(queries, 3)
+        self.assertEqual(rows[0].country.name, 'country0')
+        self.assertEqual([t.name for t in rows[2].tags.all()], ['tag0', 'tag2'])
+        self.assertEqual([o.amount for o in rows[1].orders.all()], [Decimal(21), Decimal(1)])
+
+    def test_nested_top_and_select(self):
+        param_dict = {"$expand": "orders($select=amount;$orderby=amount;$top=2)", "$select": "name", "$orderby": "name"}
+        rows, queries = self.fetch(Customer, param_dict)
+        self.assertEqual(queries, 2)
+        self.assertEqual([[o.amount for o in c.orders.all()] for c in rows[:2]],
+                         [[Decimal(0), Decimal(10)], [Decimal(1), Decimal(11)]])
+
+    def test_many_to_many_top(self):
+        rows, queries = self.fetch(Customer, {"$expand": "tags($orderby=name desc;$top=1)", "$orderby": "name"})
+        self.assertEqual(queries, 2)
+        self.assertEqual([[t.name for t in c.tags.all()] for c in rows[:3]], [['tag0'], ['tag1'], ['tag2']])
+        rows, _ = self.fetch(Customer, {"$expand": "tags($orderby=name;$skip=1;$top=1)", "$orderby": "name"})
+        self.assertEqual([[t.name for t in c.tags.all()] for c in rows[:3]], [[], ['tag1'], ['tag1']])
+
+    def test_nested_expand(self):
+        rows, queries = self.fetch(Order, {"$expand": "customer($select=name;$expand=country)", "$select": "amount"})
+        self.assertEqual(queries, 1)
+        self.assertEqual(rows[0].customer.country.name, 'country0')
+        rows, queries = self.fetch(Country, {"$expand": "customers($expand=orders($top=1))"})
+        self.assertEqual(queries, 3)
+        self.assertEqual(len(rows[0].customers.all()[0].orders.all()), 1)
+
+    def test_errors(self):
+        with self.assertRaises(ODataException):
+            django_params({"$expand": "orders"})
+        with self.assertRaises(ODataException):
+            django_params({"$expand": "name"}, model=Customer)
+        with self.assertRaises(ODataException):
+            django_params({"$expand": "missing"}, model=Customer)
+        with self.assertRaises(ODataException):
+            django_params({"$expand": "country($top=1)"}, model=Customer)
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from django.db import models
+from OdataTest.odata_param_parser import django_params
+from OdataTest.odata_filter_cache import FilterCache, lift_literals
+from OdataTest.tests_param_parser import FILTER_TESTS
+
+
+class FilterCacheTest(TestCase):
+    def test_filter_corpus(self):
+        cache = FilterCache()
+        for _ in range(2):
+            for t in FILTER_TESTS:
+                result = django_params(t[0], cache=cache)
+                self.assertEqual(result, t[1], msg=t[0])
+        self.assertEqual(cache.info().hits, cache.info().misses)
+
+    def test_uncached(self):
+        for t in FILTER_TESTS:
+            result = django_params(t[0], cache=None)
+            self.assertEqual(result, t[1], msg=t[0])
+
+    def test_lift_literals(self):
+        shape, literals, _ = lift_literals("Price2 le -1.5 and Name eq 'It 3' and d gt datetime'2017-03-01T00:00:00'")
+        self.assertEqual(shape, "Price2 le 0.0 and Name eq '?' and d gt datetime'?'")
+        self.assertEqual(literals, [('number', '-1.5'), ('string', "'It 3'"), ('datetime', "datetime'2017-03-01T00:00:00'")])
+
+    def test_rebind_same_shape(self):
+        cache = FilterCache()
+        django_params({"$filter": "Name eq 'John' and Age gt 65"}, cache=cache)
+        result = django_params({"$filter": "Name eq 'Ann' and Age gt 11"}, cache=cache)
+        self.assertEqual(result, {"filter": models.Q(Name='Ann') & models.Q(Age__gt=11)})
+        self.assertEqual(cache.info()[:3], (1, 1, 0))
+        django_params({"$filter": "Name eq 'Ann' and Age gt 11.5"}, cache=cache)
+        self.assertEqual(cache.info()[:3], (1, 2, 0))
+
+    def test_eviction(self):
+        cache = FilterCache(maxsize=2)
+        for f in ("a eq 1", "b eq 1", "c eq 1", "a eq 2"):
+            django_params({"$filter": f}, cache=cache)
+        self.assertEqual(cache.info(), (0, 4, 2, 2, 2))
+        cache.maxsize = 1
+        self.assertEqual(cache.info(), (0, 4, 3, 1, 1))
@@ -0,0 +1,31 @@
+from django.test import TestCase
+from django.db import models
+from OdataTest.odata_param_parser import django_params, FilterProcessor, ODataException
+from OdataTest.odata_filter_parser import parse
+from OdataTest.tests_param_parser import FILTER_TESTS
+
+
+class FilterParserTest(TestCase):
+    def test_filter_corpus(self):
+        processor = FilterProcessor(parser=parse)
+        for t in FILTER_TESTS:
+            result = django_params(t[0], cache=None, processor=processor)
+            self.assertEqual(result, t[1], msg=t[0])
+
+    def test_right_nested_chain(self):
+        tree = parse("a eq 1 and b eq 2 or c eq 3")
+        self.assertEqual([c.expr_name for c in tree.children], ['common_expr', 'and_expr'])
+        self.assertEqual(tree.children[1].children[0].text, "b eq 2 or c eq 3")
+
+    def test_long_chain(self):
+        filter_text = " or ".join("Id eq {}".format(i) for i in range(300))
+        self.assertEqual(parse(filter_text).text, filter_text)
+
+    def test_not_prefix_is_not_a_keyword(self):
+        processor = FilterProcessor(parser=parse)
+        self.assertEqual(processor.process("notes eq 1"), {"filter": models.Q(notes=1)})
+
+    def test_errors(self):
+        for filter_text in ("Name eq", "Name eq 'John' and", "(Name eq 'John'", "Name", "Name eq ''", "Name eq 'a' #"):
+            with self.assertRaises(ODataException, msg=filter_text):
+                parse(filter_text)
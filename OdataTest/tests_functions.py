@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from django.db import models
+from django.db.models import functions
+from OdataTest.odata_param_parser import (apply_params, django_params, FilterProcessor, FUNCTIONS, ODataException,
+                                          register_function)
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_schema import ModelFilterProcessor
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class CountingProcessor(FilterProcessor):
+    calls = 0
+
+    def function_expr(self, node):
+        CountingProcessor.calls += 1
+        return super().function_expr(node)
+
+
+class FunctionTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+        for i, name in enumerate(['Alfreds Futterkiste', 'Ana Trujillo', 'Antonio Moreno', 'Around the Horn']):
+            Customer.objects.create(name=name, city='city{}'.format(i), age=16 + i * 4, rating=i * 1.5,
+                                    created=created)
+
+    def names(self, filter_text, processor=None, cache=None):
+        params = django_params({"$filter": filter_text, "$orderby": "id"}, cache=cache,
+                               processor=processor or FilterProcessor(inline_expressions=True))
+        return [c.name for c in apply_params(Customer.objects.all(), params)]
+
+    def test_computed_in_database(self):
+        filters = {
+            "indexof(name, 'n') eq 1": ['Ana Trujillo', 'Antonio Moreno'],
+            "indexof(name, 'x') eq -1 and indexof(name, 'o') ge 0": ['Ana Trujillo', 'Antonio Moreno',
+                                                                     'Around the Horn'],
+            "substring(name, 4) eq 'Trujillo'": ['Ana Trujillo'],
+            "substring(name, 0, 3) eq 'Ant'": ['Antonio Moreno'],
+            "replace(name, ' ', '.') eq 'Around.the.Horn'": ['Around the Horn'],
+            "sqrt(age) eq 4 or power(rating, 2) gt 10": ['Alfreds Futterkiste', 'Around the Horn'],
+            "mod(age, 8) eq 0": ['Alfreds Futterkiste', 'Antonio Moreno'],
+            "contains(replace(name, ' ', '_'), 'o_M')": ['Antonio Moreno'],
+            "replace(tolower(name), 'a', 'b') eq 'bnb trujillo'": ['Ana Trujillo'],
+            "indexof(tolower(name), 'the') eq 7": ['Around the Horn'],
+            "concat(toupper(trim(name)), city) eq 'ANA TRUJILLOcity1'": ['Ana Trujillo'],
+            "power(year(created), 1) eq 2020 and substring(name, 0, 2) eq 'An'": ['Ana Trujillo', 'Antonio Moreno'],
+        }
+        for cache in (None, FilterCache()):
+            for processor in (FilterProcessor(inline_expressions=True),
+                              ModelFilterProcessor(Customer, inline_expressions=True)):
+                for filter_text, expected in filters.items():
+                    self.assertEqual(self.names(filter_text, processor, cache), expected, msg=filter_text)
+        params = django_params({"$filter": "sqrt(age) eq 4"}, processor=FilterProcessor(inline_expressions=True))
+        sql = str(apply_params(Customer.objects.all(), params).query)
+        self.assertIn('SQRT', sql.upper())
+
+    def test_register_function(self):
+        register_function('log', ('number',), functions.Ln)
+        try:
+            self.assertEqual(self.names("log(age) lt 2.9"), ['Alfreds Futterkiste'])
+        finally:
+            del FUNCTIONS['log']
+        with self.assertRaises(ODataException):
+            self.names("log(age) lt 2.9")
+        with self.assertRaises(ValueError):
+            register_function('log', ('float',), functions.Ln)
+
+    def test_invalid_arguments(self):
+        for filter_text in ("sqrt(age, 2) eq 1", "substring(name) eq 'A'", "concat(name) eq 'A'",
+                            "replace(name, 'a') eq 'A'", "indexof(contains(name, 'A'), 'A') eq 0"):
+            with self.assertRaises(ODataException, msg=filter_text):
+                self.names(filter_text)
+        processor = ModelFilterProcessor(Customer, inline_expressions=True)
+        self.assertEqual(self.names("substring(name, '4') eq 'Trujillo'", processor), ['Ana Trujillo'])
+        for filter_text in ("substring(name, 'x') eq 'A'", "power(name, 2) eq 1", "indexof(age, '1') eq 0"):
+            with self.assertRaises(ODataException, msg=filter_text):
+                self.names(filter_text, processor)
+
+    def test_nested_arguments_translated_once(self):
+        filter_text = "name"
+        for _ in range(12):
+            filter_text = "concat({}, 'x')".format(filter_text)
+        CountingProcessor.calls = 0
+        params = django_params({"$filter": filter_text + " eq 'x'"}, cache=None, processor=CountingProcessor())
+        self.assertEqual(CountingProcessor.calls, 12)
+        self.assertIsInstance(params["annotate"]["annotated_value"], functions.Concat)
+        self.assertEqual(self.names("concat(concat(city, ':'), name) eq 'city1:Ana Trujillo'"), ['Ana Trujillo'])
+        self.assertEqual(django_params({"$filter": "tolower(trim(name)) eq 'a'"})["filter"],
+                         models.Q(name__trim__lower='a'))
@@ -0,0 +1,31 @@
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from OdataTest import odata_grammar, odata_param_parser
+
+
+class GrammarTest(TestCase):
+    def test_import_is_lazy(self):
+        code = ("import sys, OdataTest.odata_param_parser, OdataTest.odata_grammar as g; "
+                "print('parsimonious' in sys.modules, g._grammar is None)")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=root)
+        self.assertEqual(output.stdout.split(), ['False', 'True'])
+
+    def test_prebuilt_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'grammar.pickle')
+            self.assertIsNone(odata_grammar.load_prebuilt(path))
+            odata_grammar.write_prebuilt(path)
+            grammar = odata_grammar.load_prebuilt(path)
+            self.assertEqual(grammar.parse("Price lt 10").text, "Price lt 10")
+            with open(path, 'wb') as f:
+                pickle.dump(('stale', grammar), f)
+            self.assertIsNone(odata_grammar.load_prebuilt(path))
+
+    def test_module_grammar(self):
+        self.assertIs(odata_param_parser.grammar, odata_grammar.get_grammar())
+        self.assertEqual(odata_grammar.parse("Name eq 'x'").expr_name, 'bool_common_expr')
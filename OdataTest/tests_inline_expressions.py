@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+from django.db import models
+from django.db.models import functions, lookups
+from OdataTest.odata_param_parser import apply_params, django_params, FilterProcessor
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class InlineExpressionsTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(6):
+            Customer.objects.create(name='c{}'.format(i), city='city{}'.format(i % 2), age=20 + i, created=created,
+                                    rating=None if i % 3 == 0 else i / 2)
+
+    def params(self, filter_text, cache=None):
+        return django_params({"$filter": filter_text}, cache=cache, processor=FilterProcessor(inline_expressions=True))
+
+    def test_translation(self):
+        for cache in (None, FilterCache()):
+            self.assertEqual(self.params("age add 1 gt 21", cache), {
+                "filter": models.Q(lookups.GreaterThan(models.F("age") + 1, models.Value(21)))
+            })
+            self.assertEqual(self.params("concat(name, city) ne 'c1city1'", cache), {
+                "filter": ~models.Q(lookups.Exact(functions.Concat(models.F("name"), models.F("city")),
+                                                  models.Value("c1city1")))
+            })
+
+    def test_many_computed_predicates(self):
+        filters = {
+            "age add 1 gt 21 and age mul 2 lt 50": ['c1', 'c2', 'c3', 'c4'],
+            "age sub 20 eq 1 or concat(name, city) eq 'c4city0' or rating mul 2 ge 5": ['c1', 'c4', 'c5'],
+            "age mod 2 eq 1 and rating add 0 ne 2.5": ['c1'],
+        }
+        for filter_text, expected in filters.items():
+            params = self.params(filter_text)
+            self.assertNotIn("annotate", params)
+            queryset = apply_params(Customer.objects.order_by('pk'), params)
+            sql = str(queryset.query)
+            self.assertEqual(sql.split(' FROM ')[0], str(Customer.objects.all().query).split(' FROM ')[0])
+            self.assertEqual([c.name for c in queryset], expected, msg=filter_text)
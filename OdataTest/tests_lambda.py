@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_filter_parser import parse
+from OdataTest.odata_memory import evaluate
+from OdataTest.odata_param_parser import apply_params, django_params, FilterProcessor, ODataException
+from OdataTest.odata_schema import ModelFilterProcessor
+from OdataTest.tests_support import ModelTestCase, Country, Customer, Order, Tag
+
+
+FILTERS = {
+    "orders/any(o: o/amount gt 20)": ['c1', 'c2'],
+    "orders/any()": ['c0', 'c1', 'c2'],
+    "not orders/any()": ['c3'],
+    "orders/all(o: o/active eq true)": ['c0', 'c2', 'c3'],
+    "orders/all(o: o/amount mul 2 gt 20) and age gt 20": ['c1', 'c2', 'c3'],
+    "tags/any(t: t/name eq 'vip') or orders/any(o: o/amount eq 5)": ['c0', 'c2'],
+    "country/customers/any(c: c/orders/any(o: o/amount gt 25))": ['c0', 'c1', 'c2'],
+}
+
+
+class LambdaTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='x')
+        vip = Tag.objects.create(name='vip')
+        created = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+        amounts = [[5, 10], [30, 15, 25], [40, 50], []]
+        for i, customer_amounts in enumerate(amounts):
+            customer = Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created,
+                                               country=country if i < 3 else None)
+            for j, amount in enumerate(customer_amounts):
+                Order.objects.create(customer=customer, amount=Decimal(amount), active=i != 1 or j == 0)
+        Customer.objects.get(name='c2').tags.add(vip)
+
+    def names(self, filter_text, processor, cache=None):
+        params = django_params({"$filter": filter_text, "$orderby": "id"}, cache=cache, processor=processor)
+        return [c.name for c in apply_params(Customer.objects.all(), params)]
+
+    def test_same_rows_with_every_processor(self):
+        processors = [FilterProcessor(), FilterProcessor(parser=parse), ModelFilterProcessor(Customer)]
+        for cache in (None, FilterCache()):
+            for processor in processors:
+                for filter_text, expected in FILTERS.items():
+                    self.assertEqual(self.names(filter_text, processor, cache), expected, msg=filter_text)
+
+    def test_exists_instead_of_join(self):
+        params = django_params({"$filter": "orders/any(o: o/amount gt 10)"}, cache=None)
+        queryset = apply_params(Customer.objects.all(), params)
+        sql = str(queryset.query)
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('DISTINCT', sql)
+        # joining the orders returns a customer once per matching order
+        self.assertEqual(Customer.objects.filter(orders__amount__gt=10).count(), 5)
+        self.assertEqual(queryset.count(), 2)
+
+    def test_in_memory(self):
+        customers = list(Customer.objects.prefetch_related('orders', 'tags', 'country__customers__orders'))
+        for filter_text, expected in FILTERS.items():
+            rows = evaluate(customers, {"$filter": filter_text, "$orderby": "id"},
+                            processor=FilterProcessor(inline_expressions=True))
+            self.assertEqual([c.name for c in rows], expected, msg=filter_text)
+
+    def test_invalid_lambdas(self):
+        invalid = [
+            (FilterProcessor(), "orders/all()"),
+            (FilterProcessor(), "orders/any(o: amount gt 1)"),
+            (FilterProcessor(), "orders/any(o: o eq 1)"),
+            (FilterProcessor(), "orders/any(o: o/items/any(i: o/amount gt 1))"),
+            (FilterProcessor(), "country/any(c: c/name eq 'x')"),
+            (FilterProcessor(parser=parse), "orders/any(o/x: o/amount gt 1)"),
+            (ModelFilterProcessor(Customer), "country/any(c: c/name eq 'x')"),
+            (ModelFilterProcessor(Customer), "orders/any(o: o/unknown gt 1)"),
+            (ModelFilterProcessor(Customer), "orders/any(o: o/amount gt 'x')"),
+        ]
+        for processor, filter_text in invalid:
+            with self.assertRaises(ODataException, msg=filter_text):
+                self.names(filter_text, processor)
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from django.core.exceptions import FieldError
+from django.db.models import F, Q, Value, functions, lookups
+from OdataTest.odata_memory import MemoryQuery, evaluate
+from OdataTest.odata_param_parser import apply_params, django_params, FilterProcessor, ODataException
+from OdataTest.odata_schema import ModelFilterProcessor
+from OdataTest.tests_support import ModelTestCase, Customer, Country
+
+
+FILTERS = [
+    "age gt 21 and city ne 'city1'",
+    "rating ne 2.5",
+    "not (rating lt 2 or age eq 27)",
+    "rating eq null or contains(name, '_3')",
+    "startswith(city, 'city2') and not endswith(name, '5')",
+    "city eq 'city0' and age ge 23",
+    "age add 1 gt 24 and age mod 3 eq 1",
+    "age div 2 eq 11",
+    "rating mul 2 ge 5",
+    "rating sub 0.5 le 1",
+    "concat(name, city) eq 'c_1city1'",
+    "country/name eq 'Narnia'",
+    "year(created) eq 2020 and day(created) le 3",
+    "created lt datetime'2020-01-04T00:00:00'",
+    "substringof('_1', name)",
+    "indexof(name, '_') eq 1 and substring(city, 4) eq '1'",
+    "replace(name, '_', '-') eq 'c-2' or power(age, 2) gt 700",
+    "sqrt(age) lt 4.8 and mod(age, 4) eq 1",
+    "contains(name, 'C') and not startswith(city, 'CITY1')",
+    "endswith(concat(name, 'X'), '_1x')",
+]
+UNSUPPORTED = [
+    "tolower(name) eq 'c_1'",
+    "length(name) eq 3",
+    "trim(city) eq 'city1'",
+    "round(rating) eq 2",
+    "ceiling(rating) eq 2",
+    "floor(rating) eq 2",
+]
+
+
+class MemoryQueryTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        narnia = Country.objects.create(name='Narnia')
+        for i in range(8):
+            Customer.objects.create(name='c_{}'.format(i), city='city{}'.format(i % 3), age=20 + i,
+                                    rating=None if i % 4 == 0 else i / 2, country=narnia if i % 2 else None,
+                                    created=datetime(2020, 1, 1 + i, 12, tzinfo=timezone.utc))
+
+    def setUp(self):
+        self.customers = list(Customer.objects.select_related('country'))
+        self.dicts = [{**{f.attname: getattr(c, f.attname) for f in c._meta.concrete_fields},
+                       "country": c.country and {"name": c.country.name}} for c in self.customers]
+
+    def test_same_rows_as_orm(self):
+        for filter_text in FILTERS:
+            for processor in (FilterProcessor(inline_expressions=True), ModelFilterProcessor(Customer, sargable=True, inline_expressions=True)):
+                if 'datetime' in filter_text and type(processor) is FilterProcessor:
+                    continue
+                param_dict = {"$filter": filter_text, "$orderby": "rating desc,id"}
+                expected = [c.pk for c in apply_params(Customer.objects.all(), django_params(param_dict, processor=processor))]
+                rows = evaluate(self.customers, param_dict, processor=processor, using='default')
+                self.assertEqual([c.pk for c in rows], expected, msg=filter_text)
+                rows = evaluate(self.dicts, param_dict, processor=processor, using='default')
+                self.assertEqual([c["id"] for c in rows], expected, msg=filter_text)
+
+    def test_annotations_and_projection(self):
+        param_dict = {"$filter": "age sub 20 lt 3", "$orderby": "age desc", "$select": "name,country/name",
+                      "$top": 2, "$skip": 1}
+        params = django_params(param_dict)
+        self.assertIn("annotate", params)
+        expected = list(apply_params(Customer.objects.all(), params))
+        self.assertEqual(expected, [{"name": "c_1", "country__name": "Narnia"}, {"name": "c_0", "country__name": None}])
+        self.assertEqual(MemoryQuery(params)(self.customers), expected)
+        self.assertEqual(MemoryQuery(params)(self.dicts), expected)
+
+    def test_nulls_order_and_errors(self):
+        params = django_params({"$orderby": "rating,id"})
+        ratings = [c.rating for c in MemoryQuery(params)(self.customers)]
+        self.assertEqual(ratings, [c.rating for c in apply_params(Customer.objects.all(), params)])
+        self.assertEqual(ratings[:2], [None, None])
+        self.assertEqual([c.rating for c in MemoryQuery(params, nulls_largest=True)(self.customers)][-2:], [None, None])
+        # SQL ROUND rounds 2.5 away from zero
+        params = {"filter": Q(lookups.Exact(functions.Round(F('rating')), Value(2))), "order_by": ["id"]}
+        self.assertEqual([c.rating for c in MemoryQuery(params)(self.customers)], [1.5])
+        self.assertEqual([c.rating for c in apply_params(Customer.objects.all(), params)], [1.5])
+        with self.assertRaises(ODataException):
+            evaluate(self.dicts, {"$filter": "contains(age, '1')"})
+        with self.assertRaises(ODataException):
+            MemoryQuery(django_params({"$expand": "orders"}, model=Customer))
+        # unknown paths and non-collections in a lambda
+        for filter_text in ("unknown eq 1", "name/any(t: t/name eq 'x')"):
+            with self.assertRaises(ODataException, msg=filter_text):
+                evaluate(self.customers, {"$filter": filter_text})
+        with self.assertRaises(ODataException):
+            MemoryQuery({"filter": Q(annotated_value=0)})(self.customers)
+        # like Substr, both reject a start before the first character
+        for rows in (self.customers, self.dicts):
+            with self.assertRaises(ODataException):
+                evaluate(rows, {"$filter": "substring(name, -1) eq 'c_1'"})
+        with self.assertRaises(ODataException):
+            django_params({"$filter": "substring(name, -1) eq 'c_1'"})
+        params = {"filter": Q(lookups.Exact(functions.Substr(F('name'), F('age') - 20), Value('c_1')))}
+        with self.assertRaises(ODataException):
+            MemoryQuery(params)(self.customers)
+
+    def test_case_and_unsupported_lookups(self):
+        param_dict = {"$filter": "contains(name, 'C')"}
+        self.assertEqual(evaluate(self.dicts, param_dict), [])
+        self.assertEqual(len(evaluate(self.dicts, param_dict, ascii_case_like=True)), 8)
+        self.assertEqual(len(list(apply_params(Customer.objects.all(), django_params(param_dict)))), 8)
+        for filter_text in UNSUPPORTED:
+            with self.assertRaises(FieldError, msg=filter_text):
+                list(apply_params(Customer.objects.all(), django_params({"$filter": filter_text})))
+            with self.assertRaises(ODataException, msg=filter_text):
+                evaluate(self.dicts, {"$filter": filter_text})
@@ -0,0 +1,115 @@
+from datetime import datetime, timezone
+from django.db.models import Q
+from OdataTest.odata_param_parser import django_params, FilterProcessor
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_filter_parser import parse
+from OdataTest.odata_optimizer import optimize_q, FALSE
+from OdataTest.tests_param_parser import FILTER_TESTS
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+OPTIMIZER_TESTS = [
+    (
+        "Id eq 1 or Id eq 2 or Id eq 3 or Id eq 2",
+        Q(Id__in=[1, 2, 3])
+    ),
+    (
+        "Price ge 10 and Price le 20",
+        Q(Price__range=(10, 20))
+    ),
+    (
+        "Price gt 10 and Price ge 12 and Price lt 30 and Price lt 20",
+        Q(Price__gte=12) & Q(Price__lt=20)
+    ),
+    (
+        "Price ge 10 and Price le 20 and Price eq 15",
+        Q(Price=15)
+    ),
+    (
+        "Price gt 20 and Price lt 10",
+        FALSE
+    ),
+    (
+        "Name eq 'a' and Name eq 'A'",
+        Q(Name='a') & Q(Name='A')
+    ),
+    (
+        "Name gt 'a' and Name lt 'B'",
+        Q(Name__gt='a') & Q(Name__lt='B')
+    ),
+    (
+        "Active eq 1 or Active eq true or Active eq 1",
+        Q(Active__in=[1, True])
+    ),
+    (
+        "Active eq 1 and Active eq true",
+        Q(Active=1) & Q(Active=True)
+    ),
+    (
+        "Name eq 'a' or (Age gt 5 and Age lt 2)",
+        Q(Name='a')
+    ),
+    (
+        "not (Age gt 5 and Age lt 2)",
+        Q()
+    ),
+    (
+        "Name eq 'John' and (Age eq 65 or Age eq 11) and Name eq 'John'",
+        Q(Name='John') & Q(Age__in=[65, 11])
+    ),
+    (
+        "year(created) eq 2020 or year(created) eq 2021 or contains(name, 'x')",
+        Q(created__year__in=[2020, 2021]) | Q(name__contains='x')
+    ),
+    (
+        "Price ge '10' and Price le 20",
+        Q(Price__gte='10') & Q(Price__lte=20)
+    ),
+    (
+        "not (Id eq 1 or Id eq 2)",
+        ~Q(Id__in=[1, 2])
+    ),
+]
+
+
+class OptimizerTest(ModelTestCase):
+    def test_rewrites(self):
+        processor = FilterProcessor(optimize=True)
+        for filter_text, expected in OPTIMIZER_TESTS:
+            for cache in (None, FilterCache()):
+                result = django_params({"$filter": filter_text}, cache=cache, processor=processor)
+                self.assertEqual(result["filter"], expected, msg=filter_text)
+        # Q equality takes 1 for True, the literal types must survive
+        result = django_params({"$filter": "Active eq 1 and Active eq true"}, processor=processor)
+        self.assertEqual([type(v) for _, v in result["filter"].children], [int, bool])
+
+    def test_corpus_semantics_kept(self):
+        for t in FILTER_TESTS:
+            expected = t[1]["filter"]
+            if isinstance(expected, Q):
+                self.assertEqual(optimize_q(expected), optimize_q(optimize_q(expected)), msg=t[0])
+
+    def test_long_chain(self):
+        filter_text = " or ".join("age eq {}".format(i) for i in range(500))
+        result = django_params({"$filter": filter_text}, processor=FilterProcessor(parser=parse, optimize=True))
+        self.assertEqual(result["filter"], Q(age__in=list(range(500))))
+
+    def test_same_rows(self):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(20):
+            Customer.objects.create(name='c{}'.format(i), city='city{}'.format(i % 4), age=i, created=created)
+        filters = [
+            "age eq 1 or age eq 3 or city eq 'city2'",
+            "age ge 3 and age le 12 and (city eq 'city1' or city eq 'city3')",
+            "age gt 3 and age ge 5 and age lt 9 and not (age eq 6 or age eq 7)",
+            "age gt 10 and age lt 5 or city eq 'city0'",
+            "not (age gt 10 and age lt 5) and age lt 3",
+        ]
+        for filter_text in filters:
+            plain = django_params({"$filter": filter_text}, cache=None)
+            optimized = django_params({"$filter": filter_text}, cache=None, processor=FilterProcessor(optimize=True))
+            self.assertEqual(
+                list(Customer.objects.filter(optimized["filter"]).order_by('pk')),
+                list(Customer.objects.filter(plain["filter"]).order_by('pk')),
+                msg=filter_text
+            )
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from django.db import models
+from OdataTest.odata_param_parser import apply_params, django_params, ODataException
+from OdataTest.odata_pagination import KeysetPagination, decode_skiptoken, encode_skiptoken
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class KeysetPaginationTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(25):
+            Customer.objects.create(name='c{:02}'.format(i), city='city{}'.format(i % 3), age=20 + i % 5, created=created)
+
+    def walk_pages(self, pagination, param_dict):
+        rows = []
+        pages = 0
+        while True:
+            page = pagination.paginate(Customer.objects.all(), param_dict)
+            rows.extend(page.rows)
+            pages += 1
+            if page.skiptoken is None:
+                return rows, pages
+            param_dict = dict(param_dict, **{'$skiptoken': page.skiptoken})
+
+    def test_seek_params(self):
+        pagination = KeysetPagination(max_page_size=10)
+        self.assertEqual(
+            django_params({"$orderby": "age desc", "$top": "50"}, pagination=pagination),
+            {"order_by": ["-age", "pk"], "__getitem__": slice(None, 11)}
+        )
+        ordering = pagination.ordering(["-age"])
+        self.assertEqual(
+            pagination.seek_predicate(ordering, [21, 7]),
+            models.Q(age__lt=21) | (models.Q(pk__gt=7) & models.Q(age=21))
+        )
+
+    def test_pages_cover_ordering(self):
+        pagination = KeysetPagination(max_page_size=4)
+        param_dict = {"$orderby": "city desc,age", "$select": "name"}
+        rows, pages = self.walk_pages(pagination, param_dict)
+        # the sort keys read for the $skiptoken stay out of the selected rows
+        expected = list(Customer.objects.order_by('-city', 'age', 'pk').values('name'))
+        self.assertEqual(rows, expected)
+        self.assertEqual(pages, 7)
+
+    def test_top_spans_pages(self):
+        pagination = KeysetPagination(max_page_size=4)
+        rows, pages = self.walk_pages(pagination, {"$top": "10", "$filter": "age ge 21"})
+        expected = list(Customer.objects.filter(age__gte=21).order_by('pk')[:10])
+        self.assertEqual(rows, expected)
+        self.assertEqual(pages, 3)
+
+    def test_skiptoken(self):
+        pagination = KeysetPagination(max_page_size=5)
+        page = pagination.paginate(Customer.objects.all(), {"$orderby": "name"})
+        self.assertEqual(decode_skiptoken(page.skiptoken), {'o': ['name', 'pk'], 'v': ['c04', page.rows[-1].pk], 't': None})
+        with self.assertRaises(ODataException):
+            pagination.paginate(Customer.objects.all(), {"$orderby": "age", "$skiptoken": page.skiptoken})
+        with self.assertRaises(ODataException):
+            pagination.paginate(Customer.objects.all(), {"$skiptoken": "not a token"})
+        with self.assertRaises(ODataException):
+            decode_skiptoken("WzFd")
+        with self.assertRaises(ODataException):
+            pagination.paginate(Customer.objects.all(), {"$skip": "5"})
+        for tampered in ({'t': 'x'}, {'t': -5}, {'t': True}, {'v': [[1], 2]}, {'v': [{}, 2]}, {'v': [None, 2]},
+                         {'v': 'ab'}):
+            token = encode_skiptoken(dict({'o': ['name', 'pk'], 'v': ['c04', 5], 't': None}, **tampered))
+            with self.assertRaises(ODataException):
+                pagination.paginate(Customer.objects.all(), {"$orderby": "name", "$skiptoken": token})
+
+    def test_computed_filter(self):
+        params = django_params({"$filter": "age div 2 eq 11", "$orderby": "name"})
+        rows = list(apply_params(Customer.objects.all(), params))
+        self.assertEqual([c.name for c in rows], list(Customer.objects.filter(age__in=[22, 23]).order_by('name')
+                                                      .values_list('name', flat=True)))
+        self.assertFalse(hasattr(rows[0], 'annotated_value'))
+        page = KeysetPagination(max_page_size=4).paginate(Customer.objects.all(), {"$filter": "age div 2 eq 11"})
+        self.assertEqual(len(page.rows), 4)
+        self.assertEqual(list(apply_params(Customer.objects.all(), django_params({"$filter": "rating div 0 eq 1"}))), [])
@@ -1,8 +1,8 @@
 from django.test import TestCase
 from django.db import models
-from django.db.models import functions
+from django.db.models import functions, lookups
 from urllib.parse import quote, parse_qs
-from OdataTest.odata_param_parser import django_params
+from OdataTest.odata_param_parser import django_params, RelatedExists
 
 
 FILTER_TESTS = [
@@ -342,6 +342,85 @@ FILTER_TESTS = [
             "annotate": {"annotated_value": models.F("Rating") % 5}
         }
     ),
+    (
+        {"$filter": "indexof(CompanyName, 'lfreds') eq 1"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value=1),
+            "annotate": {"annotated_value": functions.StrIndex(models.F("CompanyName"), models.Value("lfreds")) - 1}
+        }
+    ),
+    (
+        {"$filter": "substring(CompanyName, 1, 2) eq 'lf'"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value='lf'),
+            "annotate": {
+                "annotated_value": functions.Substr(models.F("CompanyName"), models.Value(1) + 1, models.Value(2))
+            }
+        }
+    ),
+    (
+        {"$filter": "replace(tolower(CompanyName), ' ', '-') eq 'alfreds-futterkiste'"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value='alfreds-futterkiste'),
+            "annotate": {
+                "annotated_value": functions.Replace(
+                    functions.Lower(models.F("CompanyName")), models.Value(" "), models.Value("-")
+                )
+            }
+        }
+    ),
+    (
+        {"$filter": "contains(substring(CompanyName, 1), 'lfred')"},
+        {"filter": models.Q(lookups.Contains(
+            functions.Substr(models.F("CompanyName"), models.Value(1) + 1), models.Value("lfred")))}
+    ),
+    (
+        {"$filter": "sqrt(Rating) eq 2"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value=2),
+            "annotate": {"annotated_value": functions.Sqrt(models.F("Rating"))}
+        }
+    ),
+    (
+        {"$filter": "power(Rating, 2) gt 4"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value__gt=4),
+            "annotate": {"annotated_value": functions.Power(models.F("Rating"), models.Value(2))}
+        }
+    ),
+    (
+        {"$filter": "mod(Rating, 5) eq 0"},
+        {
+            'defer': 'annotated_value',
+            "filter": models.Q(annotated_value=0),
+            "annotate": {"annotated_value": functions.Mod(models.F("Rating"), models.Value(5))}
+        }
+    ),
+    (
+        {"$filter": "Orders/any(o: o/Amount gt 100)"},
+        {"filter": models.Q(RelatedExists("Orders", models.Q(Amount__gt=100)))}
+    ),
+    (
+        {"$filter": "Name eq 'John' and not Orders/any()"},
+        {"filter": models.Q(Name='John') & ~models.Q(RelatedExists("Orders"))}
+    ),
+    (
+        {"$filter": "Tags/all(t: t/Active eq true or length(t/Name) gt 3)"},
+        {"filter": models.Q(RelatedExists("Tags", models.Q(Active=True) | models.Q(Name__length__gt=3), all=True))}
+    ),
+    (
+        {"$filter": "Customer/Orders/any(o: o/Lines/any(l: l/Price mul 2 gt 10))"},
+        {
+            "filter": models.Q(RelatedExists("Customer__Orders", models.Q(RelatedExists(
+                "Lines", models.Q(lookups.GreaterThan(models.F("Price") * 2, models.Value(10)))
+            ))))
+        }
+    ),
 ]
 ORDER_TESTS = [
     (
@@ -400,8 +479,3 @@ class OdataTest(TestCase):
             result = django_params(t[0])
             self.assertEqual(result, t[1], msg=t[0])
 
-
-# indexof   # TODO need to implement this function
-# replace   # TODO need to implement this function
-# substring # TODO need to implement this function
-# mod, sqrt, power
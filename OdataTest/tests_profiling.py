@@ -0,0 +1,89 @@
+import json
+import os
+import pstats
+import tempfile
+from datetime import datetime, timezone
+from OdataTest.odata_param_parser import django_params, FilterProcessor
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_profiling import Instrumentation, PhaseTimer, SlowRequestProfiler, evaluate
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class EventLog(Instrumentation):
+    def __init__(self):
+        self.events = []
+
+    def start(self, phase, info):
+        self.events.append(('start', phase))
+
+    def stop(self, phase, info, elapsed):
+        self.events.append(('stop', phase, dict(info)))
+
+
+class ProfilingTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(5):
+            Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created)
+
+    def test_phases(self):
+        log = EventLog()
+        processor = FilterProcessor(instrumentation=log)
+        cache = FilterCache()
+        params = django_params({"$filter": "age gt 21 and name ne 'c4'"}, cache=cache, processor=processor)
+        rows = evaluate(Customer.objects.all(), params, log)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([e[:2] for e in log.events], [
+            ('start', 'filter'), ('start', 'parse'), ('stop', 'parse'), ('start', 'translate'), ('stop', 'translate'),
+            ('stop', 'filter'), ('start', 'apply'), ('stop', 'apply'), ('start', 'execute'), ('start', 'compile'),
+            ('stop', 'compile'), ('start', 'database'), ('stop', 'database'), ('stop', 'execute'),
+        ])
+        stops = {e[1]: e[2] for e in log.events if e[0] == 'stop'}
+        self.assertEqual(stops['filter']['shape'], "age gt 0 and name ne '?'")
+        self.assertGreater(stops['parse']['nodes'], 10)
+        self.assertIn('"age" >', stops['database']['sql'])
+        self.assertEqual(stops['execute']['rows'], 2)
+
+        log.events = []
+        django_params({"$filter": "age gt 1 and name ne 'x'"}, cache=cache, processor=processor)
+        self.assertEqual([e[:2] for e in log.events], [('start', 'filter'), ('stop', 'filter')])
+
+        # without the cache, the shape is only lifted for the instrumentations asking for it
+        log.events = []
+        django_params({"$filter": "age gt 1"}, cache=None, processor=processor)
+        info = log.events[-1][2]
+        self.assertNotIn('shape', info)
+        self.assertEqual(log.filter_shape(info), "age gt 0")
+
+    def test_phase_timer(self):
+        timer = PhaseTimer()
+        params = django_params({"$filter": "age gt 21"}, cache=None, processor=FilterProcessor(instrumentation=timer))
+        evaluate(Customer.objects.all(), params, timer)
+        timings = timer.timings()
+        self.assertEqual(set(timings), {'filter', 'parse', 'translate', 'apply', 'execute', 'compile', 'database'})
+        self.assertTrue(all(t['count'] == 1 and t['total'] >= 0 for t in timings.values()))
+
+    def test_slow_request_profiler(self):
+        draws = iter([0.0, 0.9, 0.0, 0.0])
+        profiler = SlowRequestProfiler(keep=2, sample_rate=0.5, random=lambda: next(draws))
+        processor = FilterProcessor(instrumentation=profiler)
+        for i in range(4):
+            with profiler.request('request {}'.format(i)) as record:
+                params = django_params({"$filter": "age gt {}".format(i)}, processor=processor)
+                evaluate(Customer.objects.all(), params, profiler)
+            self.assertEqual(record is None, i == 1)
+        slowest = profiler.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0][0]['elapsed'], slowest[1][0]['elapsed'])
+        with tempfile.TemporaryDirectory() as directory:
+            paths = profiler.dump(directory)
+            self.assertEqual(len(paths), 2)
+            pstats.Stats(paths[0])
+            with open(os.path.splitext(paths[0])[0] + '.json') as f:
+                record = json.load(f)
+            self.assertIn('database', [p['phase'] for p in record['phases']])
+        profiler.random = lambda: 0.0
+        with profiler.request() as record:
+            django_params({"$filter": "age gt 7"}, cache=None, processor=processor)
+        self.assertEqual(record['phases'][-1]['shape'], "age gt 0")
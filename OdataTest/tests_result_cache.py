@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timezone
+from django.core.cache import cache
+from django.test import RequestFactory
+from OdataTest.odata_pagination import KeysetPagination
+from OdataTest.odata_result_cache import ResultCache, canonical_params, joined_models, queryset_scope, related_models
+from OdataTest.tests_support import ModelTestCase, Customer, Country, Order, Tag
+
+
+class ResultCacheTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='x')
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(4):
+            Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created, country=country)
+
+    def setUp(self):
+        cache.clear()
+        self.results = ResultCache()
+        self.results.connect()
+        self.addCleanup(self.results.disconnect)
+
+    def test_canonical_params(self):
+        self.assertEqual(
+            canonical_params({"$filter": " age  gt 3 and name eq 'a  b' ", "$orderby": "age asc, name desc",
+                              "$select": "name , age", "$count": "True", "other": "1"}),
+            {"$filter": "age gt 3 and name eq 'a  b'", "$orderby": "age,name desc", "$select": "name,age",
+             "$count": "true"})
+        self.assertEqual(related_models(Customer, {"$filter": "country/name eq 'tags/x'", "$expand": "orders"}),
+                         {Country, Order})
+        self.assertEqual(related_models(Country, {"$filter": "customers/any(c: c/tags/any(t: t/name eq 'x'))"}),
+                         {Customer, Tag})
+
+    def test_page_cached_until_change(self):
+        # the test models live outside the app registry and can't be pickled, so the rows are values
+        param_dict = {"$filter": "age gt 20", "$orderby": "age", "$select": "id,age", "$count": "true"}
+        with self.assertNumQueries(1):
+            etag, page = self.results.page(Customer.objects.all(), param_dict)
+        with self.assertNumQueries(0):
+            same_etag, cached = self.results.page(Customer.objects.all(), {**param_dict, "$filter": "age  gt 20"})
+        self.assertEqual((same_etag, cached.rows, cached.count), (etag, page.rows, 3))
+        Customer.objects.filter(age=23).get().delete()
+        with self.assertNumQueries(1):
+            new_etag, page = self.results.page(Customer.objects.all(), param_dict)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(page.count, 2)
+
+    def test_scoped_querysets(self):
+        param_dict = {"$select": "name", "$orderby": "name"}
+        etag, page = self.results.page(Customer.objects.filter(age__lt=22), param_dict)
+        other_etag, other = self.results.page(Customer.objects.filter(age__gte=22), param_dict)
+        self.assertNotEqual(etag, other_etag)
+        self.assertEqual([r["name"] for r in page.rows], ['c0', 'c1'])
+        self.assertEqual([r["name"] for r in other.rows], ['c2', 'c3'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.results.page(Customer.objects.filter(age__lt=22), param_dict)[0], etag)
+        paged_etag, _ = self.results.page(Customer.objects.filter(age__lt=22), param_dict,
+                                          pagination=KeysetPagination(max_page_size=1))
+        self.assertNotEqual(paged_etag, etag)
+        self.assertEqual(queryset_scope(Customer.objects.none(), {})[1:3], [None, []])
+
+    def test_related_changes(self):
+        param_dict = {"$filter": "country/name eq 'x'"}
+        etag = self.results.etag(Customer, param_dict)
+        plain = self.results.etag(Customer, {})
+        Country.objects.get().save()
+        self.assertNotEqual(self.results.etag(Customer, param_dict), etag)
+        self.assertEqual(self.results.etag(Customer, {}), plain)
+        tag = Tag.objects.create(name='t')
+        plain = self.results.etag(Customer, {})
+        Customer.objects.first().tags.add(tag)
+        self.assertNotEqual(self.results.etag(Customer, {}), plain)
+
+    def test_joined_changes(self):
+        queryset = Customer.objects.filter(country__name='x')
+        self.assertEqual(joined_models(queryset), {Country})
+        self.assertEqual(joined_models(Country.objects.filter(customers__tags__active=True)),
+                         {Customer, Customer.tags.through, Tag})
+        param_dict = {"$select": "name", "$orderby": "name"}
+        etag, page = self.results.page(queryset, param_dict)
+        self.assertEqual(len(page.rows), 4)
+        Country.objects.update(name='y')
+        Country.objects.get().save()
+        new_etag, page = self.results.page(queryset, param_dict)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(page.rows, [])
+
+    def test_respond_not_modified(self):
+        factory = RequestFactory()
+        request = factory.get('/customers', {"$select": "name", "$filter": "age lt 22", "$count": "true"})
+        response = self.results.respond(request, Customer.objects.all())
+        self.assertEqual(json.loads(response.content), {"@odata.count": 2, "value": [{"name": "c0"}, {"name": "c1"}]})
+        etag = response['ETag']
+        request = factory.get('/customers', {"$select": "name", "$filter": "age lt 22", "$count": "true"},
+                              HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            response = self.results.respond(request, Customer.objects.all())
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+        Customer.objects.create(name='new', city='city', age=1, created=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        response = self.results.respond(request, Customer.objects.all())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["@odata.count"], 3)
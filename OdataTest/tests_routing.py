@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+from django.core.cache import cache
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from OdataTest.odata_count import ExactCount
+from OdataTest.odata_routing import ReplicaRouter
+from OdataTest.tests_support import ModelTestCase, Customer, MODELS
+
+
+REPLICAS = ['replica1', 'replica2']
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class RoutingTest(ModelTestCase):
+    # resolved when the class is set up, after the replicas are registered
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # each replica is a separate in-memory SQLite database, only known to this test case
+        for alias in REPLICAS:
+            connections.settings[alias] = dict(connections.settings['default'], NAME=':memory:')
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.remove_replicas()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls.remove_replicas()
+
+    @classmethod
+    def remove_replicas(cls):
+        for alias in REPLICAS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    @classmethod
+    def create_tables(cls):
+        super().create_tables()
+        for alias in REPLICAS:
+            with connections[alias].schema_editor() as editor:
+                for model in MODELS:
+                    editor.create_model(model)
+
+    @classmethod
+    def drop_tables(cls):
+        super().drop_tables()
+        for alias in REPLICAS:
+            with connections[alias].schema_editor() as editor:
+                for model in reversed(MODELS):
+                    editor.delete_model(model)
+
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        Customer.objects.create(name='primary', city='x', age=30, created=created)
+        for alias in REPLICAS:
+            for i in range(REPLICAS.index(alias) + 2):
+                Customer.objects.using(alias).create(name=alias, city='x', age=30 + i, created=created)
+
+    @staticmethod
+    def names(page):
+        return sorted({c.name for c in page.rows})
+
+    def test_round_robin(self):
+        router = ReplicaRouter(REPLICAS)
+        seen = [self.names(router.paginate(Customer.objects.all(), {"$filter": "city eq 'x'"})) for _ in range(4)]
+        self.assertEqual(seen, [['replica1'], ['replica2'], ['replica1'], ['replica2']])
+
+    def test_least_loaded(self):
+        router = ReplicaRouter(REPLICAS, strategy='least_loaded')
+        with router.read() as first:
+            self.assertEqual(router.load[first], 1)
+            with router.read() as second:
+                self.assertNotEqual(first, second)
+                with router.read() as third:
+                    self.assertIn(third, REPLICAS)
+        self.assertEqual(router.load, {'replica1': 0, 'replica2': 0})
+        self.assertEqual(router.choose(), 'replica2')
+        self.assertRaises(ValueError, ReplicaRouter, REPLICAS, strategy='random')
+
+    def test_count_on_replica(self):
+        router = ReplicaRouter(REPLICAS[1:])
+        param_dict = {"$filter": "age ge 30", "$top": "1", "$count": "true"}
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica2']) as replica:
+            page = router.paginate(Customer.objects.all(), param_dict, strategy=ExactCount())
+        self.assertEqual((self.names(page), page.count), (['replica2'], 3))
+        self.assertEqual((len(primary), len(replica)), (0, 2))
+
+    def test_pinned_after_write(self):
+        clock = Clock()
+        router = ReplicaRouter(REPLICAS, staleness=2, clock=clock)
+        router.wrote('a')
+        self.assertEqual(router.choose('a'), 'default')
+        self.assertIn(router.choose('b'), REPLICAS)
+        self.assertIn(router.choose(), REPLICAS)
+        page = router.paginate(Customer.objects.all(), {"$count": "true"}, client='a')
+        self.assertEqual((self.names(page), page.count), (['primary'], 1))
+        clock.now += 2
+        self.assertIn(router.choose('a'), REPLICAS)
+        router.wrote()
+        self.assertEqual(router.choose('b'), 'default')
+        self.assertEqual(ReplicaRouter([]).choose(), 'default')
+
+    def test_signals_pin(self):
+        router = ReplicaRouter(REPLICAS, clock=Clock())
+        router.connect()
+        self.addCleanup(router.disconnect)
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        Customer.objects.using('replica1').create(name='r', city='y', age=1, created=created)
+        self.assertFalse(router.pinned('a'))
+        with router.writing('a'):
+            Customer.objects.create(name='p', city='y', age=1, created=created)
+        self.assertTrue(router.pinned('a'))
+        self.assertFalse(router.pinned('b'))
+        # a write outside `writing`, like a session save, pins nobody by default
+        Customer.objects.filter(name='p').delete()
+        self.assertFalse(router.pinned('b'))
+        router.pin_unscoped = True
+        Customer.objects.create(name='q', city='y', age=1, created=created)
+        self.assertTrue(router.pinned('b'))
+
+    def test_shared_pins(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        clock = Clock()
+        # two routers sharing a cache stand for two worker processes
+        workers = [ReplicaRouter(REPLICAS, staleness=2, clock=clock, cache_alias='default') for _ in range(2)]
+        workers[0].wrote('a')
+        self.assertEqual(workers[1].choose('a'), 'default')
+        self.assertIn(workers[1].choose('b'), REPLICAS)
+        workers[1].wrote()
+        self.assertEqual(workers[0].choose('b'), 'default')
+        clock.now += 2
+        self.assertIn(workers[0].choose('a'), REPLICAS)
+        self.assertFalse(ReplicaRouter(REPLICAS, clock=clock).pinned('a'))
+
+    def test_database_router(self):
+        router = ReplicaRouter(REPLICAS)
+        with override_settings(DATABASE_ROUTERS=[router]):
+            with router.read() as alias:
+                self.assertEqual({c.name for c in Customer.objects.all()}, {alias})
+            self.assertEqual([c.name for c in Customer.objects.all()], ['primary'])
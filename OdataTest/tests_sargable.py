@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from django.db.models import Q
+from django.test import override_settings
+from OdataTest.odata_param_parser import django_params, FilterProcessor
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_optimizer import sargable_q, FALSE
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+UTC = timezone.utc
+
+SARGABLE_TESTS = [
+    (
+        "year(created) eq 1990",
+        Q(created__gte=datetime(1990, 1, 1, tzinfo=UTC), created__lt=datetime(1991, 1, 1, tzinfo=UTC))
+    ),
+    (
+        "year(created) eq 1990 and month(created) eq 12 and name eq 'a'",
+        Q(created__gte=datetime(1990, 12, 1, tzinfo=UTC)) & Q(created__lt=datetime(1991, 1, 1, tzinfo=UTC))
+        & Q(name='a')
+    ),
+    (
+        "year(created) eq 1990 and month(created) eq 2 and day(created) eq 28 and hour(created) eq 23",
+        Q(created__gte=datetime(1990, 2, 28, 23, tzinfo=UTC)) & Q(created__lt=datetime(1990, 3, 1, tzinfo=UTC))
+    ),
+    (
+        "year(created) gt 1990",
+        Q(created__gte=datetime(1991, 1, 1, tzinfo=UTC))
+    ),
+    (
+        "year(created) le 1990 or name eq 'a'",
+        Q(created__lt=datetime(1991, 1, 1, tzinfo=UTC)) | Q(name='a')
+    ),
+    (
+        "year(created) ne 1990",
+        ~Q(created__gte=datetime(1990, 1, 1, tzinfo=UTC), created__lt=datetime(1991, 1, 1, tzinfo=UTC))
+    ),
+    (
+        "car/year eq 1990 and car/month eq 5",
+        Q(car__year=1990) & Q(car__month=5)
+    ),
+    (
+        "year(created) eq 1990 and created/year eq 1991",
+        Q(created__gte=datetime(1990, 1, 1, tzinfo=UTC)) & Q(created__lt=datetime(1991, 1, 1, tzinfo=UTC))
+        & Q(created__year=1991)
+    ),
+    (
+        "month(created) eq 5",
+        Q(created__month=5)
+    ),
+    (
+        "year(created) eq 1990 and month(created) eq 13",
+        FALSE
+    ),
+    (
+        "year(created) eq 1990 and year(created) eq 1991",
+        FALSE
+    ),
+    (
+        "year(created) eq 1990 and month(created) ge 5",
+        Q(created__gte=datetime(1990, 1, 1, tzinfo=UTC)) & Q(created__lt=datetime(1991, 1, 1, tzinfo=UTC))
+        & Q(created__month__gte=5)
+    ),
+    (
+        "created gt datetime'2020-01-01T10:00:00'",
+        Q(created__gt=datetime(2020, 1, 1, 10, tzinfo=UTC))
+    ),
+]
+
+
+@override_settings(TIME_ZONE='UTC')
+class SargableTest(ModelTestCase):
+    def test_rewrites(self):
+        processor = FilterProcessor(sargable=True)
+        for filter_text, expected in SARGABLE_TESTS:
+            for cache in (None, FilterCache()):
+                result = django_params({"$filter": filter_text}, cache=cache, processor=processor)
+                self.assertEqual(result["filter"], expected, msg=filter_text)
+
+    def test_plain_unchanged(self):
+        self.assertEqual(sargable_q(Q(name='a') | Q(age__gt=3)), Q(name='a') | Q(age__gt=3))
+        result = django_params({"$filter": "created gt datetime'2020-01-01T10:00:00'"}, cache=None)
+        self.assertIsInstance(result["filter"].children[0][1], float)
+
+    def test_same_rows(self):
+        for i, created in enumerate([datetime(1989, 12, 31, 23, 30), datetime(1990, 1, 1), datetime(1990, 5, 20, 8),
+                                     datetime(1990, 5, 31, 23, 59), datetime(1990, 6, 1), datetime(1991, 3, 3)]):
+            Customer.objects.create(name='c{}'.format(i), city='city', age=i, created=created.replace(tzinfo=UTC))
+        filters = [
+            "year(created) eq 1990",
+            "year(created) eq 1990 and month(created) eq 5",
+            "year(created) eq 1990 and month(created) eq 5 and day(created) eq 20 and hour(created) eq 8",
+            "year(created) gt 1989 and age lt 5",
+            "year(created) le 1990",
+            "not (year(created) eq 1990 and month(created) eq 5)",
+        ]
+        # equalities mixed with ranges or other equalities on the same parts
+        mixed = [
+            "year(created) eq 1990 and year(created) ge 1991",
+            "year(created) eq 1989 and year(created) eq 1990",
+            "year(created) eq 1990 and year(created) eq 1990",
+            "year(created) eq 1990 and month(created) eq 5 and month(created) lt 3",
+            "year(created) eq 1990 and month(created) ge 5 and day(created) eq 1",
+            "year(created) lt 1991 and month(created) eq 5 and year(created) eq 1990",
+            "not (month(created) eq 5 and month(created) eq 6) and year(created) eq 1990",
+        ]
+        for filter_text in filters + mixed:
+            plain = django_params({"$filter": filter_text}, cache=None)
+            sargable = django_params({"$filter": filter_text}, cache=None, processor=FilterProcessor(sargable=True))
+            queryset = Customer.objects.filter(sargable["filter"])
+            if filter_text in filters:
+                self.assertNotIn('django_datetime_extract', str(queryset.query), msg=filter_text)
+            self.assertEqual(
+                list(queryset.order_by('pk')),
+                list(Customer.objects.filter(plain["filter"]).order_by('pk')),
+                msg=filter_text
+            )
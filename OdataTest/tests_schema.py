@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from django.db import models
+from OdataTest.odata_param_parser import django_params, apply_params, ODataException
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_schema import ModelFilterProcessor, schema_for
+from OdataTest.tests_support import ModelTestCase, Customer, Order, Country
+
+
+class SchemaTest(ModelTestCase):
+    def params(self, model, param_dict, cache=None):
+        return django_params(param_dict, cache=cache, processor=ModelFilterProcessor(model), model=model)
+
+    def test_schema_index(self):
+        schema = schema_for(Order)
+        self.assertIs(schema_for(Order), schema)
+        self.assertIs(schema.paths['customer__country__name'], Country._meta.get_field('name'))
+        self.assertIs(schema.paths['customer_id'], Order._meta.get_field('customer'))
+        self.assertIs(schema.field('customer__orders__customer__country__name'), Country._meta.get_field('name'))
+        self.assertEqual(schema.target('customer__created__year'), (Customer._meta.get_field('created'), 'year'))
+
+    def test_literal_coercion(self):
+        for cache in (None, FilterCache()):
+            self.assertEqual(self.params(Order, {"$filter": "amount lt '20' and customer/age ge '18'"}, cache), {
+                "filter": models.Q(amount__lt=Decimal('20')) & models.Q(customer__age__gte=18)
+            })
+            self.assertEqual(self.params(Customer, {"$filter": "year(created) eq '2020' and tolower(name) eq 5"}, cache), {
+                "filter": models.Q(created__year=2020) & models.Q(name__lower='5')
+            })
+            self.assertEqual(self.params(Customer, {"$filter": "created gt datetime'2020-01-01T10:00:00'"}, cache), {
+                "filter": models.Q(created__gt=datetime(2020, 1, 1, 10, tzinfo=timezone.utc))
+            })
+            self.assertEqual(self.params(Customer, {"$filter": "contains(name, 5) and rating eq null"}, cache), {
+                "filter": models.Q(name__contains='5') & models.Q(rating__isnull=True)
+            })
+            self.assertEqual(self.params(Customer, {"$filter": "created gt '2020-01-01' and tolower(trim(name)) eq 5"},
+                                         cache), {
+                "filter": models.Q(created__gt=datetime(2020, 1, 1, tzinfo=timezone.utc)) & models.Q(name__trim__lower='5')
+            })
+            # literals compared with computed values get the type of the computed value
+            for filter_text, value in (("age add 1 eq '3'", 3), ("indexof(name, 'a') eq '1'", 1),
+                                       ("rating mul 2 eq 3", 3.0)):
+                params = self.params(Customer, {"$filter": filter_text}, cache)
+                self.assertEqual(params["filter"], models.Q(annotated_value=value), msg=filter_text)
+                self.assertIs(type(params["filter"].children[0][1]), type(value), msg=filter_text)
+            params = self.params(Customer, {"$filter": "concat(name, 1) eq 'c01'"}, cache)
+            self.assertEqual(params["annotate"]["annotated_value"].source_expressions[0].source_expressions[1],
+                             models.Value('1'))
+
+    def test_invalid_requests(self):
+        invalid = [
+            (Customer, {"$filter": "unknown eq 1"}),
+            (Customer, {"$filter": "country/unknown eq 'x'"}),
+            (Customer, {"$filter": "age eq 'old'"}),
+            (Customer, {"$filter": "year(name) eq 2000"}),
+            (Customer, {"$filter": "contains(age, 'x')"}),
+            (Customer, {"$filter": "name add 1 eq 2"}),
+            (Customer, {"$filter": "sqrt(name) eq 2"}),
+            (Customer, {"$filter": "substring(name, 'x') eq 'y'"}),
+            (Customer, {"$filter": "rating eq true"}),
+            (Customer, {"$filter": "age add 1 eq 1.5"}),
+            (Customer, {"$filter": "rating mul 2 eq 'x'"}),
+            (Customer, {"$filter": "unknown(age) eq 2"}),
+            (Customer, {"$orderby": "unknown desc"}),
+            (Customer, {"$select": "name,unknown"}),
+            (Customer, {"$expand": "orders($filter=amount eq 'x')"}),
+        ]
+        for cache in (None, FilterCache()):
+            for model, param_dict in invalid:
+                with self.assertRaises(ODataException, msg=param_dict):
+                    self.params(model, param_dict, cache)
+        cache = FilterCache()
+        self.params(Customer, {"$filter": "age eq 10"}, cache)
+        with self.assertRaises(ODataException):
+            self.params(Customer, {"$filter": "age eq 1.5"}, cache)
+
+    def test_same_rows(self):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(4):
+            customer = Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created)
+            Order.objects.create(customer=customer, amount=Decimal(i * 10))
+        params = self.params(Order, {"$filter": "amount ge '10' and customer/age lt '23'", "$orderby": "amount"})
+        self.assertEqual([o.amount for o in apply_params(Order.objects.all(), params)], [10, 20])
+        params = self.params(Customer, {"$expand": "orders($filter=amount gt '15')", "$filter": "age gt 20"})
+        rows = apply_params(Customer.objects.order_by('pk'), params)
+        self.assertEqual([[o.amount for o in c.orders.all()] for c in rows], [[], [20], [30]])
+        params = self.params(Customer, {"$filter": "age add 1 eq '22' or created lt '2020-01-01T00:00:01'",
+                                        "$orderby": "name"})
+        self.assertEqual([c.name for c in apply_params(Customer.objects.all(), params)], ['c0', 'c1', 'c2', 'c3'])
+        params = self.params(Customer, {"$filter": "indexof(name, '1') eq '1' and age lt '30'"})
+        self.assertEqual([c.name for c in apply_params(Customer.objects.all(), params)], ['c1'])
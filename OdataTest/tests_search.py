@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import models
+from OdataTest.odata_param_parser import apply_params, django_params, ODataException
+from OdataTest.odata_search import ContainsSearch, PostgresSearch, SQLiteFTS5Search, parse_search
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+NAMES = ['red apple', 'green apple', 'red cherry', 'blue berry pie', 'apple pie', 'red apple pie']
+
+
+class SearchTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fts = SQLiteFTS5Search(Customer, ['name', 'city'])
+        cls.fts.install()
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i, name in enumerate(NAMES):
+            Customer.objects.create(name=name, city='paris' if i % 2 else 'oslo', age=20 + i, created=created)
+
+    def names(self, param_dict, search):
+        return [c.name for c in apply_params(Customer.objects.all(), django_params(param_dict, search=search))]
+
+    def test_parse(self):
+        self.assertEqual(parse_search('red  apple OR "apple pie"'),
+                         ('or', ('and', ('word', 'red'), ('word', 'apple')), ('phrase', 'apple pie')))
+        self.assertEqual(parse_search('NOT (red OR blue) AND pie'),
+                         ('and', ('not', ('or', ('word', 'red'), ('word', 'blue'))), ('word', 'pie')))
+        for invalid in ('', 'red AND', '(red', 'red)', '""', 'OR red'):
+            with self.assertRaises(ODataException, msg=invalid):
+                parse_search(invalid)
+
+    def test_fts5_matches_like_scan(self):
+        searches = {
+            'apple': ['red apple', 'green apple', 'apple pie', 'red apple pie'],
+            'red apple': ['red apple', 'red apple pie'],
+            '"apple pie"': ['apple pie', 'red apple pie'],
+            'cherry OR berry': ['red cherry', 'blue berry pie'],
+            'pie AND NOT red': ['blue berry pie', 'apple pie'],
+            'NOT apple': ['red cherry', 'blue berry pie'],
+            'NOT (red OR pie) OR cherry': ['green apple', 'red cherry'],
+            'paris AND apple': ['green apple', 'red apple pie'],
+        }
+        for search_text, expected in searches.items():
+            param_dict = {"$search": search_text, "$orderby": "id"}
+            self.assertEqual(self.names(param_dict, self.fts), expected, msg=search_text)
+            self.assertEqual(self.names(param_dict, ContainsSearch(['name', 'city'])), expected, msg=search_text)
+        self.assertEqual(self.names({"$search": "apple", "$filter": "age gt 23", "$orderby": "id"}, self.fts),
+                         ['apple pie', 'red apple pie'])
+
+    def test_fts5_rank_and_sync(self):
+        ranked = self.names({"$search": "apple OR red"}, SQLiteFTS5Search(Customer, ['name', 'city'], rank=True))
+        self.assertEqual(set(ranked[:2]), {'red apple', 'red apple pie'})
+        self.assertEqual(len(ranked), 5)
+        Customer.objects.filter(name='red cherry').update(name='red banana')
+        Customer.objects.filter(name='green apple').delete()
+        self.assertEqual(self.names({"$search": "banana OR green", "$orderby": "id"}, self.fts), ['red banana'])
+        with self.assertRaises(ODataException):
+            self.names({"$search": "apple"}, None)
+
+    def test_postgres_query(self):
+        # SearchRank imports psycopg, so only the match is built here
+        params = PostgresSearch(['name', 'city']).params('red "apple pie" OR NOT cherry')
+        query = (SearchQuery('red', config='english') & SearchQuery('apple pie', config='english', search_type='phrase')
+                 | ~SearchQuery('cherry', config='english'))
+        self.assertEqual(params["filter"], models.Q(odata_search=query))
+        self.assertEqual(params["annotate"]["odata_search"], SearchVector('name', 'city', config='english'))
+        self.assertNotIn("order_by", params)
+        # the vector is an alias for the match, not a selected column
+        queryset = apply_params(Customer.objects.all(), django_params({"$search": "red", "$filter": "age add 1 gt 2"},
+                                                                      search=PostgresSearch(['name', 'city'])))
+        self.assertIn("odata_search", queryset.query.annotations)
+        self.assertEqual(list(queryset.query.annotation_select), [])
+        params = PostgresSearch(vector_field='search').params('red')
+        self.assertEqual(params["annotate"]["odata_search"], models.F('search'))
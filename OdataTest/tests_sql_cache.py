@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from OdataTest.odata_param_parser import apply_params, django_params, FilterProcessor, ODataException
+from OdataTest.odata_schema import ModelFilterProcessor
+from OdataTest.odata_sql_cache import SQLTemplateCache
+from OdataTest.tests_support import ModelTestCase, Customer, Order
+
+
+class SQLTemplateCacheTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(8):
+            customer = Customer.objects.create(name='c_{}'.format(i), city='city{}'.format(i % 3), age=20 + i,
+                                               rating=None if i % 4 == 0 else i / 2,
+                                               created=datetime(2020, 1, 1 + i, 12, tzinfo=timezone.utc))
+            Order.objects.create(customer=customer, amount=Decimal(i * 10) / 4, active=i % 3 != 0)
+
+    def assertSameRows(self, templates, param_dict, processor):
+        expected = list(apply_params(templates.queryset, django_params(param_dict, processor=processor)))
+        rows = templates.rows(param_dict)
+        if rows and not isinstance(rows[0], dict):
+            rows = [{f.attname: getattr(r, f.attname) for f in r._meta.concrete_fields} for r in rows]
+            expected = [{f.attname: getattr(r, f.attname) for f in r._meta.concrete_fields} for r in expected]
+        self.assertEqual(rows, expected, msg=param_dict)
+
+    def test_same_rows_as_orm(self):
+        requests = [
+            (Customer, "age gt {} and city ne 'city{}'", [(21, 0), (22, 1), (24, 2), (20, 0)]),
+            (Customer, "contains(name, '{}') or startswith(city, '{}')", [('_1', 'city2'), ('c', 'x'), ('_', 'q')]),
+            (Customer, "created ge datetime'2020-01-0{}T00:00:00' and rating lt {}", [(2, 3), (4, 2.5), (1, 9), (3, 4)]),
+            (Customer, "age ge {} and age le {}", [(22, 22), (21, 25), (23, 26), (20, 20)]),
+            (Order, "amount lt {} and customer/age ne {}", [(10, 21), (7.5, 20), (15, 23), (12, 22), (2.5, 27)]),
+            # the 1 or 0 compared with a boolean column goes into the SQL text, not into a parameter
+            (Order, "active eq {} and amount gt {}", [(1, 0), (1, 2.5), (1, 5), (0, 0), (0, 5), (1, 7.5)]),
+        ]
+        for processor_class in (FilterProcessor, ModelFilterProcessor):
+            for model, filter_format, values in requests:
+                processor = processor_class(model) if processor_class is ModelFilterProcessor else processor_class()
+                if 'datetime' in filter_format and processor_class is FilterProcessor:
+                    continue
+                templates = SQLTemplateCache(model.objects.all(), processor=processor, cache=None)
+                for select in (None, 'id,pk' if model is Order else 'name,age,created,rating'):
+                    for args in values:
+                        param_dict = {"$filter": filter_format.format(*args), "$orderby": "id desc", "$top": 3,
+                                      "$skip": 1}
+                        if select:
+                            param_dict["$select"] = select
+                        self.assertSameRows(templates, param_dict, processor)
+                if 'active' in filter_format:
+                    self.assertEqual(templates.info().hits, 0)
+                else:
+                    self.assertGreater(templates.info().hits, 0, msg=filter_format)
+
+    def test_template_skips_compiler(self):
+        templates = SQLTemplateCache(Customer.objects.all(), processor=ModelFilterProcessor(Customer))
+        for age in (20, 21):
+            templates.rows({"$filter": "age gt '{}'".format(age), "$select": "name"})
+        self.assertEqual(templates.info().hits, 0)
+        with self.assertNumQueries(1):
+            rows = templates.rows({"$filter": "age gt '25'", "$select": "name"})
+        self.assertEqual(rows, [{"name": "c_6"}, {"name": "c_7"}])
+        self.assertEqual(templates.info().hits, 1)
+        self.assertEqual(templates.rows({"$filter": "age gt '25'", "$select": "name", "$top": 0}), [])
+        with self.assertRaises(ODataException):
+            templates.rows({"$filter": "age gt 'old'", "$select": "name"})
+        # a hit still coerces the literals like the ORM path does
+        for filter_text in ("age gt 1.5", "age eq 1.5"):
+            with self.assertRaises(ODataException):
+                templates.rows({"$filter": filter_text, "$select": "name"})
+
+    def test_fallbacks(self):
+        templates = SQLTemplateCache(Customer.objects.all(), processor=ModelFilterProcessor(Customer, sargable=True))
+        for year in (2019, 2020, 2021):
+            self.assertEqual(len(templates.rows({"$filter": "year(created) eq {}".format(year)})),
+                             8 if year == 2020 else 0)
+        self.assertEqual(templates.info().hits, 0)
+        rows = templates.rows({"$expand": "orders", "$filter": "age lt 21"})
+        self.assertEqual([[o.amount for o in c.orders.all()] for c in rows], [[0]])
+
+    def test_value_dependent_sql(self):
+        processor = FilterProcessor(optimize=True)
+        templates = SQLTemplateCache(Customer.objects.all(), processor=processor, cache=None)
+        for args in [(22, 25), (23, 26), (27, 21), (24, 20), (21, 21), (20, 25)]:
+            self.assertSameRows(templates, {"$filter": "age gt {} and age gt {}".format(*args), "$select": "age"},
+                                processor)
+        self.assertEqual(templates.info().hits, 0)
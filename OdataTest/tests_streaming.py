@@ -0,0 +1,33 @@
+import json
+from datetime import datetime, timezone
+from OdataTest.odata_param_parser import django_params, ODataException
+from OdataTest.odata_streaming import stream_json, iter_rows
+from OdataTest.tests_support import ModelTestCase, Customer
+
+
+class StreamingTest(ModelTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i in range(7):
+            Customer.objects.create(name='c{}'.format(i), city='city', age=20 + i, created=created)
+
+    def test_stream_json(self):
+        params = django_params({"$filter": "age gt 20", "$select": "name,age", "$orderby": "age", "$top": "5"})
+        chunks = list(stream_json(Customer.objects.all(), params, chunk_size=2, count=6, next_link='next'))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), {
+            "@odata.count": 6,
+            "value": [{"name": "c{}".format(i), "age": 20 + i} for i in range(1, 6)],
+            "@odata.nextLink": "next",
+        })
+
+    def test_stream_all_fields(self):
+        rows = list(iter_rows(Customer.objects.all(), django_params({"$top": "1"})))
+        self.assertEqual(rows[0]['created'], datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(sorted(rows[0]), ['age', 'city', 'country_id', 'created', 'id', 'name', 'rating'])
+        self.assertEqual(json.loads(b''.join(stream_json(Customer.objects.none(), {}))), {"value": []})
+
+    def test_expand_not_streamed(self):
+        with self.assertRaises(ODataException):
+            list(iter_rows(Customer.objects.all(), django_params({"$expand": "orders"}, model=Customer)))
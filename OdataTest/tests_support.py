@@ -0,0 +1,91 @@
+import os
+import sys
+from django.apps import AppConfig
+from django.apps.registry import Apps
+from django.db import connection, models
+from django.test import TestCase
+
+
+class ODataTestsConfig(AppConfig):
+    name = 'OdataTest'
+    label = 'odata_tests'
+    path = os.path.dirname(__file__)
+
+
+# the test models live in their own registry, so they get reverse relations without
+# the test settings having to install an app for them
+test_apps = Apps([ODataTestsConfig('OdataTest', sys.modules[__name__])])
+
+
+class Country(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'odata_tests'
+        apps = test_apps
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100)
+    active = models.BooleanField(default=True)
+
+    class Meta:
+        app_label = 'odata_tests'
+        apps = test_apps
+
+
+class Customer(models.Model):
+    name = models.CharField(max_length=100)
+    city = models.CharField(max_length=100, db_index=True)
+    age = models.IntegerField()
+    rating = models.FloatField(null=True)
+    created = models.DateTimeField()
+    country = models.ForeignKey(Country, null=True, on_delete=models.CASCADE, related_name='customers')
+    tags = models.ManyToManyField(Tag, related_name='customers')
+
+    class Meta:
+        app_label = 'odata_tests'
+        apps = test_apps
+
+
+class Order(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    active = models.BooleanField(default=True)
+
+    class Meta:
+        app_label = 'odata_tests'
+        apps = test_apps
+
+
+MODELS = [Country, Tag, Customer, Order]
+
+
+class ModelTestCase(TestCase):
+    """TestCase creating the tables of the test models, which live outside any installed app."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.create_tables()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.drop_tables()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.drop_tables()
+
+    @classmethod
+    def create_tables(cls):
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                editor.create_model(model)
+
+    @classmethod
+    def drop_tables(cls):
+        with connection.schema_editor() as editor:
+            for model in reversed(MODELS):
+                editor.delete_model(model)
@@ -0,0 +1,71 @@
+import json
+from django.db.models import functions
+from django.test import SimpleTestCase
+from OdataTest.odata_param_parser import django_params, FilterProcessor
+from OdataTest.odata_filter_cache import FilterCache
+from OdataTest.odata_usage import UsageRecorder, FieldUsage, advise, report
+from OdataTest.tests_support import Customer, Country
+
+
+class UsageTest(SimpleTestCase):
+    def run_queries(self, recorder, queries, cache=None):
+        processor = FilterProcessor(recorder=recorder)
+        for query in queries:
+            with recorder.request():
+                django_params(query, cache=cache, processor=processor)
+
+    def test_recorded_usage(self):
+        for cache in (None, FilterCache()):
+            recorder = UsageRecorder()
+            self.run_queries(recorder, [
+                {"$filter": "name eq 'a' and age gt 3", "$orderby": "created desc"},
+                {"$filter": "name eq 'b' and age gt 5"},
+                {"$filter": "tolower(name) eq 'a' or year(created) ge 2000 or contains(city, 'x')"},
+                {"$filter": "age add 1 gt 3 and country/name eq null"},
+                {"$filter": "orders/any(o: o/amount gt 3)"},
+            ], cache=cache)
+            counts = {s.usage: s.count for s in recorder.stats()}
+            self.assertEqual(counts, {
+                FieldUsage('filter', 'name', 'eq', None): 2,
+                FieldUsage('filter', 'age', 'gt', None): 2,
+                FieldUsage('order', 'created', 'desc', None): 1,
+                FieldUsage('filter', 'name', 'eq', 'lower'): 1,
+                FieldUsage('filter', 'created', 'ge', 'year'): 1,
+                FieldUsage('filter', 'city', 'contains', None): 1,
+                FieldUsage('filter', 'age', 'gt', 'add'): 1,
+                FieldUsage('filter', 'country__name', 'null', None): 1,
+                FieldUsage('filter', 'orders__amount', 'gt', None): 1,
+            })
+            self.assertTrue(all(s.timed == s.count and s.total_time > 0 for s in recorder.stats()))
+
+    def test_advise(self):
+        recorder = UsageRecorder(model=Customer)
+        self.run_queries(recorder, [
+            {"$filter": "name eq 'a' and age gt 3"},
+            {"$filter": "name eq 'a' and age gt 3"},
+            {"$filter": "city eq 'x'", "$orderby": "age"},
+            {"$filter": "tolower(name) eq 'a' and country/name eq 'x'"},
+            {"$filter": "contains(name, 'x') and country eq 1"},
+        ])
+        suggestions = {(s.model, s.kind, s.fields): s for s in advise(recorder)}
+        self.assertEqual(set(suggestions), {
+            (Customer, 'single', ('name',)),
+            (Customer, 'single', ('age',)),
+            (Customer, 'composite', ('name', 'age')),
+            (Customer, 'composite', ('city', 'age')),
+            (Customer, 'expression', ('lower(name)',)),
+            (Country, 'single', ('name',)),
+        })
+        self.assertEqual(suggestions[Customer, 'single', ('name',)].count, 2)
+        self.assertEqual(suggestions[Customer, 'composite', ('name', 'age')].index.fields, ['name', 'age'])
+        self.assertEqual(suggestions[Customer, 'expression', ('lower(name)',)].index.expressions,
+                         (functions.Lower('name'),))
+        self.assertIn('composite index on name, age', report(advise(recorder)))
+
+    def test_dump_load(self):
+        recorder = UsageRecorder()
+        self.run_queries(recorder, [{"$filter": "name eq 'a' and age gt 3"}])
+        loaded = UsageRecorder.load(json.loads(json.dumps(recorder.dump())), model=Customer)
+        self.assertEqual(loaded.stats(), recorder.stats())
+        self.assertEqual(loaded.combinations, recorder.combinations)
+        self.assertEqual(len(advise(loaded)), 3)